@@ -15,10 +15,294 @@ top-level functions to this file.
 """
 from __future__ import annotations
 import csv
-from typing import Any, Dict, List, Optional, Tuple
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, TextIO, \
+    Tuple
 
 from melody import Melody
-from prefix_tree import SimplePrefixTree, CompressedPrefixTree
+from prefix_tree import Autocompleter, SimplePrefixTree, CompressedPrefixTree, \
+    FrozenPrefixTree, PrefixSession, CachedAutocompleter, \
+    ConcurrentAutocompleter, LoggedAutocompleter, InfixIndex
+from sanitize import sanitize_checked, sanitize_lines
+
+# The approximate number of bytes of a text file to sanitize at a time.
+_BATCH_BYTES = 1 << 20
+
+
+def _new_autocompleter(config: Dict[str, Any],
+                       items: List[Tuple[Any, float, List]]) -> Autocompleter:
+    """Return an Autocompleter for the given engine configuration storing
+    <items>, the (value, weight, prefix) triples read from config['file'].
+
+    config['autocompleter'] and config['weight_type'] are described in the
+    engine initializers. If config['top_k'] is given, every node of the
+    prefix tree caches its top_k heaviest values, so that autocomplete with a
+    limit of at most top_k (the common case for short, popular prefixes)
+    does not have to search the tree.
+
+    The tree is built with from_items, which gives the same tree as
+    inserting <items> one by one, but faster.
+
+    If config['concurrent'] is true (and there is no config['index'], whose
+    FrozenPrefixTree is read-only and so already safe to read from many
+    threads), two copies of the tree are built, for a
+    ConcurrentAutocompleter.
+    """
+    tree_class = _tree_class(config)
+    tree = tree_class.from_items(config['weight_type'], items,
+                                 config.get('top_k', 0))
+    if not config.get('concurrent') or 'index' in config:
+        return tree
+    return ConcurrentAutocompleter(
+        tree, tree_class.from_items(config['weight_type'], items,
+                                    config.get('top_k', 0)))
+
+
+def _tree_class(config: Dict[str, Any]) -> type:
+    """Return the prefix tree class named by config['autocompleter']."""
+    if config['autocompleter'] == 'simple':
+        return SimplePrefixTree
+    else:
+        return CompressedPrefixTree
+
+
+def _load_log(config: Dict[str, Any]) -> Optional[Autocompleter]:
+    """Return the autocompleter recovered from the log files named after
+    config['log'] (see LoggedAutocompleter.recover), or None if config has no
+    'log' key or nothing has been logged there yet.
+
+    Raise ValueError if config also has an 'index' key, since an index is
+    read-only, or if the log was written with a different weight type.
+    """
+    if 'log' not in config:
+        return None
+    elif 'index' in config:
+        raise ValueError("'log' cannot be used with 'index'")
+    tree = LoggedAutocompleter.recover(config['log'], _tree_class(config))
+    if tree is None:
+        return None
+    elif tree.weight_type != config['weight_type']:
+        raise ValueError(f"{config['log']} was logged with weight type "
+                         f"{tree.weight_type!r}")
+    elif config.get('concurrent'):
+        return ConcurrentAutocompleter(tree, tree.freeze().thaw(type(tree)))
+    return tree
+
+
+def _add_log(config: Dict[str, Any],
+             autocompleter: Autocompleter) -> Autocompleter:
+    """Return the autocompleter the engine should use for <autocompleter>.
+
+    If config['log'] is given, this is a LoggedAutocompleter logging the
+    changes to <autocompleter> in the files named after it, flushing the log
+    every config['log_interval'] seconds (1 by default).
+    """
+    if 'log' not in config:
+        return autocompleter
+    return LoggedAutocompleter(autocompleter, config['log'],
+                               config.get('log_interval', 1.0))
+
+
+def _load_index(config: Dict[str, Any]) -> Optional[Autocompleter]:
+    """Return the autocompleter stored in the index file config['index'], or
+    None if config has no 'index' key or the file does not exist yet.
+
+    Raise ValueError if the index was built with a different weight type.
+    """
+    if 'index' not in config or not os.path.exists(config['index']):
+        return None
+    autocompleter = FrozenPrefixTree.load(config['index'])
+    if autocompleter.weight_type != config['weight_type']:
+        raise ValueError(f"{config['index']} was built with weight type "
+                         f"{autocompleter.weight_type!r}")
+    return autocompleter
+
+
+def _save_index(config: Dict[str, Any],
+                autocompleter: Autocompleter) -> Autocompleter:
+    """Return the autocompleter the engine should use after building
+    <autocompleter> from config['file'].
+
+    If config has an 'index' key, <autocompleter> is frozen and saved to that
+    index file, and the index is opened in its place, so that the engine
+    behaves the same whether or not the index already existed.
+    """
+    if 'index' not in config:
+        return autocompleter
+    autocompleter.freeze().save(config['index'])
+    return FrozenPrefixTree.load(config['index'])
+
+
+def _add_cache(config: Dict[str, Any],
+               autocompleter: Autocompleter) -> Autocompleter:
+    """Return the autocompleter the engine should use for <autocompleter>.
+
+    If config['cache_size'] is given, this is a CachedAutocompleter caching
+    that many autocomplete results, each for at most config['cache_ttl']
+    seconds if that is given.
+
+    Raise ValueError if config['concurrent'] is also true, since a
+    CachedAutocompleter changes its cache on every read and so is not safe to
+    use from many threads.
+    """
+    if not config.get('cache_size'):
+        return autocompleter
+    elif config.get('concurrent'):
+        raise ValueError("'cache_size' cannot be used with 'concurrent'")
+    return CachedAutocompleter(autocompleter, config['cache_size'],
+                               config.get('cache_ttl'))
+
+
+def _add_infix(config: Dict[str, Any],
+               autocompleter: Autocompleter) -> Autocompleter:
+    """Return <autocompleter> with an InfixIndex over the words of its
+    sentences if config['infix'] is true, and <autocompleter> itself
+    otherwise.
+
+    Raise ValueError if config['concurrent'] is also true, since the
+    secondary tree of an InfixIndex has only one copy, which inserts and
+    removes would change under readers.
+    """
+    if not config.get('infix'):
+        return autocompleter
+    elif config.get('concurrent'):
+        raise ValueError("'infix' cannot be used with 'concurrent'")
+    return InfixIndex(autocompleter, str.split, _tree_class(config))
+
+
+################################################################################
+# Reading input files
+################################################################################
+def _parse_letters(f: TextIO) -> List[Tuple[str, float, List[str]]]:
+    """Return the (value, weight, prefix) triples LetterAutocompleteEngine
+    stores for the lines of the text file <f>.
+    """
+    items = []
+    lines = f.readlines(_BATCH_BYTES)
+    while lines:
+        for sanitized in sanitize_lines(lines):
+            lst = [char for char in sanitized]
+            items.append((sanitized, 1.0, lst))
+        lines = f.readlines(_BATCH_BYTES)
+    return items
+
+
+def _parse_sentences(f: TextIO) -> List[Tuple[str, float, List[str]]]:
+    """Return the (value, weight, prefix) triples SentenceAutocompleteEngine
+    stores for the lines of the CSV file <f>.
+    """
+    items = []
+    reader = csv.reader(f)
+    for line in reader:
+        string = line[0]
+        weight = float(line[1])
+        sanitized = sanitize_checked(string)
+        if sanitized is not None:
+            prefix_seq = sanitized.split()
+            items.append((sanitized, weight, prefix_seq))
+    return items
+
+
+def _parse_melodies(f: TextIO) -> List[Tuple[Melody, float, List[int]]]:
+    """Return the (value, weight, prefix) triples MelodyAutocompleteEngine
+    stores for the lines of the CSV file <f>.
+    """
+    items = []
+    reader = csv.reader(f)
+    for line in reader:
+        if any([s == "" for s in line]):
+            continue
+        notes = []
+        interval = []
+        name = line[0]
+        linelist = [x for x in line]
+        linelist = linelist[1:]
+        pitch = linelist[::2]
+        duration = linelist[1::2]
+        i = 0
+        while i < len(pitch):
+            notes.append((int(pitch[i]), int(duration[i])))
+            i += 1
+        for i in range(1, len(notes)):
+            interval.append(notes[i][0] - notes[i - 1][0])
+        items.append((Melody(name, notes), 1.0, interval))
+    return items
+
+
+def _read_items(config: Dict[str, Any],
+                parse: Callable[[TextIO], List[Tuple[Any, float, List]]],
+                encoding: Optional[str]) -> List[Tuple[Any, float, List]]:
+    """Return the (value, weight, prefix) triples <parse> reads from the
+    file config['file'], opened as text with <encoding>.
+
+    If config['workers'] is more than one, the file is split into that many
+    byte ranges, which are parsed (and their triples merged by _aggregate)
+    by a pool of worker processes. The result stores the same values with
+    the same weights, in the same order of first appearance, so the tree
+    built from it is the same. The ranges are split at line breaks, so a
+    CSV entry must not contain a line break.
+    """
+    workers = config.get('workers', 1)
+    if workers <= 1:
+        with open(config['file'], encoding=encoding) as f:
+            return parse(f)
+
+    size = os.path.getsize(config['file'])
+    starts = [size * i // workers for i in range(workers + 1)]
+    n = len(starts) - 1
+    with ProcessPoolExecutor(workers) as executor:
+        partials = executor.map(_parse_range, [parse] * n,
+                                [config['file']] * n, [encoding] * n,
+                                starts[:-1], starts[1:])
+        items = []
+        for partial in partials:
+            items.extend(partial)
+    return items
+
+
+def _parse_range(parse: Callable[[TextIO], List[Tuple[Any, float, List]]],
+                 path: str, encoding: Optional[str], start: int,
+                 end: int) -> List[Tuple[Any, float, List]]:
+    """Return _aggregate of the triples <parse> reads from the lines of the
+    file <path> that start at a byte offset in [start, end).
+    """
+    with open(path, 'rb') as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+        if f.tell() >= end:
+            return []
+        data = f.read(end - f.tell())
+        if not data.endswith(b'\n'):
+            data += f.readline()
+    with io.TextIOWrapper(io.BytesIO(data), encoding=encoding) as text:
+        return _aggregate(parse(text))
+
+
+def _aggregate(items: List[Tuple[Any, float, List]]) \
+        -> List[Tuple[Any, float, List]]:
+    """Return <items> with the weight of each repeated value added to the
+    triple where it first appears, and the repeats removed.
+
+    Unhashable values are kept as they are.
+    """
+    merged = []
+    positions = {}
+    for value, weight, prefix in items:
+        try:
+            i = positions.get(value)
+        except TypeError:
+            merged.append((value, weight, prefix))
+            continue
+        if i is None:
+            positions[value] = len(merged)
+            merged.append((value, weight, prefix))
+        else:
+            first, total, first_prefix = merged[i]
+            merged[i] = (first, total + weight, first_prefix)
+    return merged
 
 
 ################################################################################
@@ -48,6 +332,32 @@ class LetterAutocompleteEngine:
               specifying which subclass of Autocompleter to use.
             - 'weight_type': either 'sum' or 'average', which specifies the
               weight type for the prefix tree.
+            - 'top_k' (optional): the number of best matches to cache at
+              every node of the prefix tree (see _new_autocompleter).
+            - 'workers' (optional): the number of processes that read 'file'
+              (see _read_items). The default is 1.
+            - 'index' (optional): the path to an index file. If it exists,
+              the autocompleter is memory-mapped from it and 'file' is not
+              read; otherwise it is built from 'file' and saved there. With
+              an index the autocompleter is a read-only FrozenPrefixTree,
+              so remove is not supported. Delete the index file to rebuild
+              it after 'file' changes.
+            - 'cache_size' (optional): the number of autocomplete results
+              to cache, in a CachedAutocompleter in front of the prefix tree.
+              The default is no cache.
+            - 'cache_ttl' (optional): the number of seconds a cached result
+              is used for. The default is until it is evicted or changed.
+            - 'concurrent' (optional): if true, the autocompleter is a
+              ConcurrentAutocompleter, which can be read from many threads
+              while another thread inserts or removes values. This uses
+              twice the memory, and cannot be combined with 'cache_size'.
+            - 'log' (optional): the path to name write-ahead log files
+              after (see LoggedAutocompleter). If they exist, the
+              autocompleter is recovered from them and 'file' is not read;
+              otherwise it is built from 'file' and a first snapshot is
+              saved. Cannot be combined with 'index'.
+            - 'log_interval' (optional): the number of seconds between
+              flushes of the log. The default is 1.
 
         Each line of the specified file counts as one input string.
         Note that the line may or may not contain spaces.
@@ -62,32 +372,15 @@ class LetterAutocompleteEngine:
         one line of the input file; this would result in that string getting
         a larger weight (because of how Autocompleter.insert works).
         """
-        # We've opened the file for you here. You should iterate over the
-        # lines of the file and process them according to the description in
-        # this method's docstring.
-
-        if config['autocompleter'] == 'simple':
-            self.autocompleter = SimplePrefixTree(config['weight_type'])
-        else:
-            self.autocompleter = CompressedPrefixTree(config['weight_type'])
-
-        with open(config['file'], encoding='utf8') as f:
-            for line in f:
-                if any([s.isalnum() for s in line]):
-                    sanitized = self._sanitize(line)
-                    if not sanitized == "":
-                        lst = [char for char in sanitized]
-                        self.autocompleter.insert(sanitized, 1.0, lst)
-
-    @staticmethod
-    def _sanitize(string: str) -> str:
-        """Return a sanitized version of the string."""
-        new_string = ""
-        for char in string:
-            if char.isalnum() or char == " ":
-                new_string += char
-
-        return new_string.lower().strip('\n')
+        autocompleter = _load_log(config)
+        if autocompleter is None:
+            autocompleter = _load_index(config)
+        if autocompleter is None:
+            items = _read_items(config, _parse_letters, 'utf8')
+            autocompleter = _save_index(config,
+                                        _new_autocompleter(config, items))
+        self.autocompleter = _add_cache(config,
+                                        _add_log(config, autocompleter))
 
     def autocomplete(self, prefix: str,
                      limit: Optional[int] = None) -> List[Tuple[str, float]]:
@@ -108,6 +401,82 @@ class LetterAutocompleteEngine:
         prefix_lst = [c for c in prefix]
         return self.autocompleter.autocomplete(prefix_lst, limit)
 
+    def autocomplete_many(self, prefixes: List[str],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[str, float]]]:
+        """Return the list autocomplete(prefix, limit) returns for each
+        prefix string in <prefixes>, in order.
+
+        The prefixes are looked up together (see
+        Autocompleter.autocomplete_many), which is faster than calling
+        autocomplete on each one when they overlap.
+
+        Preconditions:
+            limit is None or limit > 0
+            each prefix contains only lowercase alphanumeric characters and
+            spaces
+        """
+        prefix_lsts = [[c for c in prefix] for prefix in prefixes]
+        return self.autocompleter.autocomplete_many(prefix_lsts, limit)
+
+    def iter_autocomplete(self, prefix: str) -> Iterator[Tuple[str, float]]:
+        """Yield the matches for the given prefix string, as tuples
+        (string, weight), in the order autocomplete(prefix) returns them.
+
+        Matches are found as they are asked for (see
+        Autocompleter.iter_autocomplete), so results can be paged through
+        without building the full list.
+
+        Precondition:
+            <prefix> contains only lowercase alphanumeric characters and spaces
+        """
+        prefix_lst = [c for c in prefix]
+        return self.autocompleter.iter_autocomplete(prefix_lst)
+
+    def fuzzy_autocomplete(self, prefix: str, distance: int = 1,
+                           limit: Optional[int] = None,
+                           penalty: float = 0.1) -> List[Tuple[str, float]]:
+        """Return up to <limit> matches for the strings starting with a
+        string at most <distance> typos away from the given prefix string.
+
+        A typo is a letter inserted, deleted or replaced. Matches are ranked
+        by their weight times penalty ** (the number of typos), so a
+        mistyped prefix still finds its strings, while the strings that
+        match it as typed come first unless they are much lighter (see
+        Autocompleter.fuzzy_autocomplete).
+
+        Preconditions:
+            distance >= 0
+            0 < penalty <= 1
+            limit is None or limit > 0
+            <prefix> contains only lowercase alphanumeric characters and spaces
+        """
+        prefix_lst = [c for c in prefix]
+        return self.autocompleter.fuzzy_autocomplete(prefix_lst, distance,
+                                                     limit, penalty)
+
+    def session(self, prefix: str = '') -> PrefixSession:
+        """Return a session for typing a prefix string one letter at a time,
+        starting from <prefix>.
+
+        Push each letter as it is typed and pop it on backspace; each takes
+        one step in the prefix tree instead of walking the prefix again. For
+        example, after session.push('f') and session.push('r'),
+        session.autocomplete(limit) is autocomplete('fr', limit).
+
+        Raise ValueError if this engine was configured with 'concurrent',
+        since a session walks one copy of the tree, which a writer may change.
+
+        Precondition:
+            <prefix> contains only lowercase alphanumeric characters and spaces
+        """
+        tree = self.autocompleter
+        while isinstance(tree, (CachedAutocompleter, LoggedAutocompleter)):
+            tree = tree.autocompleter
+        if isinstance(tree, ConcurrentAutocompleter):
+            raise ValueError("sessions cannot be used with 'concurrent'")
+        return PrefixSession(tree, [c for c in prefix])
+
     def remove(self, prefix: str) -> None:
         """Remove all strings that match the given prefix string.
 
@@ -146,6 +515,38 @@ class SentenceAutocompleteEngine:
               specifying which subclass of Autocompleter to use.
             - 'weight_type': either 'sum' or 'average', which specifies the
               weight type for the prefix tree.
+            - 'top_k' (optional): the number of best matches to cache at
+              every node of the prefix tree (see _new_autocompleter).
+            - 'workers' (optional): the number of processes that read 'file'
+              (see _read_items). The default is 1.
+            - 'index' (optional): the path to an index file. If it exists,
+              the autocompleter is memory-mapped from it and 'file' is not
+              read; otherwise it is built from 'file' and saved there. With
+              an index the autocompleter is a read-only FrozenPrefixTree,
+              so remove is not supported. Delete the index file to rebuild
+              it after 'file' changes.
+            - 'cache_size' (optional): the number of autocomplete results
+              to cache, in a CachedAutocompleter in front of the prefix tree.
+              The default is no cache.
+            - 'cache_ttl' (optional): the number of seconds a cached result
+              is used for. The default is until it is evicted or changed.
+            - 'concurrent' (optional): if true, the autocompleter is a
+              ConcurrentAutocompleter, which can be read from many threads
+              while another thread inserts or removes values. This uses
+              twice the memory, and cannot be combined with 'cache_size'.
+            - 'log' (optional): the path to name write-ahead log files
+              after (see LoggedAutocompleter). If they exist, the
+              autocompleter is recovered from them and 'file' is not read;
+              otherwise it is built from 'file' and a first snapshot is
+              saved. Cannot be combined with 'index'.
+            - 'log_interval' (optional): the number of seconds between
+              flushes of the log. The default is 1.
+            - 'infix' (optional): if true, the autocompleter is an
+              InfixIndex, so that infix_autocomplete can match from any
+              word of a string. Its secondary tree is built from the
+              autocompleter's strings on every start, and takes about 2 to
+              2.5 times as much memory as the autocompleter itself. Cannot
+              be combined with 'concurrent'.
 
         Precondition:
         The given file is a *CSV file* where each line has two entries:
@@ -165,34 +566,15 @@ class SentenceAutocompleteEngine:
         one line of the input file; this would result in that string getting
         a larger weight.
         """
-        # We haven't given you any starter code here! You should review how
-        # you processed CSV files on Assignment 1.
-
-        if config['autocompleter'] == 'simple':
-            self.autocompleter = SimplePrefixTree(config['weight_type'])
-        else:
-            self.autocompleter = CompressedPrefixTree(config['weight_type'])
-
-        with open(config['file']) as csvfile:
-            reader = csv.reader(csvfile)
-            for line in reader:
-                string = line[0]
-                weight = float(line[1])
-                if any([s.isalnum() for s in string]):
-                    sanitized = self._sanitize(string)
-                    if not sanitized == "":
-                        prefix_seq = sanitized.split()
-                        self.autocompleter.insert(sanitized, weight, prefix_seq)
-
-    @staticmethod
-    def _sanitize(string: str) -> str:
-        """Return a sanitized version of the string."""
-        new_string = ""
-        for char in string:
-            if char.isalnum() or char == " ":
-                new_string += char
-
-        return new_string.lower().strip('\n')
+        autocompleter = _load_log(config)
+        if autocompleter is None:
+            autocompleter = _load_index(config)
+        if autocompleter is None:
+            items = _read_items(config, _parse_sentences, None)
+            autocompleter = _save_index(config,
+                                        _new_autocompleter(config, items))
+        self.autocompleter = _add_cache(
+            config, _add_infix(config, _add_log(config, autocompleter)))
 
     def autocomplete(self, prefix: str,
                      limit: Optional[int] = None) -> List[Tuple[str, float]]:
@@ -213,6 +595,61 @@ class SentenceAutocompleteEngine:
         prefix_seq = prefix.split()
         return self.autocompleter.autocomplete(prefix_seq, limit)
 
+    def autocomplete_many(self, prefixes: List[str],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[str, float]]]:
+        """Return the list autocomplete(prefix, limit) returns for each
+        prefix string in <prefixes>, in order.
+
+        The prefixes are looked up together (see
+        Autocompleter.autocomplete_many), which is faster than calling
+        autocomplete on each one when they overlap.
+
+        Preconditions:
+            limit is None or limit > 0
+            each prefix contains only lowercase alphanumeric characters and
+            spaces
+        """
+        prefix_seqs = [prefix.split() for prefix in prefixes]
+        return self.autocompleter.autocomplete_many(prefix_seqs, limit)
+
+    def iter_autocomplete(self, prefix: str) -> Iterator[Tuple[str, float]]:
+        """Yield the matches for the given prefix string, as tuples
+        (string, weight), in the order autocomplete(prefix) returns them.
+
+        Matches are found as they are asked for (see
+        Autocompleter.iter_autocomplete), so results can be paged through
+        without building the full list.
+
+        Precondition:
+            <prefix> contains only lowercase alphanumeric characters and spaces
+        """
+        prefix_seq = prefix.split()
+        return self.autocompleter.iter_autocomplete(prefix_seq)
+
+    def infix_autocomplete(self, prefix: str,
+                           limit: Optional[int] = None) \
+            -> List[Tuple[str, float]]:
+        """Return up to <limit> matches for the strings containing the words
+        of the given prefix string starting at any of their words, so
+        infix_autocomplete('to cook') matches 'how to cook rice'.
+
+        The return value is a list of tuples (string, weight), ordered in
+        non-increasing weight, with each string at most once.
+
+        Raise ValueError if this engine was not configured with 'infix'.
+
+        Preconditions:
+            limit is None or limit > 0
+            <prefix> contains only lowercase alphanumeric characters and spaces
+        """
+        index = self.autocompleter
+        if isinstance(index, CachedAutocompleter):
+            index = index.autocompleter
+        if not isinstance(index, InfixIndex):
+            raise ValueError("infix_autocomplete needs 'infix'")
+        return index.infix_autocomplete(prefix.split(), limit)
+
     def remove(self, prefix: str) -> None:
         """Remove all strings that match the given prefix.
 
@@ -225,6 +662,19 @@ class SentenceAutocompleteEngine:
         prefix_seq = prefix.split()
         return self.autocompleter.remove(prefix_seq)
 
+    def decay(self, factor: float) -> None:
+        """Multiply the weight of every string by <factor>, so that the
+        counts of old queries fade relative to new ones.
+
+        This takes constant time (see SimplePrefixTree.decay), and does not
+        change the order of the matches of any prefix. For weights with a
+        half-life of n decays, use factor 0.5 ** (1 / n). Not supported with
+        'index', since the autocompleter is then read-only.
+
+        Precondition: factor > 0
+        """
+        self.autocompleter.decay(factor)
+
 
 ################################################################################
 # Melody-based Autocomplete Engines (Task 5)
@@ -253,6 +703,32 @@ class MelodyAutocompleteEngine:
               specifying which subclass of Autocompleter to use.
             - 'weight_type': either 'sum' or 'average', which specifies the
               weight type for the prefix tree.
+            - 'top_k' (optional): the number of best matches to cache at
+              every node of the prefix tree (see _new_autocompleter).
+            - 'workers' (optional): the number of processes that read 'file'
+              (see _read_items). The default is 1.
+            - 'index' (optional): the path to an index file. If it exists,
+              the autocompleter is memory-mapped from it and 'file' is not
+              read; otherwise it is built from 'file' and saved there. With
+              an index the autocompleter is a read-only FrozenPrefixTree,
+              so remove is not supported. Delete the index file to rebuild
+              it after 'file' changes.
+            - 'cache_size' (optional): the number of autocomplete results
+              to cache, in a CachedAutocompleter in front of the prefix tree.
+              The default is no cache.
+            - 'cache_ttl' (optional): the number of seconds a cached result
+              is used for. The default is until it is evicted or changed.
+            - 'concurrent' (optional): if true, the autocompleter is a
+              ConcurrentAutocompleter, which can be read from many threads
+              while another thread inserts or removes values. This uses
+              twice the memory, and cannot be combined with 'cache_size'.
+            - 'log' (optional): the path to name write-ahead log files
+              after (see LoggedAutocompleter). If they exist, the
+              autocompleter is recovered from them and 'file' is not read;
+              otherwise it is built from 'file' and a first snapshot is
+              saved. Cannot be combined with 'index'.
+            - 'log_interval' (optional): the number of seconds between
+              flushes of the log. The default is 1.
 
         Precondition:
         The given file is a *CSV file* where each line has the following format:
@@ -267,32 +743,15 @@ class MelodyAutocompleteEngine:
 
         Each melody is be inserted into the Autocompleter with a weight of 1.
         """
-        # We haven't given you any starter code here! You should review how
-        # you processed CSV files on Assignment 1.
-        if config['autocompleter'] == 'simple':
-            self.autocompleter = SimplePrefixTree(config['weight_type'])
-        else:
-            self.autocompleter = CompressedPrefixTree(config['weight_type'])
-
-        with open(config['file']) as csvfile:
-            reader = csv.reader(csvfile)
-            for line in reader:
-                if any([s == "" for s in line]):
-                    continue
-                notes = []
-                interval = []
-                name = line[0]
-                linelist = [x for x in line]
-                linelist = linelist[1:]
-                pitch = linelist[::2]
-                duration = linelist[1::2]
-                i = 0
-                while i < len(pitch):
-                    notes.append((int(pitch[i]), int(duration[i])))
-                    i += 1
-                for i in range(1, len(notes)):
-                    interval.append(notes[i][0] - notes[i - 1][0])
-                self.autocompleter.insert(Melody(name, notes), 1.0, interval)
+        autocompleter = _load_log(config)
+        if autocompleter is None:
+            autocompleter = _load_index(config)
+        if autocompleter is None:
+            items = _read_items(config, _parse_melodies, None)
+            autocompleter = _save_index(config,
+                                        _new_autocompleter(config, items))
+        self.autocompleter = _add_cache(config,
+                                        _add_log(config, autocompleter))
 
     def autocomplete(self, prefix: List[int],
                      limit: Optional[int] = None) -> List[Tuple[Melody, float]]:
@@ -308,6 +767,55 @@ class MelodyAutocompleteEngine:
         """
         return self.autocompleter.autocomplete(prefix, limit)
 
+    def autocomplete_many(self, prefixes: List[List[int]],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[Melody, float]]]:
+        """Return the list autocomplete(prefix, limit) returns for each
+        interval sequence in <prefixes>, in order.
+
+        The prefixes are looked up together (see
+        Autocompleter.autocomplete_many), which is faster than calling
+        autocomplete on each one when they overlap.
+
+        Precondition:
+            limit is None or limit > 0
+        """
+        return self.autocompleter.autocomplete_many(prefixes, limit)
+
+    def iter_autocomplete(self, prefix: List[int]) \
+            -> Iterator[Tuple[Melody, float]]:
+        """Yield the matches for the given interval sequence, as tuples
+        (melody, weight), in the order autocomplete(prefix) returns them.
+
+        Matches are found as they are asked for (see
+        Autocompleter.iter_autocomplete), so results can be paged through
+        without building the full list.
+        """
+        return self.autocompleter.iter_autocomplete(prefix)
+
+    def approximate_autocomplete(self, prefix: List[int], tolerance: int = 1,
+                                 mismatches: int = 0,
+                                 limit: Optional[int] = None,
+                                 penalty: float = 0.1) \
+            -> List[Tuple[Melody, float]]:
+        """Return up to <limit> matches for interval sequences close to the
+        given one, such as one hummed slightly out of tune.
+
+        Each interval of a match is within <tolerance> semitones of the
+        interval of <prefix> in the same position, except for at most
+        <mismatches> intervals, which can be anything. Matches are ranked by
+        their weight times penalty ** (their number of mismatched
+        intervals) (see Autocompleter.approximate_autocomplete). Since
+        intervals don't depend on the starting pitch, neither do matches.
+
+        Precondition:
+            tolerance >= 0 and mismatches >= 0
+            0 < penalty <= 1
+            limit is None or limit > 0
+        """
+        return self.autocompleter.approximate_autocomplete(
+            prefix, tolerance, mismatches, limit, penalty)
+
     def remove(self, prefix: List[int]) -> None:
         """Remove all melodies that match the given interval sequence.
         """
@@ -362,12 +870,6 @@ if __name__ == '__main__':
     #     'extra-imports': ['csv', 'prefix_tree', 'melody']
     # })
 
-    # This is used to increase the recursion limit so that your sample runs
-    # work even for fairly tall simple prefix trees.
-    import sys
-
-    sys.setrecursionlimit(5000)
-
     # print(sample_letter_autocomplete())
     # print(sample_sentence_autocomplete())
     sample_melody_autocomplete()
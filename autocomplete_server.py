@@ -0,0 +1,243 @@
+"""CSC148 Assignment 2: Autocomplete server
+
+=== Module Description ===
+This file contains an asyncio server that answers autocomplete queries for
+one of the engines in autocomplete_engines.py over TCP, using a line
+protocol. Each request is a line holding a JSON object such as
+
+    {"prefix": "how to", "limit": 10}
+
+(for a MelodyAutocompleteEngine, "prefix" is a list of intervals, and
+"limit" may be left out or null to get every match). Each response is a line
+holding either {"results": [[value, weight], ...]} or {"error": message}.
+Responses are sent in the order of the requests, so clients may send several
+requests without waiting for the responses.
+
+Identical queries that arrive while one is being answered share its answer
+instead of searching the tree again. Queries for every match (or for more
+than inline_limit matches) run in a thread pool, so that they don't hold up
+the event loop. A connection stops being read while max_pending of its
+requests are unanswered, and while its responses have not been sent (so a
+client that sends requests faster than it reads responses is slowed down,
+rather than queueing unbounded work in the server).
+
+The engine must be safe to read from two threads at once, so it must not be
+configured with 'cache_size'. The server only reads from the engine.
+"""
+from __future__ import annotations
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from autocomplete_engines import SentenceAutocompleteEngine
+from melody import Melody
+from prefix_tree import CachedAutocompleter
+
+
+class AutocompleteServer:
+    """A server answering autocomplete queries for an engine.
+
+    === Attributes ===
+    engine:
+        The autocomplete engine queries are answered by.
+    max_pending:
+        The maximum number of unanswered requests of one connection.
+    inline_limit:
+        Queries with a limit of at most this are answered on the event loop
+        thread; others are answered in the thread pool.
+    queries:
+        The number of queries the engine has answered.
+    coalesced:
+        The number of queries answered by sharing the answer to an identical
+        query that was already in progress.
+
+    === Private Attributes ===
+    _executor:
+        The thread pool for queries with a large or no limit.
+    _in_flight:
+        Maps (prefix, limit), with the prefix made hashable by _query_key,
+        to the task answering that query, for the queries in progress.
+    _connections:
+        The tasks handling the open connections.
+
+    === Representation invariants ===
+    - max_pending > 0
+    """
+    engine: Any
+    max_pending: int
+    inline_limit: int
+    queries: int
+    coalesced: int
+    _executor: ThreadPoolExecutor
+    _in_flight: Dict[Tuple[Any, Optional[int]], asyncio.Task]
+    _connections: Set[asyncio.Task]
+
+    def __init__(self, engine: Any, max_pending: int = 64,
+                 inline_limit: int = 100, workers: int = 4) -> None:
+        """Initialize a server for <engine>, answering large queries with a
+        pool of <workers> threads.
+
+        Raise ValueError if <engine> caches its results, since the cache is
+        not safe to read from many threads.
+
+        Preconditions:
+            <engine> is a LetterAutocompleteEngine, SentenceAutocompleteEngine
+            or MelodyAutocompleteEngine.
+            max_pending > 0 and workers > 0
+        """
+        if isinstance(engine.autocompleter, CachedAutocompleter):
+            raise ValueError('the engine cannot be served with a cache')
+        self.engine = engine
+        self.max_pending = max_pending
+        self.inline_limit = inline_limit
+        self.queries = 0
+        self.coalesced = 0
+        self._executor = ThreadPoolExecutor(workers)
+        self._in_flight = {}
+        self._connections = set()
+
+    async def serve(self, host: str = 'localhost',
+                    port: int = 8148) -> asyncio.AbstractServer:
+        """Start serving connections on <host> and <port>, and return the
+        asyncio server doing so.
+        """
+        return await asyncio.start_server(self._handle, host, port)
+
+    async def wait_closed(self) -> None:
+        """Wait until the clients have closed every open connection."""
+        while self._connections:
+            await asyncio.wait(list(self._connections))
+
+    def close(self) -> None:
+        """Shut down the thread pool, once the server is no longer used."""
+        self._executor.shutdown()
+
+    async def autocomplete(self, prefix: Any,
+                           limit: Optional[int] = None) \
+            -> List[Tuple[Any, float]]:
+        """Return engine.autocomplete(prefix, limit), sharing the answer with
+        any identical query already in progress.
+
+        Precondition: limit is None or limit > 0.
+        """
+        key = (_query_key(prefix), limit)
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._answer(prefix, limit))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key))
+        else:
+            self.coalesced += 1
+        # A client that goes away must not cancel the answer for the others.
+        return await asyncio.shield(task)
+
+    async def _answer(self, prefix: Any,
+                      limit: Optional[int]) -> List[Tuple[Any, float]]:
+        """Return engine.autocomplete(prefix, limit), computed on the event
+        loop thread if <limit> is small, and in the thread pool otherwise.
+        """
+        self.queries += 1
+        if limit is not None and limit <= self.inline_limit:
+            return self.engine.autocomplete(prefix, limit)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor,
+                                          self.engine.autocomplete,
+                                          prefix, limit)
+
+    async def _handle(self, reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter) -> None:
+        """Answer the requests of one connection until the client closes it.
+
+        Each request is answered in its own task. The tasks wait in a queue
+        of at most max_pending, which a second coroutine empties in order,
+        sending each response once it is ready.
+        """
+        connection = asyncio.current_task()
+        self._connections.add(connection)
+        pending = asyncio.Queue(self.max_pending)
+        sender = asyncio.ensure_future(self._send(pending, writer))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                # Waits (without reading more requests) while the queue is
+                # full.
+                await pending.put(asyncio.ensure_future(self._respond(line)))
+            await pending.put(None)
+            await sender
+        finally:
+            # If the connection failed, the remaining responses are dropped.
+            sender.cancel()
+            writer.close()
+            self._connections.discard(connection)
+
+    async def _send(self, pending: asyncio.Queue,
+                    writer: asyncio.StreamWriter) -> None:
+        """Send the response of each task in <pending>, in order, until a
+        None is taken from it.
+        """
+        while True:
+            task = await pending.get()
+            if task is None:
+                return
+            writer.write(await task)
+            # Waits while the client is not reading its responses.
+            await writer.drain()
+
+    async def _respond(self, line: bytes) -> bytes:
+        """Return the response line for the request line <line>."""
+        try:
+            request = json.loads(line)
+            prefix = request['prefix']
+            limit = request.get('limit')
+            # bool is a subclass of int, but true is not a limit.
+            if limit is not None and (not isinstance(limit, int) or
+                                      isinstance(limit, bool) or limit <= 0):
+                raise ValueError(f'limit must be a positive integer or null, '
+                                 f'not {limit!r}')
+            results = await self.autocomplete(prefix, limit)
+            response = {'results': [[_json_value(value), weight]
+                                    for value, weight in results]}
+        except Exception as error:
+            # Any error must become a response: if it escaped, the sender
+            # would stop, and the connection would hang once max_pending
+            # requests were queued.
+            response = {'error': f'{type(error).__name__}: {error}'}
+        return json.dumps(response).encode() + b'\n'
+
+
+def _query_key(prefix: Any) -> Any:
+    """Return a hashable version of <prefix>: the string itself, or a tuple
+    of the elements of a list.
+    """
+    if isinstance(prefix, list):
+        return tuple(prefix)
+    return prefix
+
+
+def _json_value(value: Any) -> Any:
+    """Return the form of the autocompleted <value> sent to clients: the
+    name of a Melody, or <value> itself.
+    """
+    if isinstance(value, Melody):
+        return value.name
+    return value
+
+
+async def sample_server() -> None:
+    """A sample run of the server, for a sentence autocomplete engine."""
+    server = AutocompleteServer(SentenceAutocompleteEngine({
+        'file': 'data/google_searches.csv',
+        'autocompleter': 'compressed',
+        'weight_type': 'sum',
+        'top_k': 20
+    }))
+    listener = await server.serve()
+    async with listener:
+        await listener.serve_forever()
+
+
+if __name__ == '__main__':
+    asyncio.run(sample_server())
@@ -0,0 +1,951 @@
+"""CSC148 Assignment 2: Autocompleter benchmarks
+
+=== Module Description ===
+This file contains timing harnesses for the prefix trees in prefix_tree.py.
+Each benchmark builds trees from one of the data files used by the sample
+runs in autocomplete_engines.py, checks that the optimized code returns the
+same results as the behaviour it replaces, and prints the timings.
+
+Run this file directly to run every benchmark.
+"""
+from __future__ import annotations
+import asyncio
+import csv
+import gc
+import json
+import itertools
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, List, Optional, Tuple, Type
+
+from autocomplete_engines import LetterAutocompleteEngine, \
+    SentenceAutocompleteEngine, MelodyAutocompleteEngine
+from autocomplete_server import AutocompleteServer
+from prefix_tree import Autocompleter, SimplePrefixTree, CompressedPrefixTree, \
+    PrefixSession, ConcurrentAutocompleter, InfixIndex
+from sanitize import sanitize, sanitize_checked, sanitize_lines
+
+
+def load_letter_items(file: str) -> List[Tuple[str, float, List[str]]]:
+    """Return the (value, weight, prefix) triples that LetterAutocompleteEngine
+    would insert for the text file <file>.
+    """
+    with open(file, encoding='utf8') as f:
+        return [(sanitized, 1.0, list(sanitized))
+                for sanitized in sanitize_lines(f.readlines())]
+
+
+def time_call(func: Callable[[], Any]) -> Tuple[Any, float]:
+    """Return the result of calling <func> and the seconds it took."""
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def build_tree(items: List[Tuple[Any, float, List]],
+               weight_type: str, top_k: int = 0,
+               tree_class: Type[SimplePrefixTree] = SimplePrefixTree) \
+        -> SimplePrefixTree:
+    """Return a <tree_class> with all of <items> inserted one by one."""
+    tree = tree_class(weight_type, top_k)
+    for value, weight, prefix in items:
+        tree.insert(value, weight, prefix)
+    return tree
+
+
+def _old_sanitize(string: str) -> str:
+    """Return a sanitized version of the string, one character at a time, as
+    the engines did before sanitize.py was shared.
+    """
+    new_string = ""
+    for char in string:
+        if char.isalnum() or char == " ":
+            new_string += char
+
+    return new_string.lower().strip('\n')
+
+
+def _old_sanitize_lines(lines: List[str]) -> List[str]:
+    """Return the sanitized lines LetterAutocompleteEngine inserted before
+    sanitize.py was shared.
+    """
+    sanitized = []
+    for line in lines:
+        if any([s.isalnum() for s in line]):
+            new = _old_sanitize(line)
+            if not new == "":
+                sanitized.append(new)
+    return sanitized
+
+
+def bench_sanitize(file: str = 'data/lotr.txt') -> None:
+    """Compare the throughput of the shared sanitizer, line by line and in
+    one batch, against the sanitizing the engines used to do, and check that
+    they give the same results (including on non-ASCII text).
+    """
+    with open(file, encoding='utf8') as f:
+        lines = f.readlines()
+    unicode = ['Éowyn ÉOWYN\n', '   \n', '\t\n', 'İstanbul ǅ ß ﬁ ²³ ⅷ\n',
+               'naïve café, über-cool!\n', '٣ 日本語 テキスト\n', '']
+    for batch in [unicode, lines[:1000] + unicode]:
+        assert sanitize_lines(batch) == _old_sanitize_lines(batch)
+        for line in batch:
+            assert sanitize(line) == _old_sanitize(line)
+    old, old_seconds = time_call(lambda: _old_sanitize_lines(lines))
+    checked, checked_seconds = time_call(
+        lambda: [x for x in map(sanitize_checked, lines) if x is not None])
+    batch, batch_seconds = time_call(lambda: sanitize_lines(lines))
+    assert old == checked == batch
+    print(f'sanitize {len(lines)} lines: old '
+          f'{len(lines) / old_seconds:,.0f} lines/s, sanitize_checked '
+          f'{len(lines) / checked_seconds:,.0f} lines/s, sanitize_lines '
+          f'{len(lines) / batch_seconds:,.0f} lines/s '
+          f'({old_seconds / batch_seconds:.0f}x)')
+
+
+def _resort_subtrees(self: SimplePrefixTree, _: SimplePrefixTree) -> None:
+    """Fully re-sort self.subtrees, as insert did before incremental
+    repositioning was added.
+    """
+    asc = sorted(self.subtrees, key=lambda x: x.weight)
+    asc.reverse()
+    self._subtrees = asc
+
+
+def bench_subtree_ordering(file: str = 'data/lotr.txt') -> None:
+    """Compare building a tree with incremental subtree repositioning against
+    re-sorting every subtree list on the insertion path.
+    """
+    items = load_letter_items(file)
+    for weight_type in ['sum', 'average']:
+        tree, incremental = time_call(lambda: build_tree(items, weight_type))
+        reposition = SimplePrefixTree._reposition
+        SimplePrefixTree._reposition = _resort_subtrees
+        try:
+            old_tree, resort = time_call(lambda: build_tree(items,
+                                                            weight_type))
+        finally:
+            SimplePrefixTree._reposition = reposition
+
+        for prefix in [[], ['a'], ['t', 'h'], ['f', 'r', 'o']]:
+            new = tree.autocomplete(prefix)
+            old = old_tree.autocomplete(prefix)
+            assert [w for _, w in new] == [w for _, w in old]
+            assert sorted(new) == sorted(old)
+
+        print(f'subtree ordering ({weight_type}, {len(items)} inserts): '
+              f'full re-sort {resort:.2f}s, incremental {incremental:.2f}s '
+              f'({resort / incremental:.1f}x)')
+
+
+def bench_from_items(file: str = 'data/lotr.txt') -> None:
+    """Compare building each prefix tree with from_items against inserting
+    the values one by one, and check that the trees are the same.
+    """
+    items = load_letter_items(file)
+    for tree_class in [SimplePrefixTree, CompressedPrefixTree]:
+        for weight_type in ['sum', 'average']:
+            tree, incremental = time_call(
+                lambda: build_tree(items, weight_type, tree_class=tree_class))
+            bulk, seconds = time_call(
+                lambda: tree_class.from_items(weight_type, items))
+            assert str(bulk) == str(tree)
+            assert bulk.autocomplete([]) == tree.autocomplete([])
+            print(f'{tree_class.__name__} ({weight_type}, {len(items)} '
+                  f'values): insert {incremental:.2f}s, from_items '
+                  f'{seconds:.2f}s ({incremental / seconds:.1f}x)')
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Return the <pct>th percentile of <samples>."""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def short_prefixes(items: List[Tuple[Any, float, List]],
+                   max_length: int = 3) -> List[List]:
+    """Return every distinct prefix of length 1 to <max_length> in <items>.
+    """
+    seen = set()
+    prefixes = []
+    for _, _, prefix in items:
+        for i in range(1, min(max_length, len(prefix)) + 1):
+            key = tuple(prefix[:i])
+            if key not in seen:
+                seen.add(key)
+                prefixes.append(prefix[:i])
+    return prefixes
+
+
+def bench_top_k(file: str = 'data/lotr.txt', limit: int = 10) -> None:
+    """Report the latency of autocomplete(prefix, <limit>) on short prefixes,
+    with and without a top-<limit> cache at every node, compared with
+    collecting and sorting every match.
+    """
+    items = load_letter_items(file)
+    prefixes = short_prefixes(items)
+    for weight_type, top_k in [('sum', 0), ('average', 0),
+                               ('sum', limit), ('average', limit)]:
+        tree = build_tree(items, weight_type, top_k)
+        best_first = []
+        full_sort = []
+        for prefix in prefixes:
+            top, seconds = time_call(lambda: tree.autocomplete(prefix, limit))
+            best_first.append(seconds)
+            every, seconds = time_call(lambda: tree.autocomplete(prefix))
+            full_sort.append(seconds)
+            assert top == every[:limit]
+        print(f'top-{limit} on {len(prefixes)} short prefixes '
+              f'({weight_type}, top_k={top_k}): '
+              f'limit {limit} p50 {percentile(best_first, 50) * 1e6:.0f}us '
+              f'p99 {percentile(best_first, 99) * 1e6:.0f}us, '
+              f'limit None p50 {percentile(full_sort, 50) * 1e6:.0f}us '
+              f'p99 {percentile(full_sort, 99) * 1e6:.0f}us')
+
+
+def count_nodes(tree: SimplePrefixTree) -> int:
+    """Return the number of tree objects in <tree>, including leaves."""
+    count = 0
+    stack = [tree]
+    while stack:
+        tree = stack.pop()
+        count += 1
+        stack.extend(tree.subtrees)
+    return count
+
+
+def bench_compressed(file: str = 'data/lotr.txt', limit: int = 10) -> None:
+    """Compare the size, build time and query latency of SimplePrefixTree
+    and CompressedPrefixTree.
+    """
+    items = load_letter_items(file)
+    prefixes = short_prefixes(items, 6)
+    results = {}
+    for tree_class in [SimplePrefixTree, CompressedPrefixTree]:
+        tracemalloc.start()
+        tree, build = time_call(lambda: build_tree(items, 'sum',
+                                                   tree_class=tree_class))
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        latencies = []
+        results[tree_class] = []
+        for prefix in prefixes:
+            result, seconds = time_call(lambda: tree.autocomplete(prefix,
+                                                                  limit))
+            latencies.append(seconds)
+            results[tree_class].append(result)
+        print(f'{tree_class.__name__}: {count_nodes(tree)} nodes, '
+              f'{memory / 2 ** 20:.1f} MiB '
+              f'({memory / len(tree):.0f} bytes per value), build {build:.2f}s, '
+              f'top-{limit} p50 {percentile(latencies, 50) * 1e6:.0f}us '
+              f'p99 {percentile(latencies, 99) * 1e6:.0f}us')
+    assert results[SimplePrefixTree] == results[CompressedPrefixTree]
+
+
+def query_latencies(tree: Autocompleter, prefixes: List[List],
+                    limit: int) -> List[float]:
+    """Return the seconds tree.autocomplete(prefix, <limit>) takes for each
+    of <prefixes>.
+    """
+    latencies = []
+    for prefix in prefixes:
+        _, seconds = time_call(lambda: tree.autocomplete(prefix, limit))
+        latencies.append(seconds)
+    return latencies
+
+
+def bench_freeze(file: str = 'data/lotr.txt', limit: int = 10) -> None:
+    """Compare the memory use and query latency of each prefix tree and the
+    FrozenPrefixTree made from it.
+    """
+    items = load_letter_items(file)
+    prefixes = short_prefixes(items, 6)
+    for tree_class in [SimplePrefixTree, CompressedPrefixTree]:
+        tracemalloc.start()
+        tree = build_tree(items, 'sum', tree_class=tree_class)
+        memory = tracemalloc.get_traced_memory()[0]
+        frozen = tree.freeze()
+        del tree
+        gc.collect()
+        memory_frozen = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        tree = build_tree(items, 'sum', tree_class=tree_class)
+        frozen = tree.freeze()
+        for prefix in prefixes:
+            for lim in [limit, None]:
+                assert frozen.autocomplete(prefix, lim) == \
+                    tree.autocomplete(prefix, lim)
+        tree_latencies = query_latencies(tree, prefixes, limit)
+        frozen_latencies = query_latencies(frozen, prefixes, limit)
+        print(f'{tree_class.__name__}: {memory / len(frozen):.0f} bytes '
+              f'per value, top-{limit} p50 '
+              f'{percentile(tree_latencies, 50) * 1e6:.0f}us p99 '
+              f'{percentile(tree_latencies, 99) * 1e6:.0f}us; frozen: '
+              f'{memory_frozen / len(frozen):.0f} bytes per value, '
+              f'top-{limit} p50 '
+              f'{percentile(frozen_latencies, 50) * 1e6:.0f}us p99 '
+              f'{percentile(frozen_latencies, 99) * 1e6:.0f}us')
+
+
+def bench_iter(file: str = 'data/lotr.txt', page: int = 20) -> None:
+    """Compare getting the first <page> matches of the empty prefix with
+    iter_autocomplete against building the full list with autocomplete, in
+    time and peak memory.
+    """
+    items = load_letter_items(file)
+    for tree_class in [SimplePrefixTree, CompressedPrefixTree]:
+        tree = build_tree(items, 'sum', tree_class=tree_class)
+        for name, autocompleter in [(tree_class.__name__, tree),
+                                    ('frozen', tree.freeze())]:
+            full = autocompleter.autocomplete([])
+            assert list(autocompleter.iter_autocomplete([])) == full
+            first, lazy = time_call(lambda: list(itertools.islice(
+                autocompleter.iter_autocomplete([]), page)))
+            assert first == full[:page]
+            _, eager = time_call(lambda: autocompleter.autocomplete([])[:page])
+            tracemalloc.start()
+            list(itertools.islice(autocompleter.iter_autocomplete([]), page))
+            lazy_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.reset_peak()
+            autocompleter.autocomplete([])
+            eager_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f'{name}: first {page} of {len(full)} matches: iter '
+                  f'{lazy * 1e3:.2f}ms ({lazy_peak / 1024:.0f} KiB peak), '
+                  f'full list {eager * 1e3:.1f}ms '
+                  f'({eager_peak / 1024:.0f} KiB peak)')
+
+
+def bench_autocomplete_many(file: str = 'data/lotr.txt', limit: int = 10,
+                            lines: int = 200) -> None:
+    """Compare autocomplete_many against calling autocomplete on each prefix,
+    for every keystroke prefix of <lines> lines of <file> (as when a string
+    is pasted) followed by the same prefixes again (as when several users
+    type the same thing).
+    """
+    items = load_letter_items(file)
+    pasted = [prefix for _, _, prefix in items[::len(items) // lines]]
+    prefixes = [prefix[:i] for prefix in pasted
+                for i in range(1, len(prefix) + 1)] * 2
+    for tree_class in [SimplePrefixTree, CompressedPrefixTree]:
+        tree = build_tree(items, 'sum', tree_class=tree_class)
+        for name, autocompleter in [(tree_class.__name__, tree),
+                                    ('frozen', tree.freeze())]:
+            looped, loop = time_call(
+                lambda: [autocompleter.autocomplete(prefix, limit)
+                         for prefix in prefixes])
+            batched, batch = time_call(
+                lambda: autocompleter.autocomplete_many(prefixes, limit))
+            assert batched == looped
+            print(f'{name}: {len(prefixes)} prefixes, top-{limit}: loop '
+                  f'{loop * 1e3:.0f}ms, autocomplete_many '
+                  f'{batch * 1e3:.0f}ms')
+
+
+def bench_session(file: str = 'data/lotr.txt', limit: int = 10,
+                  lines: int = 200) -> None:
+    """Compare typing <lines> lines of <file> one letter at a time into a
+    PrefixSession, with a backspace and retype after each letter, against
+    calling autocomplete on the whole prefix after every keystroke.
+
+    The trees cache their top <limit> matches, so that the time is mostly
+    spent finding the tree for the prefix.
+    """
+    items = load_letter_items(file)
+    typed = [prefix for _, _, prefix in items[::len(items) // lines]]
+    for tree_class in [SimplePrefixTree, CompressedPrefixTree]:
+        tree = build_tree(items, 'sum', limit, tree_class)
+        for name, autocompleter in [(tree_class.__name__, tree),
+                                    ('frozen', tree.freeze())]:
+            def retype() -> List[List[Tuple[Any, float]]]:
+                results = []
+                for prefix in typed:
+                    for i in range(1, len(prefix) + 1):
+                        for n in [i, i - 1, i]:
+                            results.append(
+                                autocompleter.autocomplete(prefix[:n], limit))
+                return results
+
+            def session() -> List[List[Tuple[Any, float]]]:
+                results = []
+                for prefix in typed:
+                    typing = PrefixSession(autocompleter)
+                    for element in prefix:
+                        typing.push(element)
+                        results.append(typing.autocomplete(limit))
+                        typing.pop()
+                        results.append(typing.autocomplete(limit))
+                        typing.push(element)
+                        results.append(typing.autocomplete(limit))
+                return results
+
+            expected, full = time_call(retype)
+            results, incremental = time_call(session)
+            assert results == expected
+            print(f'{name}: {len(results)} keystrokes, top-{limit}: '
+                  f'autocomplete {full * 1e3:.0f}ms, PrefixSession '
+                  f'{incremental * 1e3:.0f}ms')
+
+
+def bench_fuzzy(file: str = 'data/lotr.txt', limit: int = 10,
+                queries: int = 500, distance: int = 1) -> None:
+    """Time fuzzy_autocomplete with up to <distance> edits on <queries>
+    prefixes of lines of <file> (3 to 8 letters long), each with one random
+    typo, reporting the median and 99th percentile latency.
+    """
+    items = load_letter_items(file)
+    rng = random.Random(148)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    typos = []
+    for _, _, prefix in rng.sample(items, queries):
+        typo = prefix[:rng.randint(3, 8)]
+        i = rng.randrange(len(typo))
+        edit = rng.choice(['insert', 'delete', 'replace'])
+        if edit == 'insert':
+            typo.insert(i, rng.choice(letters))
+        elif edit == 'delete':
+            del typo[i]
+        else:
+            typo[i] = rng.choice(letters)
+        typos.append(typo)
+    for tree_class in [SimplePrefixTree, CompressedPrefixTree]:
+        tree = build_tree(items, 'sum', 0, tree_class)
+        expected = None
+        for name, autocompleter in [(tree_class.__name__, tree),
+                                    ('frozen', tree.freeze())]:
+            results = []
+            latencies = []
+            for typo in typos:
+                result, latency = time_call(
+                    lambda: autocompleter.fuzzy_autocomplete(typo, distance,
+                                                             limit))
+                results.append(result)
+                latencies.append(latency)
+            if expected is None:
+                expected = results
+            assert results == expected
+            exact = sum(1 for typo in typos if tree.autocomplete(typo, 1))
+            print(f'{name}: {queries} mistyped prefixes ({exact} with exact '
+                  f'matches), distance {distance}, top-{limit}: median '
+                  f'{percentile(latencies, 50) * 1e3:.2f}ms, p99 '
+                  f'{percentile(latencies, 99) * 1e3:.2f}ms')
+
+
+def load_melody_intervals(file: str) -> List[List[int]]:
+    """Return the interval sequences MelodyAutocompleteEngine would store
+    for the CSV file <file>.
+    """
+    with open(file) as f:
+        sequences = []
+        for line in csv.reader(f):
+            if '' in line:
+                continue
+            pitches = [int(pitch) for pitch in line[1::2]]
+            sequences.append([pitches[i] - pitches[i - 1]
+                              for i in range(1, len(pitches))])
+        return sequences
+
+
+def bench_approximate(file: str = 'data/music.csv', limit: int = 10,
+                      queries: int = 500, length: int = 6) -> None:
+    """Time approximate_autocomplete on <queries> hummed queries: the first
+    <length> intervals of random melodies in <file>, each interval off by a
+    semitone with probability 0.3, and one interval replaced with
+    probability 0.5. Report latency, how many queries find the melody they
+    came from, and check the matches against scanning every melody.
+    """
+    sequences = [sequence for sequence in load_melody_intervals(file)
+                 if len(sequence) >= length]
+    rng = random.Random(148)
+    hummed = []
+    for sequence in rng.sample(sequences, queries):
+        query = [interval + rng.choice([-1, 1]) if rng.random() < 0.3
+                 else interval for interval in sequence[:length]]
+        if rng.random() < 0.5:
+            query[rng.randrange(length)] = rng.randint(-12, 12)
+        hummed.append((query, sequence))
+    for kind in ['simple', 'compressed']:
+        engine = MelodyAutocompleteEngine({'file': file, 'autocompleter': kind,
+                                           'weight_type': 'sum'})
+        for tolerance, mismatches in [(0, 0), (1, 0), (0, 1), (1, 1),
+                                      (2, 1)]:
+            latencies = []
+            found = 0
+            for query, sequence in hummed:
+                result, seconds = time_call(
+                    lambda: engine.approximate_autocomplete(
+                        query, tolerance, mismatches, limit))
+                latencies.append(seconds)
+                close = sum(abs(a - b) > tolerance
+                            for a, b in zip(query, sequence)) <= mismatches
+                found += close
+            # The full match lists, against a scan of every melody.
+            query = hummed[0][0]
+            matches = engine.approximate_autocomplete(query, tolerance,
+                                                      mismatches)
+            scan = [sequence for sequence in sequences
+                    if sum(abs(a - b) > tolerance
+                           for a, b in zip(query, sequence)) <= mismatches]
+            assert len(matches) == len(scan)
+            print(f'{kind}, tolerance {tolerance}, {mismatches} mismatches: '
+                  f'{found} of {queries} hummed queries within reach, '
+                  f'top-{limit} p50 {percentile(latencies, 50) * 1e6:.0f}us '
+                  f'p99 {percentile(latencies, 99) * 1e6:.0f}us')
+
+
+def bench_cache(file: str = 'data/google_searches.csv', limit: int = 10,
+                queries: int = 20000, cache_size: int = 1000) -> None:
+    """Compare a SentenceAutocompleteEngine with and without a result cache
+    of <cache_size> results, on <queries> prefixes drawn with a skewed
+    (Zipf-like) distribution, with an insert after every 100 queries.
+    """
+    config = {'file': file, 'autocompleter': 'compressed',
+              'weight_type': 'sum'}
+    engine = SentenceAutocompleteEngine(config)
+    cached = SentenceAutocompleteEngine(dict(config, cache_size=cache_size))
+    # Heavier sentences come first, so their prefixes are the most popular.
+    items = [(value, weight, value.split())
+             for value, weight in engine.autocompleter.autocomplete([])]
+    candidates = [' '.join(prefix) for prefix in short_prefixes(items, 2)]
+    rng = random.Random(148)
+    weights = [1 / (rank + 1) for rank in range(len(candidates))]
+    workload = rng.choices(candidates, weights, k=queries)
+    inserts = [rng.choice(candidates) + ' new' for _ in workload[::100]]
+
+    def run(autocompleter: Autocompleter) -> List[List[Tuple[Any, float]]]:
+        results = []
+        for i in range(len(workload)):
+            if i % 100 == 0:
+                value = inserts[i // 100]
+                autocompleter.insert(value, 1.0, value.split())
+            results.append(autocompleter.autocomplete(workload[i].split(),
+                                                      limit))
+        return results
+
+    expected, uncached = time_call(lambda: run(engine.autocompleter))
+    results, with_cache = time_call(lambda: run(cached.autocompleter))
+    assert results == expected
+    cache = cached.autocompleter
+    print(f'{len(candidates)} distinct prefixes, {queries} queries, '
+          f'top-{limit}: no cache {uncached * 1e3:.0f}ms, cache of '
+          f'{cache_size} {with_cache * 1e3:.0f}ms ({cache.hits} hits, '
+          f'{cache.misses} misses, {cache.evictions} evictions)')
+
+
+def bench_concurrent(file: str = 'data/lotr.txt', limit: int = 10,
+                     seconds: float = 2.0, values: int = 50) -> None:
+    """Stress test a ConcurrentAutocompleter: reader threads query it while a
+    writer thread inserts into it, for <seconds> seconds with 1, 2 and 4
+    readers, and print the throughput.
+
+    The writer inserts <values> new values under the prefix ['#'] in turn,
+    each with weight 1, so after n inserts the weights of those values are
+    exactly determined by n. Every read of that prefix checks that it saw
+    the result of some whole number of inserts, in order of weight.
+    """
+    items = load_letter_items(file)
+    prefixes = short_prefixes(items)
+    tree = build_tree(items, 'sum', limit)
+    rng = random.Random(148)
+    queries = rng.choices(prefixes, k=10000)
+    _, alone = time_call(lambda: [tree.autocomplete(prefix, limit)
+                                  for prefix in queries])
+    print(f'SimplePrefixTree, one thread: '
+          f'{len(queries) / alone:.0f} reads/s')
+
+    def check(result: List[Tuple[Any, float]]) -> None:
+        n = int(sum(weight for _, weight in result))
+        expected = sorted([(f'#{j}', float(n // values + (j < n % values)))
+                           for j in range(min(n, values))],
+                          key=lambda pair: -pair[1])
+        assert sorted(result) == sorted(expected), result
+        assert [w for _, w in result] == [w for _, w in expected], result
+
+    for readers in [1, 2, 4]:
+        autocompleter = ConcurrentAutocompleter(
+            SimplePrefixTree.from_items('sum', items, limit),
+            SimplePrefixTree.from_items('sum', items, limit))
+        stop = threading.Event()
+        reads = [0] * readers
+        writes = [0]
+
+        def read(i: int) -> None:
+            while not stop.is_set():
+                for prefix in queries[i * 100:(i + 1) * 100]:
+                    autocompleter.autocomplete(prefix, limit)
+                check(autocompleter.autocomplete(['#']))
+                reads[i] += 101
+
+        def write() -> None:
+            while not stop.is_set():
+                j = writes[0] % values
+                autocompleter.insert(f'#{j}', 1, ['#'] + list(str(j)))
+                writes[0] += 1
+
+        threads = [threading.Thread(target=read, args=(i,))
+                   for i in range(readers)]
+        threads.append(threading.Thread(target=write))
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        check(autocompleter.autocomplete(['#']))
+        assert str(autocompleter._trees[0]) == str(autocompleter._trees[1])
+        print(f'ConcurrentAutocompleter, {readers} reader threads and a '
+              f'writer: {sum(reads) / seconds:.0f} reads/s, '
+              f'{writes[0] / seconds:.0f} writes/s')
+
+
+def bench_server(file: str = 'data/google_searches.csv', limit: int = 10,
+                 clients: int = 20, requests: int = 500) -> None:
+    """Run an AutocompleteServer for a SentenceAutocompleteEngine, and time
+    <clients> connections each sending <requests> pipelined queries drawn
+    with a skewed distribution, while another connection asks for every
+    match of the empty prefix.
+    """
+    engine = SentenceAutocompleteEngine({
+        'file': file, 'autocompleter': 'compressed', 'weight_type': 'sum',
+        'top_k': limit})
+    items = [(value, weight, value.split())
+             for value, weight in engine.autocompleter.autocomplete([])]
+    candidates = [' '.join(prefix) for prefix in short_prefixes(items, 2)]
+    rng = random.Random(148)
+    weights = [1 / (rank + 1) for rank in range(len(candidates))]
+    workloads = [rng.choices(candidates, weights, k=requests)
+                 for _ in range(clients)]
+
+    async def client(port: int, prefixes: List[str],
+                     query_limit: Optional[int]) -> List[List]:
+        reader, writer = await asyncio.open_connection('localhost', port,
+                                                       limit=1 << 26)
+        for prefix in prefixes:
+            writer.write(json.dumps({'prefix': prefix,
+                                     'limit': query_limit}).encode() + b'\n')
+        await writer.drain()
+        responses = [json.loads(await reader.readline())['results']
+                     for _ in prefixes]
+        writer.close()
+        await writer.wait_closed()
+        return responses
+
+    async def run() -> Tuple[List[List[List]], float, float]:
+        listener = await server.serve(port=0)
+        port = listener.sockets[0].getsockname()[1]
+        start = time.perf_counter()
+        heavy = asyncio.ensure_future(client(port, [''], None))
+        responses = await asyncio.gather(*[
+            client(port, workload, limit) for workload in workloads])
+        small = time.perf_counter() - start
+        await heavy
+        total = time.perf_counter() - start
+        listener.close()
+        await server.wait_closed()
+        await listener.wait_closed()
+        return responses, small, total
+
+    server = AutocompleteServer(engine)
+    responses, small, total = asyncio.run(run())
+    server.close()
+    for workload, results in zip(workloads, responses):
+        for prefix, result in zip(workload, results):
+            assert result == [list(pair) for pair
+                              in engine.autocomplete(prefix, limit)]
+    queries = clients * requests
+    print(f'server: {queries} top-{limit} queries from {clients} clients in '
+          f'{small * 1e3:.0f}ms ({queries / small:.0f}/s), '
+          f'{server.coalesced} coalesced; all-matches query done after '
+          f'{total * 1e3:.0f}ms')
+
+
+def bench_log(file: str = 'data/lotr.txt', limit: int = 10,
+              changes: int = 20000) -> None:
+    """Time a LetterAutocompleteEngine with a write-ahead log: <changes>
+    live inserts and removes with and without logging, restarting from the
+    snapshot and log against parsing <file>, and compacting the log.
+    """
+    items = load_letter_items(file)
+    rng = random.Random(148)
+    lines = [value for value, _, _ in rng.choices(items, k=changes)]
+    prefixes = short_prefixes(items)
+    for kind in ['simple', 'compressed']:
+        config = {'file': file, 'autocompleter': kind, 'weight_type': 'sum'}
+        with tempfile.TemporaryDirectory() as directory:
+            logged = dict(config, log=os.path.join(directory, 'letters'))
+            engine, parse = time_call(lambda: LetterAutocompleteEngine(config))
+            live, build = time_call(lambda: LetterAutocompleteEngine(logged))
+
+            def change(autocompleter: Autocompleter) -> None:
+                for i in range(len(lines)):
+                    if i % 100 == 99:
+                        autocompleter.remove(list(lines[i][:3]))
+                    else:
+                        autocompleter.insert(lines[i] + ' again', 1.0,
+                                             list(lines[i] + ' again'))
+
+            _, plain = time_call(lambda: change(engine.autocompleter))
+            _, logging = time_call(lambda: change(live.autocompleter))
+            live.autocompleter.close()
+            # Free the old trees first, so that collecting them isn't timed.
+            del live
+            gc.collect()
+            restarted, recover = time_call(
+                lambda: LetterAutocompleteEngine(logged))
+            for prefix in prefixes:
+                assert restarted.autocomplete(''.join(prefix), limit) == \
+                    engine.autocomplete(''.join(prefix), limit)
+            _, compact = time_call(restarted.autocompleter.compact)
+            restarted.autocompleter.close()
+            del restarted
+            gc.collect()
+            compacted, reopen = time_call(
+                lambda: LetterAutocompleteEngine(logged))
+            compacted.autocompleter.close()
+        print(f'{kind} letter engine: parse {parse:.2f}s (with first '
+              f'snapshot {build:.2f}s); {changes} changes '
+              f'{plain * 1e3:.0f}ms, logged {logging * 1e3:.0f}ms; restart '
+              f'from snapshot and log {recover:.2f}s; compact '
+              f'{compact:.2f}s; restart after compacting {reopen:.2f}s')
+
+
+def bench_decay(file: str = 'data/google_searches.csv', limit: int = 10,
+                decays: int = 1000) -> None:
+    """Compare decaying the weights of a SentenceAutocompleteEngine <decays>
+    times (halving them overall) against rebuilding its prefix tree with the
+    decayed weights, checking that both return the same matches.
+    """
+    factor = 0.5 ** (1 / decays)
+    scale = 1.0
+    for _ in range(decays):
+        scale *= factor
+    for kind, tree_class in [('simple', SimplePrefixTree),
+                             ('compressed', CompressedPrefixTree)]:
+        for weight_type in ['sum', 'average']:
+            engine = SentenceAutocompleteEngine({
+                'file': file, 'autocompleter': kind,
+                'weight_type': weight_type})
+            matches = engine.autocompleter.autocomplete([])
+            items = [(value, weight, value.split())
+                     for value, weight in matches]
+            prefixes = short_prefixes(items, 2)
+
+            def decay_all() -> None:
+                for _ in range(decays):
+                    engine.decay(factor)
+
+            _, decay = time_call(decay_all)
+            decayed = [(value, weight * scale, prefix)
+                       for value, weight, prefix in items]
+            rebuilt, rebuild = time_call(
+                lambda: tree_class.from_items(weight_type, decayed))
+            for prefix in prefixes:
+                assert engine.autocompleter.autocomplete(prefix, limit) == \
+                    rebuilt.autocomplete(prefix, limit)
+            # Push the scale out of range, so the weights are rescaled.
+            _, rescale = time_call(lambda: engine.decay(2.0 ** -64))
+            print(f'{kind} {weight_type}: decay {decay * 1e6 / decays:.2f}us '
+                  f'each; rebuild with decayed weights {rebuild * 1e3:.0f}ms; '
+                  f'rescale {rescale * 1e3:.0f}ms')
+
+
+def bench_infix(file: str = 'data/google_searches.csv', limit: int = 10,
+                queries: int = 1000) -> None:
+    """Measure the memory an InfixIndex adds to the prefix tree of a
+    SentenceAutocompleteEngine, and compare its infix_autocomplete on
+    <queries> one or two word prefixes taken from the middle of sentences
+    against scanning every sentence.
+    """
+    rng = random.Random(148)
+    for kind, tree_class in [('simple', SimplePrefixTree),
+                             ('compressed', CompressedPrefixTree)]:
+        config = {'file': file, 'autocompleter': kind, 'weight_type': 'sum'}
+        tracemalloc.start()
+        engine = SentenceAutocompleteEngine(config)
+        base = tracemalloc.get_traced_memory()[0]
+        index, build = time_call(
+            lambda: InfixIndex(engine.autocompleter, str.split, tree_class))
+        overhead = tracemalloc.get_traced_memory()[0] - base
+        tracemalloc.stop()
+
+        matches = engine.autocomplete('')
+        words = [value.split() for value, _ in matches]
+        prefixes = []
+        while len(prefixes) < queries:
+            sentence = rng.choice(words)
+            if len(sentence) > 1:
+                start = rng.randrange(1, len(sentence))
+                prefixes.append(sentence[start:start + rng.randint(1, 2)])
+
+        def scan(prefix: List[str]) -> List[Tuple[Any, float]]:
+            found = []
+            for (value, weight), sentence in zip(matches, words):
+                if any(sentence[i:i + len(prefix)] == prefix
+                       for i in range(len(sentence))):
+                    found.append((value, weight))
+                    if len(found) == limit:
+                        break
+            return found
+
+        latencies = []
+        for prefix in prefixes:
+            result, seconds = time_call(
+                lambda: index.infix_autocomplete(prefix, limit))
+            latencies.append(seconds)
+            assert [weight for _, weight in result] == \
+                [weight for _, weight in scan(prefix)]
+        scans = [time_call(lambda: scan(prefix))[1]
+                 for prefix in prefixes[:50]]
+        print(f'{kind}: {len(engine.autocompleter)} sentences, infix index '
+              f'{overhead / 2 ** 20:.1f} MiB on top of {base / 2 ** 20:.1f} '
+              f'MiB ({overhead / base:.0%}), built in {build:.2f}s; infix '
+              f'top-{limit} p50 {percentile(latencies, 50) * 1e6:.0f}us p99 '
+              f'{percentile(latencies, 99) * 1e6:.0f}us, scan p50 '
+              f'{percentile(scans, 50) * 1e3:.1f}ms')
+
+
+def bench_index(file: str = 'data/lotr.txt', limit: int = 10) -> None:
+    """Compare starting a LetterAutocompleteEngine by parsing <file> against
+    opening an index file built from it.
+    """
+    prefixes = short_prefixes(load_letter_items(file))
+    for kind in ['simple', 'compressed']:
+        config = {'file': file, 'autocompleter': kind, 'weight_type': 'sum'}
+        with tempfile.TemporaryDirectory() as directory:
+            index = os.path.join(directory, 'letters.idx')
+            engine, parse = time_call(
+                lambda: LetterAutocompleteEngine(config))
+            _, build = time_call(
+                lambda: LetterAutocompleteEngine(dict(config, index=index)))
+            indexed, start = time_call(
+                lambda: LetterAutocompleteEngine(dict(config, index=index)))
+            for prefix in prefixes:
+                assert indexed.autocomplete(''.join(prefix), limit) == \
+                    engine.autocomplete(''.join(prefix), limit)
+            size = os.path.getsize(index)
+            del indexed
+        print(f'{kind} letter engine: parse {parse:.2f}s, write index '
+              f'{build:.2f}s ({size / 2 ** 20:.1f} MiB), '
+              f'open index {start * 1e3:.1f}ms')
+
+
+def bench_workers(workers: Tuple[int, ...] = (1, 2, 4, 8)) -> None:
+    """Report how long the CSV-based engines take to start with each number
+    of <workers> reading their file, and check that they build the same
+    tree.
+    """
+    print(f'{os.cpu_count()} CPUs')
+    for engine_class, file in [(SentenceAutocompleteEngine,
+                                'data/google_searches.csv'),
+                               (MelodyAutocompleteEngine, 'data/music.csv')]:
+        expected = None
+        timings = []
+        for n in workers:
+            config = {'file': file, 'autocompleter': 'compressed',
+                      'weight_type': 'sum', 'workers': n}
+            engine, seconds = time_call(lambda: engine_class(config))
+            if expected is None:
+                expected = str(engine.autocompleter)
+            assert str(engine.autocompleter) == expected
+            timings.append(f'{n} workers {seconds:.2f}s')
+        print(f'{engine_class.__name__}: ' + ', '.join(timings))
+
+
+def _recursive_find(tree: SimplePrefixTree, prefix: List,
+                    i: int = 0) -> SimplePrefixTree:
+    """Return the subtree of <tree> for <prefix>, one call per element."""
+    if i == len(prefix) or tree is None:
+        return tree
+    return _recursive_find(tree._children.get(prefix[i]), prefix, i + 1)
+
+
+def _recursive_leaves(tree: SimplePrefixTree,
+                      leaves: List[SimplePrefixTree]) -> None:
+    """Append the leaves of <tree> to <leaves>, one call per subtree."""
+    if tree.is_leaf():
+        leaves.append(tree)
+    else:
+        for subtree in tree.subtrees:
+            _recursive_leaves(subtree, leaves)
+
+
+def _recursive_str(tree: SimplePrefixTree, depth: int = 0) -> str:
+    """Return tree._str_indented(depth), one call per subtree."""
+    s = '  ' * depth + f'{tree.value} ({tree.weight})\n'
+    for subtree in tree.subtrees:
+        s += _recursive_str(subtree, depth + 1)
+    return s
+
+
+def bench_traversals(file: str = 'data/lotr.txt') -> None:
+    """Compare the explicit-stack walks used by the prefix trees against
+    the recursive walks they replaced, and check that a prefix far longer
+    than the recursion limit works.
+    """
+    items = load_letter_items(file)
+    tree = build_tree(items, 'sum')
+    prefixes = [prefix for _, _, prefix in items]
+
+    def descend_loop() -> None:
+        for prefix in prefixes:
+            subtree = tree
+            for key in prefix:
+                subtree = subtree._children.get(key)
+
+    def descend_recursive() -> None:
+        for prefix in prefixes:
+            _recursive_find(tree, prefix)
+
+    _, loop = time_call(descend_loop)
+    _, recursive = time_call(descend_recursive)
+    print(f'descent: recursive {recursive / len(prefixes) * 1e6:.2f}us, '
+          f'loop {loop / len(prefixes) * 1e6:.2f}us per prefix '
+          f'({recursive / loop:.1f}x)')
+
+    leaves, loop = time_call(lambda: tree._no_limit_items([]))
+    old = []
+    _, recursive = time_call(lambda: _recursive_leaves(tree, old))
+    print(f'collect {len(tree)} leaves: recursive {recursive * 1e3:.0f}ms, '
+          f'stack {loop * 1e3:.0f}ms ({recursive / loop:.1f}x)')
+
+    new, loop = time_call(lambda: str(tree))
+    old, recursive = time_call(lambda: _recursive_str(tree))
+    assert new == old
+    print(f'str: recursive {recursive * 1e3:.0f}ms, stack {loop * 1e3:.0f}ms '
+          f'({recursive / loop:.1f}x)')
+
+    deep = SimplePrefixTree('sum')
+    prefix = [0] * 5000
+    deep.insert('deep', 1.0, prefix)
+    assert deep.autocomplete(prefix[:2500]) == [('deep', 1.0)]
+    assert len(deep) == 1 and str(deep).count('\n') == len(prefix) + 2
+    deep.remove(prefix[:1000])
+    assert len(deep) == 0
+
+
+if __name__ == '__main__':
+    bench_sanitize()
+    bench_subtree_ordering()
+    bench_from_items()
+    bench_top_k()
+    bench_compressed()
+    bench_freeze()
+    bench_iter()
+    bench_autocomplete_many()
+    bench_session()
+    bench_fuzzy()
+    bench_cache()
+    bench_concurrent()
+    bench_server()
+    bench_log()
+    bench_decay()
+    bench_infix()
+    bench_approximate()
+    bench_index()
+    bench_workers()
+    bench_traversals()
@@ -15,7 +15,250 @@ testing directly! You may, however, add new private attributes, methods, and
 top-level functions to this file.
 """
 from __future__ import annotations
-from typing import Any, List, Optional, Tuple
+import gc
+import heapq
+import itertools
+import mmap
+import os
+import pickle
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, \
+    Sequence, Set, Tuple
+
+# Key under which an index stores (key, tree) pairs for unhashable keys.
+_UNHASHABLE = object()
+
+# Source of insertion sequence numbers, used to break ties between subtrees
+# of equal weight (older subtrees come first).
+_next_seq = itertools.count().__next__
+
+# The index file format written by FrozenPrefixTree.save. A file starts with
+# a header (magic, format version, byte order, weight type, top_k, number of
+# sections, CRC-32 of everything after the header, weight scale), followed by
+# a table giving the typecode, offset and item count of each section, and then
+# the sections, each aligned to 8 bytes.
+_INDEX_MAGIC = b'PFXTREE\0'
+_INDEX_VERSION = 2
+_INDEX_HEADER = struct.Struct('<8sI1s1s2xIIId')
+_INDEX_SECTION = struct.Struct('<1s7xQQ')
+
+# Each record of a LoggedAutocompleter log is this header (the length and
+# CRC-32 of the record's data) followed by the data, a pickled tuple.
+_LOG_RECORD = struct.Struct('<II')
+
+# The range of scales SimplePrefixTree.decay lets a tree's weights have before
+# folding the scale into the stored weights.
+_MIN_SCALE = 2.0 ** -64
+_MAX_SCALE = 2.0 ** 64
+
+# The message of the TypeError raised on changing a FrozenPrefixTree.
+_READ_ONLY = ('a FrozenPrefixTree is read-only; modify the tree it was frozen '
+              'from and freeze it again')
+
+
+################################################################################
+# Subtree indexes
+################################################################################
+def _index_get(index: Optional[Dict[Any, Any]], key: Any) -> Optional[Any]:
+    """Return the tree stored under <key> in <index>, or None if there is none.
+
+    An index is None until something is stored in it. Keys are compared
+    using ==, so unhashable keys (which cannot be stored in a dict) are kept
+    in a list of (key, tree) pairs under _UNHASHABLE.
+    """
+    if index is None:
+        return None
+    try:
+        return index.get(key)
+    except TypeError:
+        for other, tree in index.get(_UNHASHABLE, []):
+            if other == key:
+                return tree
+        return None
+
+
+def _index_set(index: Optional[Dict[Any, Any]], key: Any,
+               tree: Any) -> Dict[Any, Any]:
+    """Store <tree> under <key> in <index>, and return the index (which is
+    created if <index> is None).
+
+    Precondition: <key> is not already in <index>.
+    """
+    if index is None:
+        index = {}
+    try:
+        index[key] = tree
+    except TypeError:
+        index.setdefault(_UNHASHABLE, []).append((key, tree))
+    return index
+
+
+def _index_pop(index: Dict[Any, Any], key: Any) -> Optional[Dict[Any, Any]]:
+    """Remove the tree stored under <key> from <index>, and return the index
+    (or None if it is now empty).
+
+    Precondition: <key> is in <index>.
+    """
+    try:
+        del index[key]
+    except TypeError:
+        pairs = index[_UNHASHABLE]
+        for i in range(len(pairs)):
+            if pairs[i][0] == key:
+                pairs.pop(i)
+                break
+        if not pairs:
+            del index[_UNHASHABLE]
+    return index or None
+
+
+################################################################################
+# Batched lookups
+################################################################################
+def _sorted_distinct(prefixes: List[List]) -> Optional[List[Tuple]]:
+    """Return the distinct prefixes in <prefixes> as tuples, in sorted order,
+    or None if some prefix element cannot be hashed or compared.
+    """
+    try:
+        return sorted({tuple(prefix) for prefix in prefixes})
+    except TypeError:
+        return None
+
+
+def _walk_sorted(prefixes: List[Tuple], start: Any,
+                 step: Callable[[Any, int, Any], Any]) \
+        -> Iterator[Tuple[Tuple, Any]]:
+    """Yield each prefix in <prefixes> with the state reached by walking
+    its elements from <start>, or None if no value matches it.
+
+    step(state, depth, element) returns the state reached from <state> (the
+    state for the first <depth> elements of a prefix) by taking <element>,
+    or None if no value matches. Since <prefixes> is sorted, each prefix
+    shares the longest common prefix it has with any earlier one with the
+    prefix just before it, so only the elements after that are stepped
+    through.
+
+    Precondition: <prefixes> is sorted and has no duplicates.
+    """
+    # path[d] is the state for the first d elements of the previous prefix.
+    path = [start]
+    previous = ()
+    for prefix in prefixes:
+        n = 0
+        while n < len(previous) and previous[n] == prefix[n]:
+            n += 1
+        del path[n + 1:]
+        while path[-1] is not None and len(path) <= len(prefix):
+            depth = len(path) - 1
+            path.append(step(path[-1], depth, prefix[depth]))
+        yield prefix, path[-1]
+        previous = prefix
+
+
+def _autocomplete_many(tree: Autocompleter, prefixes: List[List],
+                       limit: Optional[int]) -> List[List[Tuple[Any, float]]]:
+    """Return tree.autocomplete(prefix, limit) for each prefix in <prefixes>,
+    walking them together with the walk methods of <tree> (see
+    SimplePrefixTree._walk_start).
+
+    The matches of a walk state's <matching> tree are found once however many
+    prefixes lead to it.
+    """
+    distinct = _sorted_distinct(prefixes)
+    if distinct is None:
+        return [tree.autocomplete(prefix, limit) for prefix in prefixes]
+    found = {}
+    tree_matches = {}
+    for prefix, state in _walk_sorted(distinct, tree._walk_start(),
+                                      tree._walk_step):
+        if state is None:
+            found[prefix] = []
+        else:
+            if state[0] not in tree_matches:
+                tree_matches[state[0]] = tree._walk_matches(state, limit)
+            found[prefix] = tree_matches[state[0]]
+    return [list(found[tuple(prefix)]) for prefix in prefixes]
+
+
+################################################################################
+# Fuzzy matching
+################################################################################
+def _fuzzy_start(prefix: Sequence) -> Optional[List[int]]:
+    """Return the edit distance row (see _fuzzy_edge) of the empty prefix
+    sequence, against <prefix>.
+    """
+    if not prefix:
+        return None
+    return list(range(len(prefix) + 1))
+
+
+def _fuzzy_edge(prefix: Sequence, row: Optional[List[int]], best: int,
+                labels: Iterable) -> Tuple[Optional[List[int]], int, int]:
+    """Return the edit distance row, distance and distance bound of a tree
+    whose prefix is its parent's followed by <labels>, where <row> and
+    <best> are the row and distance of the parent.
+
+    This is the row-by-row Levenshtein dynamic program, one row per prefix
+    element. The row of a tree is the list whose entry <i> is the edit
+    distance between prefix[:i] and the tree's prefix, or None once no
+    deeper tree can have a smaller distance than <best>. The distance of a
+    tree is the smallest edit distance between <prefix> and a prefix of the
+    tree's prefix, which is the distance of the values directly in it. The
+    smallest entry of a row never shrinks going down the tree, so the
+    bound, the smaller of the distance and that entry, is at most the
+    distance of every value in the tree.
+    """
+    if row is None:
+        return None, best, best
+    lowest = min(row)
+    for label in labels:
+        left = lowest = row[0] + 1
+        new = [left]
+        for element, diagonal, up in zip(prefix, row, row[1:]):
+            # The cheapest of replacing (free if the elements are equal),
+            # deleting from <prefix>, and inserting into <prefix>.
+            cell = diagonal if element == label else diagonal + 1
+            if up < cell:
+                cell = up + 1
+            if left < cell:
+                cell = left + 1
+            new.append(cell)
+            left = cell
+            if cell < lowest:
+                lowest = cell
+        if left < best:
+            best = left
+        if lowest >= best:
+            return None, best, best
+        row = new
+    return row, best, lowest
+
+
+def _approximate_edge(prefix: Sequence, tolerance: int, depth: int,
+                      missed: int, labels: Iterable) -> Tuple[int, int]:
+    """Return the depth and mismatch count of a tree whose prefix is its
+    parent's followed by <labels>, where <depth> and <missed> are those of
+    the parent.
+
+    The depth of a tree is the length of its prefix, up to len(prefix), and
+    its mismatch count is the number of elements of its prefix more than
+    <tolerance> away from the element of <prefix> in the same position (see
+    approximate_autocomplete).
+    """
+    for label in labels:
+        if depth == len(prefix):
+            break
+        if abs(label - prefix[depth]) > tolerance:
+            missed += 1
+        depth += 1
+    return depth, missed
 
 
 ################################################################################
@@ -24,6 +267,8 @@ from typing import Any, List, Optional, Tuple
 class Autocompleter:
     """An abstract class representing the Autocompleter Abstract Data Type.
     """
+    # Empty, so that the slotted tree classes have no __dict__.
+    __slots__ = ()
 
     def __len__(self) -> int:
         """Return the number of values stored in this Autocompleter."""
@@ -60,15 +305,126 @@ class Autocompleter:
         """
         raise NotImplementedError
 
+    def autocomplete_many(self, prefixes: List[List],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[Any, float]]]:
+        """Return the list autocomplete(prefix, limit) returns for each
+        prefix in <prefixes>, in order.
+
+        The prefixes are looked up together, so the work shared between them
+        (such as the path to a common prefix, or the matches of a repeated
+        prefix) is done once.
+
+        Precondition: limit is None or limit > 0.
+        """
+        raise NotImplementedError
+
+    def iter_autocomplete(self, prefix: List) -> Iterator[Tuple[Any, float]]:
+        """Yield the matches for the given prefix, as tuples (value, weight),
+        in the order autocomplete(prefix) returns them.
+
+        Unlike autocomplete, this finds the matches as they are asked for, so
+        a caller that only pages through the first few neither waits for nor
+        stores the rest. The Autocompleter must not be changed while the
+        generator is in use.
+        """
+        raise NotImplementedError
+
+    def fuzzy_autocomplete(self, prefix: List, distance: int,
+                           limit: Optional[int] = None,
+                           penalty: float = 0.1) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the values whose prefix sequence
+        starts with a sequence at most <distance> edits (insertions,
+        deletions or substitutions of one element) away from <prefix>.
+
+        The distance of a value is the fewest edits turning <prefix> into a
+        prefix of the value's prefix sequence. Matches are ranked by their
+        weight times penalty ** distance, so each edit makes a match count
+        for less; ties are broken as in autocomplete, which this is when
+        <distance> is 0. The return value is a list of tuples
+        (value, weight), in that order (so not always in non-increasing
+        weight).
+
+        If limit is None, return *every* match.
+
+        Precondition: distance >= 0, 0 < penalty <= 1, and limit is None or
+        limit > 0.
+        """
+        raise NotImplementedError
+
+    def approximate_autocomplete(self, prefix: List, tolerance: int,
+                                 mismatches: int = 0,
+                                 limit: Optional[int] = None,
+                                 penalty: float = 0.1) \
+            -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the values whose prefix sequence
+        (of numbers) starts with a sequence close to <prefix>: each element
+        is within <tolerance> of the element of <prefix> in the same
+        position, except for at most <mismatches> elements, which can be
+        anything.
+
+        Matches are ranked by their weight times penalty ** (the number of
+        elements more than <tolerance> away), so elements within
+        <tolerance> count as equal; ties are broken as in autocomplete,
+        which this is when <tolerance> and <mismatches> are 0. The return
+        value is a list of tuples (value, weight), in that order.
+
+        If limit is None, return *every* match.
+
+        Precondition: the prefix sequences are sequences of numbers,
+        <tolerance> is a whole number, tolerance >= 0, mismatches >= 0,
+        0 < penalty <= 1, and limit is None or limit > 0.
+        """
+        raise NotImplementedError
+
     def remove(self, prefix: List) -> None:
         """Remove all values that match the given prefix.
         """
         raise NotImplementedError
 
+    def decay(self, factor: float) -> None:
+        """Multiply the weight of every value in this Autocompleter by
+        <factor>.
+
+        Precondition: factor > 0
+        """
+        raise NotImplementedError
+
 
 ################################################################################
 # SimplePrefixTree (Tasks 1-3)
 ################################################################################
+class _TreeSettings:
+    """The settings shared by every tree object in one prefix tree.
+
+    === Attributes ===
+    weight_type:
+        The method in which the weight of non-leaf trees is calculated
+        (either 'sum' or 'average').
+    top_k:
+        The number of best leaves cached at every non-leaf tree, or 0 if
+        caching is off.
+    version:
+        The number of times the prefix tree has been changed by insert,
+        remove or decay.
+    scale:
+        The factor every weight stored in the prefix tree is multiplied by
+        to give its true weight (see SimplePrefixTree.decay).
+    """
+    __slots__ = ('weight_type', 'top_k', 'version', 'scale')
+    weight_type: str
+    top_k: int
+    version: int
+    scale: float
+
+    def __init__(self, weight_type: str, top_k: int) -> None:
+        """Initialize the settings of a new prefix tree."""
+        self.weight_type = weight_type
+        self.top_k = top_k
+        self.version = 0
+        self.scale = 1.0
+
+
 class SimplePrefixTree(Autocompleter):
     """A simple prefix tree.
 
@@ -76,20 +432,38 @@ class SimplePrefixTree(Autocompleter):
     Note that we've made the attributes public because we will be accessing them
     directly for testing purposes.
 
+    Tree objects use __slots__, and a non-leaf tree stores only the last
+    element of its prefix, so value and subtrees are computed on access for
+    non-leaf trees and leaves respectively.
+
     === Attributes ===
     value:
         The value stored at the root of this prefix tree, or [] if this
-        prefix tree is empty.
+        prefix tree is empty. For a non-leaf tree, this is rebuilt from the
+        edge labels on the path from the root.
     weight:
         The weight of this prefix tree. If this tree is a leaf, this attribute
         stores the weight of the value stored in the leaf. If this tree is
         not a leaf and non-empty, this attribute stores the *aggregate weight*
-        of the leaf weights in this tree.
+        of the leaf weights in this tree. Like every weight stored in the
+        tree, this is relative to _settings.scale: the weights autocomplete
+        returns are the stored ones multiplied by it (which changes nothing
+        until decay is called).
     weight_type:
         The method in which the weight of this subtree will be calculated
-        (either 'sum' or 'average').
+        (either 'sum' or 'average'). This is shared by the whole tree.
     subtrees:
         A list of subtrees of this prefix tree.
+    _value:
+        If this tree is a leaf, the value stored in it. Otherwise, the label
+        of the edge from its parent: the element its prefix adds to its
+        parent's (unused at the root).
+    _parent:
+        The tree this tree is a subtree of, or None at the root.
+    _subtrees:
+        The list behind subtrees, or None if this tree is a leaf.
+    _settings:
+        The settings shared by every tree object in this prefix tree.
     _leaf_count:
         The amount of leaves this prefix tree has. If it is a leaf itself,
         its _leaf_count == 1.
@@ -98,6 +472,24 @@ class SimplePrefixTree(Autocompleter):
         leaves the tree has. It does not store an average but rather the total
         sum of the weights. if the prefix tree is a leaf itself then its
         _sum_weight is the weight of the leaf.
+    _children:
+        An index of the non-leaf subtrees of this prefix tree, keyed by the
+        label of the edge leading to them, or None if there are none.
+    _leaves:
+        An index of the leaf subtrees of this prefix tree, keyed by the value
+        stored in the leaf, or None if there are none.
+    _seq:
+        The insertion sequence number of the value whose insertion created
+        this prefix tree. Used to break ties between subtrees of equal weight.
+    _max_leaf:
+        The largest weight of a leaf in this prefix tree (the weight of the
+        leaf itself if this tree is a leaf). This bounds the weight of every
+        value that autocomplete could return from this tree.
+    _top:
+        If this tree is not a leaf and caching is on, its (up to)
+        _settings.top_k heaviest leaves in the order autocomplete returns
+        them, so that autocomplete(prefix, limit) with limit <= top_k is a
+        descent followed by a slice. Otherwise None.
 
     === Representation invariants ===
     - self.weight >= 0
@@ -112,6 +504,11 @@ class SimplePrefixTree(Autocompleter):
         If len(self.subtrees) > 0, then self.value is a list (*common prefix*),
         and self.weight > 0 (*aggregate weight*).
 
+    - self._children and self._leaves together index exactly the trees in
+      self.subtrees, and every subtree's _parent is self.
+    - If self is not a leaf and caching is on, self._top == the first
+      min(top_k, self._leaf_count) leaves of self._best_first().
+
     - ("prefixes grow by 1")
       If len(self.subtrees) > 0, and subtree in self.subtrees, and subtree
       is non-empty and not a leaf, then
@@ -120,46 +517,289 @@ class SimplePrefixTree(Autocompleter):
 
     - self.subtrees does not contain any empty prefix trees.
     - self.subtrees is *sorted* in non-increasing order of their weights.
-      (You can break ties any way you like.)
+      Ties are broken by _seq, so older subtrees come first.
       Note that this applies to both leaves and non-leaf subtrees:
       both can appear in the same self.subtrees list, and both have a `weight`
       attribute.
     """
-    value: Any
+    __slots__ = ('weight', '_value', '_parent', '_subtrees', '_settings',
+                 '_leaf_count', '_sum_weight', '_children', '_leaves', '_seq',
+                 '_max_leaf', '_top')
     weight: float
-    subtrees: List[SimplePrefixTree]
-    weight_type: str
+    _value: Any
+    _parent: Optional[SimplePrefixTree]
+    _subtrees: Optional[List[SimplePrefixTree]]
+    _settings: _TreeSettings
     _leaf_count: int
     _sum_weight: float
+    _children: Optional[Dict[Any, SimplePrefixTree]]
+    _leaves: Optional[Dict[Any, SimplePrefixTree]]
+    _seq: int
+    _max_leaf: float
+    _top: Optional[List[SimplePrefixTree]]
 
-    def __init__(self, weight_type: str) -> None:
+    def __init__(self, weight_type: str, top_k: int = 0) -> None:
         """Initialize an empty simple prefix tree.
 
         Precondition: weight_type == 'sum' or weight_type == 'average'.
+                      top_k >= 0
 
         The given <weight_type> value specifies how the aggregate weight
         of non-leaf trees should be calculated (see the assignment handout
         for details).
+
+        If <top_k> is positive, every non-leaf tree caches its <top_k>
+        heaviest values, which speeds up autocomplete with a limit of at most
+        <top_k> at the cost of memory.
         """
-        self.value = []
-        self.subtrees = []
-        self.weight = 0.0
-        self.weight_type = weight_type
-        self._leaf_count = 0
-        self._sum_weight = 0.0
+        self._settings = _TreeSettings(weight_type, top_k)
+        self._parent = None
+        self._seq = 0
+        self._clear()
+
+    @classmethod
+    def _new_tree(cls, settings: _TreeSettings, parent: SimplePrefixTree,
+                  value: Any, seq: int, leaf: bool) -> SimplePrefixTree:
+        """Return a new empty tree to be added as a subtree of <parent>.
+
+        <value> is the value stored in the new tree if <leaf> is True, and
+        the label of the edge leading to it otherwise.
+        """
+        tree = cls.__new__(cls)
+        tree._settings = settings
+        tree._parent = parent
+        tree._value = value
+        tree._seq = seq
+        tree.weight = 0.0
+        tree._leaf_count = 0
+        tree._sum_weight = 0.0
+        tree._children = None
+        tree._leaves = None
+        tree._max_leaf = 0.0
+        if leaf:
+            tree._subtrees = None
+            tree._top = None
+        else:
+            tree._subtrees = []
+            tree._top = [] if settings.top_k > 0 else None
+        return tree
+
+    @classmethod
+    def from_items(cls, weight_type: str,
+                   items: Iterable[Tuple[Any, float, List]],
+                   top_k: int = 0) -> SimplePrefixTree:
+        """Return a new prefix tree storing <items>, (value, weight, prefix)
+        triples.
+
+        The tree is identical to the one made by inserting the triples into
+        cls(weight_type, top_k) one by one, in order (so insert's
+        preconditions apply to them). Aggregate weights are summed in a
+        different order, though, which can change them in the last bit if
+        the weights are not whole numbers.
+
+        Rather than walking down from the root for every triple, this sorts
+        the triples by prefix and then builds the tree bottom-up in one
+        pass: a tree's aggregates and the order of its subtrees are
+        computed once, after all of its subtrees have been built.
+
+        The build makes no garbage, so the cyclic garbage collector is
+        paused meanwhile; otherwise it would repeatedly rescan the growing
+        tree.
+        """
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return cls._build_bulk(weight_type, items, top_k)
+        finally:
+            if enabled:
+                gc.enable()
+
+    @classmethod
+    def _build_bulk(cls, weight_type: str,
+                    items: Iterable[Tuple[Any, float, List]],
+                    top_k: int) -> SimplePrefixTree:
+        """Return from_items(weight_type, items, top_k), without pausing the
+        garbage collector.
+        """
+        tree = cls(weight_type, top_k)
+        # Prefix elements are replaced by ids (in order of first appearance)
+        # so that prefixes can be sorted whatever their elements are.
+        ids = {}
+        count = 0
+        keyed = []
+        for value, weight, prefix in items:
+            try:
+                key = [ids[element] for element in prefix]
+            except (KeyError, TypeError):
+                # A new or unhashable element.
+                key = []
+                for element in prefix:
+                    i = _index_get(ids, element)
+                    if i is None:
+                        i = count
+                        count += 1
+                        ids = _index_set(ids, element, i)
+                    key.append(i)
+            keyed.append((key, _next_seq(), value, weight, prefix))
+        keyed.sort(key=lambda x: x[0])
+
+        # <stack> holds the trees on the path to the last value, with the
+        # lengths of their prefixes, from the root down. A tree is complete
+        # (and is attached to its parent) once it is popped, which happens
+        # when the next prefix leaves it.
+        settings = tree._settings
+        stack = [(0, tree)]
+        last_key = []
+        last_prefix = []
+        for key, seq, value, weight, prefix in keyed:
+            n = 0
+            end = min(len(key), len(last_key))
+            while n < end and key[n] == last_key[n]:
+                n += 1
+            while stack[-1][0] > n:
+                depth, subtree = stack.pop()
+                if stack[-1][0] < n:
+                    # <prefix> leaves the edge to <subtree> partway.
+                    stack.append((n, cls._new_tree(settings, None, None, seq,
+                                                   False)))
+                stack[-1][1]._attach_bulk(stack[-1][0], subtree, depth,
+                                          last_prefix)
+            for depth in cls._bulk_depths(n, len(key)):
+                stack.append((depth, cls._new_tree(settings, None, None, seq,
+                                                   False)))
+            last_key = key
+            last_prefix = prefix
+
+            parent = stack[-1][1]
+            leaf = _index_get(parent._leaves, value)
+            if leaf is None:
+                leaf = cls._new_tree(settings, parent, value, seq, True)
+                leaf.weight = float(weight)
+                leaf._leaf_count = 1
+                leaf._sum_weight = weight
+                parent._subtrees.append(leaf)
+                parent._leaves = _index_set(parent._leaves, value, leaf)
+            else:
+                leaf.weight += weight
+                leaf._sum_weight += weight
+            leaf._max_leaf = leaf.weight
+        while len(stack) > 1:
+            depth, subtree = stack.pop()
+            stack[-1][1]._attach_bulk(stack[-1][0], subtree, depth,
+                                      last_prefix)
+        tree._finish_bulk()
+        return tree
+
+    @staticmethod
+    def _bulk_depths(start: int, end: int) -> Iterable[int]:
+        """Return the lengths of the prefixes of the non-leaf trees
+        from_items must add below one whose prefix has length <start> to
+        reach one whose prefix has length <end>.
+        """
+        return range(start + 1, end + 1)
+
+    def _attach_bulk(self, depth: int, subtree: SimplePrefixTree,
+                     subtree_depth: int, prefix: List) -> None:
+        """Finish <subtree> and add it to the subtrees of this tree, for
+        from_items.
+
+        <depth> and <subtree_depth> are the lengths of the prefixes of this
+        tree and <subtree>, both of which are prefixes of <prefix>.
+        """
+        subtree._parent = self
+        subtree._finish_bulk()
+        subtree._value = prefix[depth]
+        self._subtrees.append(subtree)
+        self._children = _index_set(self._children, prefix[depth], subtree)
+
+    def _finish_bulk(self) -> None:
+        """Compute the aggregates of this tree from its subtrees and sort
+        them, once from_items has built all of them.
+        """
+        subtrees = self._subtrees
+        if not subtrees:
+            return
+        first = subtrees[0]
+        leaf_count = first._leaf_count
+        sum_weight = 0.0 + first._sum_weight
+        max_leaf = first._max_leaf
+        seq = first._seq
+        for i in range(1, len(subtrees)):
+            subtree = subtrees[i]
+            leaf_count += subtree._leaf_count
+            sum_weight += subtree._sum_weight
+            if subtree._max_leaf > max_leaf:
+                max_leaf = subtree._max_leaf
+            if subtree._seq < seq:
+                seq = subtree._seq
+        self._leaf_count = leaf_count
+        self._sum_weight = sum_weight
+        self._max_leaf = max_leaf
+        if self._parent is not None:
+            # The insert that would have made this tree is the first one
+            # with a value in it.
+            self._seq = seq
+        if self._settings.weight_type == 'sum':
+            self.weight = float(self._sum_weight)
+        else:
+            self.weight = float(self._sum_weight / self._leaf_count)
+        if len(subtrees) > 1:
+            self._sort_subtrees()
+        if self._top is not None:
+            self._rebuild_top()
+
+    @property
+    def value(self) -> Any:
+        """The value stored in this leaf, or the prefix of this non-leaf tree.
+        """
+        if self._subtrees is None:
+            return self._value
+        return self._prefix()
+
+    @property
+    def subtrees(self) -> List[SimplePrefixTree]:
+        """The subtrees of this prefix tree ([] for a leaf)."""
+        if self._subtrees is None:
+            return []
+        return self._subtrees
+
+    @property
+    def weight_type(self) -> str:
+        """The weight type shared by every tree object in this prefix tree."""
+        return self._settings.weight_type
+
+    def _prefix(self) -> List:
+        """Return the prefix of this non-leaf tree.
+
+        The prefix is rebuilt by following _parent up to the root, so this
+        takes time proportional to its length.
+        """
+        prefix = []
+        tree = self
+        while tree._parent is not None:
+            prefix.append(tree._value)
+            tree = tree._parent
+        prefix.reverse()
+        return prefix
+
+    def _key(self) -> Any:
+        """Return the key of this non-leaf tree in its parent's _children."""
+        return self._value
+
+    def _edge(self) -> Tuple:
+        """Return the elements the prefix of this non-leaf tree adds to its
+        parent's (all of them at the root).
+        """
+        if self._parent is None:
+            return ()
+        return (self._value,)
 
     def __len__(self) -> int:
         """Return the number of values (leaves) stored in this SimplePrefixTree.
+
+        This is _leaf_count, which insert and remove keep up to date.
         """
-        if self.is_empty():
-            return 0
-        elif self.is_leaf():
-            return 1
-        else:
-            count = 0
-            for subtree in self.subtrees:
-                count = count + len(subtree)
-            return count
+        return self._leaf_count
 
     def insert(self, value: Any, weight: float, prefix: List) -> None:
         """Insert the given value into this SimplePrefixTree.
@@ -177,90 +817,269 @@ class SimplePrefixTree(Autocompleter):
                 1) not in this SimplePrefixTree
                 2) was previously inserted with the SAME prefix sequence
         """
-        update_leaf = self._insert_helper(value, weight, prefix, 1,
-                                          self.weight_type)
-        self._update_weight(self.weight_type, update_leaf, weight)
-        self._sort_subtrees()
-
-    def _insert_helper(self, value: Any, weight: float, prefix: List,
-                       i: int, wtype: str) -> bool:
-        """A helper function for insert.
-        """
-        if i <= len(prefix):
-            if prefix[0:i] in [x.value for x in self.subtrees]:
-                index = [x.value for x in self.subtrees].index(prefix[0:i])
-                update_leaf = self.subtrees[index]._insert_helper(value, weight,
-                                                                  prefix, i + 1,
-                                                                  wtype)
-                self.subtrees[index]._update_weight(wtype, update_leaf, weight)
-                self.subtrees[index]._sort_subtrees()
-            else:
-                newtree = SimplePrefixTree(wtype)
-                newtree.value = prefix[0:i]
-                self.subtrees.append(newtree)
-                update_leaf = newtree._insert_helper(value, weight, prefix,
-                                                     i + 1, wtype)
-                newtree._update_weight(wtype, update_leaf, weight)
-                newtree._sort_subtrees()
-            return update_leaf
+        self._settings.version += 1
+        if self._settings.scale != 1.0:
+            weight /= self._settings.scale
+        seq = _next_seq()
+        path = [self]
+        tree = self
+        for key in prefix:
+            subtree = _index_get(tree._children, key)
+            if subtree is None:
+                subtree = SimplePrefixTree._new_tree(self._settings, tree, key,
+                                                     seq, False)
+                tree._subtrees.append(subtree)
+                tree._children = _index_set(tree._children, key, subtree)
+            path.append(subtree)
+            tree = subtree
+        update_leaf, leaf = tree._add_to_leaf(value, weight, seq)
+        self._update_path(path, update_leaf, weight, leaf)
+
+    def decay(self, factor: float) -> None:
+        """Multiply the weight of every value in this prefix tree by
+        <factor>, for example to let old query counts fade.
+
+        This takes constant time: the stored weights are all relative to one
+        scale, and only the scale changes. Every leaf weight, and so every
+        aggregate weight (under both 'sum' and 'average'), is multiplied by
+        the same factor, so the order of the subtrees and the cached _top
+        lists stay correct. New weights are stored divided by the scale, so
+        once the scale drifts too far from 1, it is folded back into the
+        stored weights in one pass over the tree (see _rescale), to keep them
+        from overflowing or losing precision.
+
+        To halve every weight each week, call decay(0.5 ** (1 / n)) n times
+        a week.
+
+        Precondition: factor > 0
+        """
+        settings = self._settings
+        settings.version += 1
+        settings.scale *= factor
+        if not _MIN_SCALE <= settings.scale <= _MAX_SCALE:
+            self._rescale()
+
+    def _rescale(self) -> None:
+        """Multiply every weight stored in this prefix tree by its scale,
+        and set the scale to 1.
+        """
+        scale = self._settings.scale
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            tree.weight *= scale
+            tree._sum_weight *= scale
+            tree._max_leaf *= scale
+            if tree._subtrees is not None:
+                stack.extend(tree._subtrees)
+        self._settings.scale = 1.0
+
+    def _add_to_leaf(self, value: Any, weight: float,
+                     seq: int) -> Tuple[bool, SimplePrefixTree]:
+        """Add <weight> to the leaf subtree of this tree storing <value>,
+        creating the leaf (with sequence number <seq>) if it doesn't exist.
+
+        Return whether a new leaf was created, and the leaf storing <value>.
+        """
+        leaf = _index_get(self._leaves, value)
+        if leaf is not None:
+            leaf.weight += weight
+            leaf._sum_weight += weight
+            leaf._max_leaf = leaf.weight
+            self._reposition(leaf)
+            return False, leaf
         else:
-            if value in [x.value for x in self.subtrees]:
-                index = [x.value for x in self.subtrees].index(value)
-                self.subtrees[index].weight += weight
-                self.subtrees[index]._sum_weight += weight
-                return False
-            else:
-                endtree = SimplePrefixTree(wtype)
-                endtree.value = value
-                endtree.weight = float(weight)
-                endtree._leaf_count = 1
-                endtree._sum_weight = weight
-                self.subtrees.append(endtree)
-                return True
+            endtree = self._new_tree(self._settings, self, value, seq, True)
+            endtree.weight = float(weight)
+            endtree._leaf_count = 1
+            endtree._sum_weight = weight
+            endtree._max_leaf = endtree.weight
+            self._subtrees.append(endtree)
+            self._leaves = _index_set(self._leaves, value, endtree)
+            self._reposition(endtree)
+            return True, endtree
 
     def remove(self, prefix: List) -> None:
         """Remove all values that match the given prefix.
+
+        Only the trees on the path to <prefix> are updated, so no matter how
+        many values are removed, this takes O(len(prefix) * fanout) time,
+        plus O(len(prefix) * fanout * top_k) to rebuild the top-k caches if
+        there are any, where fanout is the largest number of subtrees of a
+        tree on the path: every tree on the path finds the largest leaf
+        weight among its subtrees and repositions its subtree on the path.
+        """
+        self._settings.version += 1
+        path = [self]
+        for key in prefix:
+            tree = _index_get(path[-1]._children, key)
+            if tree is None:
+                return
+            path.append(tree)
+        if len(path) == 1:
+            self._clear()
+            return
+
+        removed = path.pop()
+        path[-1]._detach(removed)
+        # Trees whose only values were removed are removed as well.
+        while len(path) > 1 and path[-1]._subtrees == []:
+            empty = path.pop()
+            path[-1]._detach(empty)
+        self._repair_ancestors(path, removed)
+
+    def _update_weight(self, wtype: str, update_leaf: bool, weight: float,
+                       leaf: SimplePrefixTree) -> None:
+        """Update the aggregates of this tree after <weight> was added to
+        the weight of <leaf>, one of its leaves.
         """
-        # self._remove_helper(prefix, 1, self)
-        pass
-
-    def _remove_helper(self, prefix: List, i: int,
-                       prev: SimplePrefixTree) -> None:
-        # if i <= len(prefix):
-        #     if prefix[0:i] not in [x.value for x in self.subtrees]:
-        #         return None
-        #     index = [x.value for x in self.subtrees].index(prefix[0:i])
-        #     empty = self.subtrees[index]._remove_helper(prefix, i + 1, self)
-        #     if empty:
-        #         index = prev.subtrees.index(self)
-        #         prev.subtrees.pop(index)
-        #         return len(prev.subtrees == 0)
-        #     return False
-        # else:
-        #     index = prev.subtrees.index(self)
-        #     prev.subtrees.pop(index)
-        #     return len(prev.subtrees == 0)
-        pass
-
-    def _update_weight(self, wtype: str, update_leaf: bool, weight: float) \
-            -> None:
         if update_leaf:
             self._leaf_count += 1
             self._sum_weight += weight
         else:
             self._sum_weight += weight
 
+        if leaf.weight > self._max_leaf:
+            self._max_leaf = leaf.weight
+        if self._top is not None:
+            self._offer_top(leaf)
+
         if wtype == 'sum':
             self.weight = float(self._sum_weight)
         else:
             self.weight = float(self._sum_weight / self._leaf_count)
 
+    def _update_path(self, path: List[SimplePrefixTree], update_leaf: bool,
+                     weight: float, leaf: SimplePrefixTree) -> None:
+        """Update the aggregates of the trees in <path> after <weight> was
+        added to the weight of <leaf>, and restore the order of their
+        subtrees.
+
+        <path> is a list of trees from this tree (the root) down to the
+        parent of <leaf>. <update_leaf> is whether <leaf> is new.
+        """
+        wtype = self._settings.weight_type
+        for i in range(len(path) - 1, -1, -1):
+            path[i]._update_weight(wtype, update_leaf, weight, leaf)
+            if i > 0:
+                path[i - 1]._reposition(path[i])
+
+    def _repair_ancestors(self, path: List[SimplePrefixTree],
+                          removed: SimplePrefixTree) -> None:
+        """Update the aggregates of the trees in <path> after <removed> was
+        detached from path[-1].
+
+        <path> is a list of trees from this tree (the root) down to the
+        former parent of <removed>. Only these trees are visited, and the
+        subtrees of <removed> are never looked at.
+        """
+        for i in range(len(path) - 1, -1, -1):
+            tree = path[i]
+            tree._leaf_count -= removed._leaf_count
+            tree._sum_weight -= removed._sum_weight
+            if tree._leaf_count == 0:
+                tree.weight = 0.0
+                tree._sum_weight = 0.0
+                tree._max_leaf = 0.0
+            else:
+                if self.weight_type == 'sum':
+                    tree.weight = float(tree._sum_weight)
+                else:
+                    tree.weight = float(tree._sum_weight / tree._leaf_count)
+                if removed._max_leaf >= tree._max_leaf:
+                    tree._max_leaf = max(x._max_leaf for x in tree._subtrees)
+            if tree._top is not None:
+                tree._rebuild_top()
+            if i > 0 and tree._leaf_count > 0:
+                path[i - 1]._reposition(tree)
+
+    def _detach(self, subtree: SimplePrefixTree) -> None:
+        """Remove the non-leaf <subtree> from this tree's subtrees.
+
+        The aggregates of this tree are not updated.
+        """
+        self._subtrees.remove(subtree)
+        self._children = _index_pop(self._children, subtree._key())
+
+    def _clear(self) -> None:
+        """Make this tree empty."""
+        self._value = None
+        self._subtrees = []
+        self.weight = 0.0
+        self._leaf_count = 0
+        self._sum_weight = 0.0
+        self._children = None
+        self._leaves = None
+        self._max_leaf = 0.0
+        self._top = [] if self._settings.top_k > 0 else None
+
     def _sort_subtrees(self) -> None:
         """Helper method that sorts a simple prefix tree's list of subtrees.
         """
-        asc = sorted(self.subtrees, key=lambda x: x.weight)
-        asc.reverse()
-        self.subtrees = asc
+        self._subtrees.sort(key=lambda x: (-x.weight, x._seq))
+
+    def _reposition(self, subtree: SimplePrefixTree) -> None:
+        """Move <subtree> to its sorted position in self.subtrees.
+
+        Only <subtree>'s weight may have changed since self.subtrees was last
+        sorted, so it is shifted towards the front or back of the list
+        until it is back in order; the other subtrees keep their positions.
+        """
+        subtrees = self._subtrees
+        i = subtrees.index(subtree)
+        weight, seq = subtree.weight, subtree._seq
+        j = i
+        while j > 0 and (subtrees[j - 1].weight < weight or
+                         (subtrees[j - 1].weight == weight and
+                          subtrees[j - 1]._seq > seq)):
+            j -= 1
+        if j == i:
+            last = len(subtrees) - 1
+            while j < last and (subtrees[j + 1].weight > weight or
+                                (subtrees[j + 1].weight == weight and
+                                 subtrees[j + 1]._seq < seq)):
+                j += 1
+        if j != i:
+            subtrees.insert(j, subtrees.pop(i))
+
+    def _offer_top(self, leaf: SimplePrefixTree) -> None:
+        """Update self._top after the weight of <leaf>, one of this tree's
+        leaves, increased.
+        """
+        top = self._top
+        if leaf in top:
+            i = top.index(leaf)
+        elif len(top) < self._settings.top_k:
+            i = len(top)
+            top.append(leaf)
+        elif (leaf.weight > top[-1].weight or
+              (leaf.weight == top[-1].weight and leaf._seq < top[-1]._seq)):
+            i = len(top) - 1
+            top[i] = leaf
+        else:
+            return
+        weight, seq = leaf.weight, leaf._seq
+        while i > 0 and (top[i - 1].weight < weight or
+                         (top[i - 1].weight == weight and
+                          top[i - 1]._seq > seq)):
+            top[i] = top[i - 1]
+            i -= 1
+        top[i] = leaf
+
+    def _rebuild_top(self) -> None:
+        """Recompute self._top from the subtrees of this tree.
+
+        Every leaf in self._top must be in the _top of one of the subtrees
+        (or be a subtree itself), so only those candidates are considered.
+        """
+        candidates = []
+        for subtree in self._subtrees:
+            if subtree._subtrees is None:
+                candidates.append(subtree)
+            else:
+                candidates.extend(subtree._top)
+        self._top = heapq.nsmallest(self._settings.top_k, candidates,
+                                    key=lambda x: (-x.weight, x._seq))
 
     def autocomplete(self, prefix: List,
                      limit: Optional[int] = None) -> List[Tuple[Any, float]]:
@@ -273,61 +1092,351 @@ class SimplePrefixTree(Autocompleter):
 
         Precondition: limit is None or limit > 0.
         """
-        return self._autocomplete_helper(prefix, 1, limit)
+        tree = self._find(prefix)
+        if tree is None:
+            return []
+        return tree._matches(limit)
 
-    def _autocomplete_helper(self, prefix: list, i: int,
-                             limit: Optional[int]
-                             = None) -> List[Tuple[Any, float]]:
-        if i <= len(prefix):
-            if prefix[0:i] not in [x.value for x in self.subtrees]:
-                return []
-            index = [x.value for x in self.subtrees].index(prefix[0:i])
-            x = self.subtrees[index]._autocomplete_helper(prefix, i + 1, limit)
-            return x
-        else:
-            if limit is None:
-                results = self._no_limit_items()
-                results = sorted(results, key=lambda x: x[1], reverse=True)
-                return results
-            else:
-                results = self._limited_items(limit)
-                results = sorted(results, key=lambda x: x[1], reverse=True)
-                return results
+    def iter_autocomplete(self, prefix: List) -> Iterator[Tuple[Any, float]]:
+        """Yield the matches for the given prefix, as tuples (value, weight),
+        in the order autocomplete(prefix) returns them.
 
-    def _no_limit_items(self) -> List[Tuple[Any, float]]:
-        """Helper method for autocomplete.
+        The matches come from _best_first, so the memory used grows with the
+        part of the tree searched so far rather than with the number of
+        matches. This tree must not be changed while the generator is in use.
+        """
+        tree = self._find(prefix)
+        if tree is not None:
+            scale = self._settings.scale
+            for leaf in tree._best_first():
+                yield leaf._value, leaf.weight * scale
+
+    def _find(self, prefix: List) -> Optional[SimplePrefixTree]:
+        """Return the highest tree in this tree whose values all match
+        <prefix>, or None if no value matches <prefix>.
+        """
+        tree = self
+        for key in prefix:
+            tree = _index_get(tree._children, key)
+            if tree is None:
+                return None
+        return tree
+
+    def fuzzy_autocomplete(self, prefix: List, distance: int,
+                           limit: Optional[int] = None,
+                           penalty: float = 0.1) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the values whose prefix sequence
+        starts with a sequence at most <distance> edits (insertions,
+        deletions or substitutions of one element) away from <prefix>.
+
+        The distance of a value is the fewest edits turning <prefix> into a
+        prefix of the value's prefix sequence. Matches are ranked by their
+        weight times penalty ** distance, so each edit makes a match count
+        for less; ties are broken as in autocomplete, which this is when
+        <distance> is 0. The return value is a list of tuples
+        (value, weight), in that order (so not always in non-increasing
+        weight).
+
+        If limit is None, return *every* match.
+
+        Precondition: distance >= 0, 0 < penalty <= 1, and limit is None or
+        limit > 0.
+        """
+        scale = self._settings.scale
+        leaves = itertools.islice(
+            self._fuzzy_best_first(prefix, distance, penalty), limit)
+        return [(leaf._value, leaf.weight * scale) for leaf in leaves]
+
+    def approximate_autocomplete(self, prefix: List, tolerance: int,
+                                 mismatches: int = 0,
+                                 limit: Optional[int] = None,
+                                 penalty: float = 0.1) \
+            -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the values whose prefix sequence
+        (of numbers) starts with a sequence close to <prefix>: each element
+        is within <tolerance> of the element of <prefix> in the same
+        position, except for at most <mismatches> elements, which can be
+        anything.
+
+        Matches are ranked by their weight times penalty ** (the number of
+        elements more than <tolerance> away), so elements within
+        <tolerance> count as equal; ties are broken as in autocomplete,
+        which this is when <tolerance> and <mismatches> are 0. The return
+        value is a list of tuples (value, weight), in that order.
+
+        If limit is None, return *every* match.
+
+        Precondition: the prefix sequences are sequences of numbers,
+        <tolerance> is a whole number, tolerance >= 0, mismatches >= 0,
+        0 < penalty <= 1, and limit is None or limit > 0.
+        """
+        scale = self._settings.scale
+        leaves = itertools.islice(self._approximate_best_first(
+            prefix, tolerance, mismatches, penalty), limit)
+        return [(leaf._value, leaf.weight * scale) for leaf in leaves]
+
+    def autocomplete_many(self, prefixes: List[List],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[Any, float]]]:
+        """Return the list autocomplete(prefix, limit) returns for each
+        prefix in <prefixes>, in order.
+
+        The distinct prefixes are walked in sorted order (see _walk_sorted),
+        and the matches of a tree are found once however many prefixes lead
+        to it. A prefix leads to the same tree as its longest prefix whose
+        tree has as many leaves (those trees have the same leaves, and so the
+        same matches).
+
+        Precondition: limit is None or limit > 0.
+        """
+        return _autocomplete_many(self, prefixes, limit)
+
+    def _walk_start(self) -> Tuple[SimplePrefixTree, SimplePrefixTree, int]:
+        """Return the walk state for the empty prefix.
+
+        A walk state for a prefix is a tuple (matching, tree, end): <tree> is
+        the highest tree whose values all match the prefix, <end> is the
+        length of the prefix of <tree>, and <matching> is the highest tree
+        with the same leaves as <tree> (so with the same matches).
+        """
+        return self, self, len(self._edge())
+
+    def _walk_step(self, state: Tuple[SimplePrefixTree, SimplePrefixTree, int],
+                   depth: int, element: Any) \
+            -> Optional[Tuple[SimplePrefixTree, SimplePrefixTree, int]]:
+        """Return the walk state for prefix[:depth + 1], where <state> is the
+        walk state for prefix[:depth] and prefix[depth] is <element>, or None
+        if no value matches prefix[:depth + 1].
+        """
+        matching, tree, end = state
+        subtree, end = tree._step(element, depth, end)
+        if subtree is None:
+            return None
+        elif subtree._leaf_count != tree._leaf_count:
+            matching = subtree
+        return matching, subtree, end
+
+    @staticmethod
+    def _walk_matches(state: Tuple[SimplePrefixTree, SimplePrefixTree, int],
+                      limit: Optional[int]) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the prefix with walk state
+        <state>, as autocomplete does.
+        """
+        return state[0]._matches(limit)
+
+    def _walk_version(self) -> int:
+        """Return the number of times this tree has been changed, so that
+        walk states can be checked for being out of date.
+        """
+        return self._settings.version
 
-        Returns all items from this prefix tree.
+    def _step(self, element: Any, depth: int,
+              end: int) -> Tuple[Optional[SimplePrefixTree], int]:
+        """Return the highest tree whose values all match prefix[:depth + 1],
+        and the length of that tree's prefix, where prefix[depth] is
+        <element>, this is the highest tree whose values all match
+        prefix[:depth], and <end> is the length of this tree's prefix.
 
-        The return value is a list of tuples (value, weight), this is not
-        ordered.
+        Return (None, 0) if no value matches prefix[:depth + 1].
         """
-        if self.is_leaf():
-            return [(self.value, self.weight)]
+        subtree = _index_get(self._children, element)
+        if subtree is None:
+            return None, 0
+        return subtree, depth + 1
+
+    def _matches(self, limit: Optional[int]) -> List[Tuple[Any, float]]:
+        """Return up to <limit> (value, weight) tuples for the leaves of
+        this tree, in non-increasing order of weight (ties broken by _seq).
+
+        If limit is None, return every leaf.
+        """
+        if limit is not None and limit <= self._settings.top_k:
+            leaves = self._top[:limit]
+        elif limit is None or self._leaf_count <= limit:
+            leaves = []
+            self._no_limit_items(leaves)
+            leaves.sort(key=lambda x: (-x.weight, x._seq))
         else:
-            items = []
-            for subtree in self.subtrees:
-                items = items + subtree._no_limit_items()
-            return items
+            leaves = itertools.islice(self._best_first(), limit)
+        scale = self._settings.scale
+        if scale == 1.0:
+            return [(leaf._value, leaf.weight) for leaf in leaves]
+        return [(leaf._value, leaf.weight * scale) for leaf in leaves]
+
+    def _no_limit_items(self, leaves: List[SimplePrefixTree]) -> None:
+        """Helper method for autocomplete.
 
-    def _limited_items(self, limit: int) -> List[Tuple[Any, float]]:
+        Append every leaf of this prefix tree to <leaves>, in no particular
+        order.
+        """
+        if self._subtrees is None:
+            leaves.append(self)
+            return
+        stack = [self._subtrees]
+        while stack:
+            for subtree in stack.pop():
+                if subtree._subtrees is None:
+                    leaves.append(subtree)
+                else:
+                    stack.append(subtree._subtrees)
+
+    def _best_first(self) -> Iterator[SimplePrefixTree]:
         """Helper method for autocomplete.
 
-        Returns <limit> of the highest-weighted items from this prefix tree.
+        Yield the leaves of this prefix tree in non-increasing order of
+        weight, breaking ties by _seq.
 
-        The return value is a list of tuples (value, weight), and must be
-        ordered in non-increasing weight.
+        Subtrees wait in a priority queue keyed by (-_max_leaf, _seq), which
+        is a lower bound on the (-weight, _seq) key of every leaf in them
+        (a subtree is never newer than its leaves). So a leaf is only yielded
+        once no unexplored subtree could contain a leaf that comes before it,
+        and taking the first k leaves expands only the subtrees that could
+        hold one of the top k values.
         """
-        if limit == 0:
-            return []
-        if self.is_leaf():
-            return [(self.value, self.weight)]
-        else:
-            items = []
-            lim = limit
-            for subtree in self.subtrees:
-                items = items + subtree._limited_items(lim - len(items))
-            return items
+        # Queue entries are (-bound, _seq, is_leaf, tiebreak, tree).
+        tiebreak = itertools.count()
+        queue = [(-self._max_leaf, self._seq, self.is_leaf(), 0, self)]
+        while queue:
+            _, _, is_leaf, _, tree = heapq.heappop(queue)
+            if is_leaf:
+                yield tree
+            else:
+                for subtree in tree._subtrees:
+                    heapq.heappush(queue, (-subtree._max_leaf, subtree._seq,
+                                           subtree._subtrees is None,
+                                           next(tiebreak), subtree))
+
+    def _fuzzy_best_first(self, prefix: List, distance: int,
+                          penalty: float) -> Iterator[SimplePrefixTree]:
+        """Helper method for fuzzy_autocomplete.
+
+        Yield the leaves of this prefix tree at most <distance> edits away
+        from <prefix>, in non-increasing order of weight times
+        penalty ** distance, breaking ties by _seq.
+
+        This is _best_first with each subtree keyed by _max_leaf times
+        penalty ** bound, where the bound (see _fuzzy_edge) is at most the
+        distance of every value in it. A subtree is first queued with its
+        parent's bound (which is at most its own), and its edit distance row
+        is only computed once it is taken from the queue; it is then queued
+        again if its own bound is larger, and dropped if that is more than
+        <distance>. Once no edits are left, the subtrees that can still
+        match are looked up in _children (see _fuzzy_branches) rather than
+        tried one by one.
+        """
+        row, best, bound = _fuzzy_edge(prefix, _fuzzy_start(prefix),
+                                       len(prefix), self._edge())
+        if bound > distance:
+            return
+        # Queue entries are (-key, _seq, tiebreak, tree, row, distance,
+        # bound, known), where the row, distance and bound are the parent's
+        # unless <known>.
+        tiebreak = itertools.count()
+        queue = [(-self._max_leaf * penalty ** bound, self._seq, 0, self, row,
+                  best, bound, True)]
+        while queue:
+            _, _, _, tree, row, best, bound, known = heapq.heappop(queue)
+            if tree._subtrees is None:
+                yield tree
+                continue
+            if not known:
+                row, best, own = _fuzzy_edge(prefix, row, best, tree._edge())
+                if own > distance:
+                    continue
+                elif own > bound:
+                    heapq.heappush(queue, (
+                        -tree._max_leaf * penalty ** own, tree._seq,
+                        next(tiebreak), tree, row, best, own, True))
+                    continue
+            if best > distance and bound == distance:
+                subtrees = tree._fuzzy_branches(prefix, row, distance)
+            else:
+                subtrees = tree._subtrees
+            for subtree in subtrees:
+                if subtree._subtrees is not None:
+                    heapq.heappush(queue, (
+                        -subtree._max_leaf * penalty ** bound, subtree._seq,
+                        next(tiebreak), subtree, row, best, bound, False))
+                elif best <= distance:
+                    heapq.heappush(queue, (
+                        -subtree.weight * penalty ** best, subtree._seq,
+                        next(tiebreak), subtree, None, best, best, True))
+
+    def _fuzzy_branches(self, prefix: List, row: List[int],
+                        distance: int) -> List[SimplePrefixTree]:
+        """Helper method for _fuzzy_best_first.
+
+        Return the non-leaf subtrees of this tree that can hold a value at
+        most <distance> edits away from <prefix>, where <row> is this tree's
+        edit distance row, every entry of which is at least <distance>, and
+        the values directly in this tree are more than <distance> edits
+        away.
+
+        With no edits left, a subtree's first edge label must be some
+        prefix[i] with row[i] == distance (so that it costs no edit), so
+        only those are looked up.
+        """
+        elements = []
+        subtrees = []
+        for i in range(len(prefix)):
+            if row[i] == distance and prefix[i] not in elements:
+                elements.append(prefix[i])
+                subtree = _index_get(self._children, prefix[i])
+                if subtree is not None:
+                    subtrees.append(subtree)
+        return subtrees
+
+    def _approximate_best_first(self, prefix: List, tolerance: int,
+                                mismatches: int, penalty: float) \
+            -> Iterator[SimplePrefixTree]:
+        """Helper method for approximate_autocomplete.
+
+        Yield the leaves of this prefix tree that match <prefix> with at
+        most <mismatches> mismatches, in non-increasing order of weight times
+        penalty ** (their number of mismatches), breaking ties by _seq.
+
+        This is _best_first with each subtree keyed by _max_leaf times
+        penalty ** (the mismatch count of the subtree, which only grows
+        going down). Subtrees with more than <mismatches> mismatches are
+        never entered, and once no mismatches are left, only the subtrees
+        whose first edge label is within <tolerance> of the next element of
+        <prefix> are looked up in _children.
+        """
+        depth, missed = _approximate_edge(prefix, tolerance, 0, 0,
+                                          self._edge())
+        if missed > mismatches:
+            return
+        # Queue entries are (-key, _seq, tiebreak, tree, depth, missed).
+        tiebreak = itertools.count()
+        queue = [(-self._max_leaf * penalty ** missed, self._seq, 0, self,
+                  depth, missed)]
+        while queue:
+            _, _, _, tree, depth, missed = heapq.heappop(queue)
+            if tree._subtrees is None:
+                yield tree
+                continue
+            if depth < len(prefix) and missed == mismatches:
+                subtrees = []
+                for label in range(prefix[depth] - tolerance,
+                                   prefix[depth] + tolerance + 1):
+                    subtree = _index_get(tree._children, label)
+                    if subtree is not None:
+                        subtrees.append(subtree)
+            else:
+                subtrees = tree._subtrees
+            for subtree in subtrees:
+                if subtree._subtrees is not None:
+                    subdepth, submissed = _approximate_edge(
+                        prefix, tolerance, depth, missed, subtree._edge())
+                    if submissed <= mismatches:
+                        heapq.heappush(queue, (
+                            -subtree._max_leaf * penalty ** submissed,
+                            subtree._seq, next(tiebreak), subtree, subdepth,
+                            submissed))
+                elif depth == len(prefix):
+                    heapq.heappush(queue, (
+                        -subtree.weight * penalty ** missed, subtree._seq,
+                        next(tiebreak), subtree, depth, missed))
 
     def is_empty(self) -> bool:
         """Return whether this simple prefix tree is empty."""
@@ -335,7 +1444,15 @@ class SimplePrefixTree(Autocompleter):
 
     def is_leaf(self) -> bool:
         """Return whether this simple prefix tree is a leaf."""
-        return self.weight > 0 and self.subtrees == []
+        return self._subtrees is None
+
+    def freeze(self) -> FrozenPrefixTree:
+        """Return a read-only copy of this prefix tree stored in flat arrays.
+
+        The copy returns exactly what this tree returns from autocomplete, and
+        does not change when this tree does.
+        """
+        return FrozenPrefixTree(self)
 
     def __str__(self) -> str:
         """Return a string representation of this tree.
@@ -351,17 +1468,20 @@ class SimplePrefixTree(Autocompleter):
         """
         if self.is_empty():
             return ''
-        else:
-            s = '  ' * depth + f'{self.value} ({self.weight})\n'
-            for subtree in self.subtrees:
-                s += subtree._str_indented(depth + 1)
-            return s
+        lines = []
+        stack = [(self, depth)]
+        while stack:
+            tree, depth = stack.pop()
+            lines.append('  ' * depth + f'{tree.value} ({tree.weight})\n')
+            for subtree in reversed(tree.subtrees):
+                stack.append((subtree, depth + 1))
+        return ''.join(lines)
 
 
 ################################################################################
 # CompressedPrefixTree (Task 6)
 ################################################################################
-class CompressedPrefixTree(Autocompleter):
+class CompressedPrefixTree(SimplePrefixTree):
     """A compressed prefix tree implementation.
 
     While this class has the same public interface as SimplePrefixTree,
@@ -381,6 +1501,11 @@ class CompressedPrefixTree(Autocompleter):
     subtrees:
         A list of subtrees of this prefix tree.
 
+    The private attributes are the same as SimplePrefixTree's, except that
+    the _value of a non-leaf tree is a tuple: the elements its prefix adds to
+    its parent's (the whole prefix at the root). _children is keyed by the
+    first element of these edge labels.
+
     === Representation invariants ===
     - self.weight >= 0
 
@@ -398,48 +1523,95 @@ class CompressedPrefixTree(Autocompleter):
       This tree does not contain any compressible internal values.
       (See the assignment handout for a definition of "compressible".)
 
+    - If subtree in self.subtrees is not a leaf, then self.value is a proper
+      prefix of subtree.value, and no other subtree in self.subtrees has a
+      prefix starting with self.value + [subtree.value[len(self.value)]].
+
     - self.subtrees does not contain any empty prefix trees.
     - self.subtrees is *sorted* in non-increasing order of their weights.
-      (You can break ties any way you like.)
+      Ties are broken by _seq, so older subtrees come first.
       Note that this applies to both leaves and non-leaf subtrees:
       both can appear in the same self.subtrees list, and both have a `weight`
       attribute.
     """
-    value: Optional[Any]
-    weight: float
+    __slots__ = ()
     subtrees: List[CompressedPrefixTree]
 
-    def __init__(self, weight_type: str) -> None:
-        """Initialize an empty simple prefix tree.
-
-        Precondition: weight_type == 'sum' or weight_type == 'average'.
+    def _prefix(self) -> List:
+        """Return the prefix of this non-leaf tree.
 
-        The given <weight_type> value specifies how the aggregate weight
-        of non-leaf trees should be calculated (see the assignment handout
-        for details).
+        The prefix is rebuilt by following _parent up to the root, so this
+        takes time proportional to its length.
         """
-        self.value = []
-        self.subtrees = []
-        self.weight = 0.0
-        self.weight_type = weight_type
-        self._leaf_count = 0
-        self._sum_weight = 0.0
+        edges = []
+        tree = self
+        while tree is not None:
+            edges.append(tree._value)
+            tree = tree._parent
+        prefix = []
+        for edge in reversed(edges):
+            prefix.extend(edge)
+        return prefix
+
+    def _key(self) -> Any:
+        """Return the key of this non-leaf tree in its parent's _children."""
+        return self._value[0]
+
+    def _edge(self) -> Tuple:
+        """Return the elements the prefix of this non-leaf tree adds to its
+        parent's (all of them at the root).
+        """
+        return self._value
+
+    def _clear(self) -> None:
+        """Make this tree empty."""
+        SimplePrefixTree._clear(self)
+        self._value = ()
+
+    @staticmethod
+    def _bulk_depths(start: int, end: int) -> Iterable[int]:
+        """Return the lengths of the prefixes of the non-leaf trees
+        from_items must add below one whose prefix has length <start> to
+        reach one whose prefix has length <end>.
+        """
+        if end > start:
+            return [end]
+        return []
 
-    def __len__(self) -> int:
-        """Return the number of values (leaves) stored in this SimplePrefixTree.
+    def _attach_bulk(self, depth: int, subtree: SimplePrefixTree,
+                     subtree_depth: int, prefix: List) -> None:
+        """Finish <subtree> and add it to the subtrees of this tree, for
+        from_items.
+
+        <depth> and <subtree_depth> are the lengths of the prefixes of this
+        tree and <subtree>, both of which are prefixes of <prefix>.
         """
-        if self.is_empty():
-            return 0
-        elif self.is_leaf():
-            return 1
-        else:
-            count = 0
-            for subtree in self.subtrees:
-                count = count + len(subtree)
-            return count
+        subtree._parent = self
+        subtree._finish_bulk()
+        subtree._value = tuple(prefix[depth:subtree_depth])
+        self._subtrees.append(subtree)
+        self._children = _index_set(self._children, prefix[depth], subtree)
+
+    def _finish_bulk(self) -> None:
+        """Compute the aggregates of this tree from its subtrees and sort
+        them, once from_items has built all of them.
+
+        The root is merged with its only subtree if it is compressible;
+        from_items only makes the other trees where prefixes branch or
+        values are stored.
+        """
+        SimplePrefixTree._finish_bulk(self)
+        if self._parent is None and self._subtrees:
+            # Like every other tree, the root has the _seq of the first
+            # insert, which matters once its edge label is split.
+            self._seq = min(x._seq for x in self._subtrees)
+            if len(self._subtrees) == 1 and not self._subtrees[0].is_leaf():
+                child = self._subtrees[0]
+                self._value = self._value + child._value
+                self._absorb(child)
 
     def insert(self, value: Any, weight: float, prefix: List) -> None:
-        """Insert the given value into this SimplePrefixTree.
+        """Insert the given value into this CompressedPrefixTree.
 
         The value is inserted with the given weight, and is associated with
         the prefix sequence <prefix>.
@@ -451,80 +1623,2035 @@ class CompressedPrefixTree(Autocompleter):
         Preconditions:
             weight > 0
             The given value is either:
-                1) not in this SimplePrefixTree
+                1) not in this CompressedPrefixTree
                 2) was previously inserted with the SAME prefix sequence
         """
-        update_leaf = self._insert_helper(value, weight, prefix, 1)
-        self._update_weight(self.weight_type, update_leaf, weight)
-        self._sort_subtrees()
-
-    def _insert_helper(self, value: Any, weight: float,
-                       prefix: List, i: int) -> bool:
-        if i < len(prefix):
-            if not self.subtrees:
-                temp = CompressedPrefixTree(self.weight_type)
-                temp.value = prefix
-                new_leaf = CompressedPrefixTree(self.weight_type)
-                new_leaf.weight = weight
-                new_leaf._leaf_count = 1
-                new_leaf._sum_weight = weight
-                temp.subtrees.append(new_leaf)
-
-    def _insert_find_prefix(self, prefix: List):
-        j = 0
-        while j <= len(prefix):
-            if prefix[:j] in [x.value for x in self.subtrees]:
-                return j
-            j += 1
-        return False
+        self._settings.version += 1
+        if self._settings.scale != 1.0:
+            weight /= self._settings.scale
+        seq = _next_seq()
+        if self.is_empty():
+            self._value = tuple(prefix)
+            self._seq = seq
+
+        # Walk down from the root, splitting the edge where <prefix> leaves
+        # the tree, to the tree whose value is <prefix>. <depth> is the
+        # length of the prefix of tree's parent.
+        path = []
+        tree = self
+        depth = 0
+        start = 0
+        while True:
+            n = tree._common_length(prefix, depth, start)
+            if n < len(tree._value):
+                tree._split(n)
+            path.append(tree)
+            depth += n
+            if depth == len(prefix):
+                break
+            subtree = _index_get(tree._children, prefix[depth])
+            if subtree is None:
+                subtree = CompressedPrefixTree._new_tree(
+                    self._settings, tree, tuple(prefix[depth:]), seq, False)
+                tree._subtrees.append(subtree)
+                tree._children = _index_set(tree._children, prefix[depth],
+                                            subtree)
+                path.append(subtree)
+                break
+            tree = subtree
+            start = 1
+
+        update_leaf, leaf = path[-1]._add_to_leaf(value, weight, seq)
+        self._update_path(path, update_leaf, weight, leaf)
+
+    def _common_length(self, prefix: List, depth: int, start: int) -> int:
+        """Return the number of elements of this tree's edge label that
+        match <prefix> from index <depth> on, given that the first <start>
+        are known to match.
+        """
+        edge = self._value
+        n = start
+        end = min(len(edge), len(prefix) - depth)
+        while n < end and edge[n] == prefix[depth + n]:
+            n += 1
+        return n
 
-    def _update_weight(self, update_leaf: bool, weight: float) \
-            -> None:
-        if update_leaf:
-            self._leaf_count += 1
-            self._sum_weight += weight
-        else:
-            self._sum_weight += weight
+    def _split(self, n: int) -> None:
+        """Split the edge leading to this tree after its <n>th element.
 
-        if self.weight_type == 'sum':
-            self.weight = float(self._sum_weight)
-        else:
-            self.weight = float(self._sum_weight / self._leaf_count)
+        This tree keeps its place in its parent but its edge label is
+        shortened to its first <n> elements; everything it stored moves into
+        a new subtree labelled with the rest, which becomes its only subtree.
 
-    def _sort_subtrees(self) -> None:
-        """Helper method that sorts a simple prefix tree's list of subtrees.
+        Precondition: 0 <= n < len(self._value)
         """
-        asc = sorted(self.subtrees, key=lambda x: x.weight)
-        asc.reverse()
-        self.subtrees = asc
+        lower = CompressedPrefixTree._new_tree(self._settings, self,
+                                               self._value[n:], self._seq,
+                                               False)
+        lower._absorb(self)
+        self._value = self._value[:n]
+        self._subtrees = [lower]
+        self._children = _index_set(None, lower._value[0], lower)
+        self._leaves = None
+        if lower._top is not None:
+            self._top = list(lower._top)
+
+    def _absorb(self, other: CompressedPrefixTree) -> None:
+        """Take over the subtrees and aggregates of <other>.
+
+        This is used both to split an edge and to merge a compressible tree
+        with its only subtree. The edge label of this tree is not changed,
+        and <other> should not be used afterwards.
+        """
+        self._subtrees = other._subtrees
+        self.weight = other.weight
+        self._leaf_count = other._leaf_count
+        self._sum_weight = other._sum_weight
+        self._children = other._children
+        self._leaves = other._leaves
+        self._max_leaf = other._max_leaf
+        self._top = other._top
+        for subtree in self._subtrees:
+            subtree._parent = self
 
-    def is_empty(self) -> bool:
-        """Return whether this simple prefix tree is empty."""
-        return self.weight == 0.0
+    def autocomplete(self, prefix: List,
+                     limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the given prefix.
 
-    def is_leaf(self) -> bool:
-        """Return whether this simple prefix tree is a leaf."""
-        return self.weight > 0 and self.subtrees == []
+        The return value is a list of tuples (value, weight), and must be
+        ordered in non-increasing weight. (You can decide how to break ties.)
 
-    def __str__(self) -> str:
-        """Return a string representation of this tree.
+        If limit is None, return *every* match for the given prefix.
 
-        You may find this method helpful for debugging.
+        Precondition: limit is None or limit > 0.
         """
-        return self._str_indented()
+        path = self._locate(prefix)
+        if not path:
+            return []
+        return path[-1]._matches(limit)
 
-    def _str_indented(self, depth: int = 0) -> str:
-        """Return an indented string representation of this tree.
+    def _find(self, prefix: List) -> Optional[CompressedPrefixTree]:
+        """Return the highest tree in this tree whose values all match
+        <prefix>, or None if no value matches <prefix>.
+        """
+        path = self._locate(prefix)
+        if not path:
+            return None
+        return path[-1]
+
+    def _step(self, element: Any, depth: int,
+              end: int) -> Tuple[Optional[CompressedPrefixTree], int]:
+        """Return the highest tree whose values all match prefix[:depth + 1],
+        and the length of that tree's prefix, where prefix[depth] is
+        <element>, this is the highest tree whose values all match
+        prefix[:depth], and <end> is the length of this tree's prefix.
+
+        Return (None, 0) if no value matches prefix[:depth + 1].
+        """
+        if depth < end:
+            # prefix[depth] is still on this tree's edge.
+            if self._value[len(self._value) - end + depth] == element:
+                return self, end
+            return None, 0
+        subtree = _index_get(self._children, element)
+        if subtree is None:
+            return None, 0
+        return subtree, end + len(subtree._value)
 
-        The indentation level is specified by the <depth> parameter.
+    def remove(self, prefix: List) -> None:
+        """Remove all values that match the given prefix.
         """
-        if self.is_empty():
-            return ''
-        else:
-            s = '  ' * depth + f'{self.value} ({self.weight})\n'
-            for subtree in self.subtrees:
-                s += subtree._str_indented(depth + 1)
-            return s
+        self._settings.version += 1
+        path = self._locate(prefix)
+        if not path:
+            return
+        elif len(path) == 1:
+            self._clear()
+            return
+        removed = path.pop()
+        parent = path[-1]
+        parent._detach(removed)
+        self._repair_ancestors(path, removed)
+
+        # <parent> had at least two subtrees, so it still has one; if that is
+        # its only subtree and it is not a leaf, <parent> is now compressible.
+        if len(parent._subtrees) == 1 and not parent._subtrees[0].is_leaf():
+            child = parent._subtrees[0]
+            parent._value = parent._value + child._value
+            parent._absorb(child)
+
+    def _locate(self, prefix: List) -> List[CompressedPrefixTree]:
+        """Return the path of trees from this tree down to the highest tree
+        whose values all match <prefix>, or [] if no value matches <prefix>.
+        """
+        path = []
+        tree = self
+        depth = 0
+        start = 0
+        while True:
+            path.append(tree)
+            n = tree._common_length(prefix, depth, start)
+            if depth + n == len(prefix):
+                return path
+            elif n < len(tree._value):
+                return []
+            depth += n
+            tree = _index_get(tree._children, prefix[depth])
+            if tree is None:
+                return []
+            start = 1
+
+
+################################################################################
+# FrozenPrefixTree
+################################################################################
+class FrozenPrefixTree(Autocompleter):
+    """A read-only prefix tree stored in flat arrays.
+
+    A FrozenPrefixTree is made by calling freeze() on a SimplePrefixTree or
+    CompressedPrefixTree, and its autocomplete returns exactly what that
+    tree's autocomplete returned. Instead of one object per tree, it
+    numbers the trees in preorder (subtrees in the same order as in
+    subtrees) and keeps one array entry per tree, so it takes much less
+    memory, a query touches a few contiguous arrays, and since the arrays
+    hold no Python objects, processes forked after freezing keep sharing
+    their pages.
+
+    Tree <i> is stored as follows. Its subtrees are numbered i + 1 to
+    _end[i] - 1, so its first subtree (if any) is i + 1 and the one after
+    subtree <j> is _end[j].
+
+    Prefix elements (edge labels) are stored as ids: element _label_values[k]
+    has id k.
+
+    === Attributes ===
+    _end:
+        The number one past the last tree in each tree's subtrees.
+    _weights:
+        The weight of each tree, relative to _scale.
+    _leaf_counts:
+        The number of leaves in each tree.
+    _max_leaf:
+        The largest weight of a leaf in each tree, relative to _scale.
+    _scale:
+        The scale of the weights (see _TreeSettings.scale): the weights
+        autocomplete returns are the stored ones times _scale.
+    _seqs:
+        The _seq of each tree, used to break ties as the mutable tree does.
+    _value_ids:
+        For each leaf, the index of its value in _values; -1 for non-leaf
+        trees.
+    _edge_start:
+        The ids of the elements tree <i> adds to its parent's prefix are
+        _labels[_edge_start[i]:_edge_start[i + 1]].
+    _labels:
+        The edge labels of all trees, as ids.
+    _branch_start:
+        The non-leaf subtrees of tree <i> are at positions
+        _branch_start[i] to _branch_start[i + 1] - 1 of _branch_keys and
+        _branch_trees.
+    _branch_keys:
+        The id of the first edge label of each non-leaf subtree, sorted
+        within each tree so that they can be binary searched.
+    _branch_trees:
+        The number of each non-leaf subtree, in the same order.
+    weight_type:
+        The weight type of the tree this tree was frozen from.
+    _top_k:
+        The number of best leaves cached for every tree (0 if none are).
+    _top_start:
+        The cached leaves of tree <i> are
+        _top_trees[_top_start[i]:_top_start[i + 1]], best first.
+    _top_trees:
+        The cached leaves of all trees.
+    _values:
+        The values stored in the leaves.
+    _label_values:
+        The prefix element with each id.
+    _label_ids:
+        An index from prefix elements to their ids.
+    _mmap:
+        The memory-mapped index file this tree was loaded from, or None.
+        In a loaded tree the arrays are memoryviews of it, and _values
+        unpickles each value when it is looked up.
+
+    === Representation invariants ===
+    - Tree 0 is the root.
+    - All arrays with one entry per tree have the same length.
+    """
+    _end: Sequence[int]
+    _weights: Sequence[float]
+    _leaf_counts: Sequence[int]
+    _max_leaf: Sequence[float]
+    _scale: float
+    _seqs: Sequence[int]
+    _value_ids: Sequence[int]
+    _edge_start: Sequence[int]
+    _labels: Sequence[int]
+    _branch_start: Sequence[int]
+    _branch_keys: Sequence[int]
+    _branch_trees: Sequence[int]
+    weight_type: str
+    _top_k: int
+    _top_start: Sequence[int]
+    _top_trees: Sequence[int]
+    _values: Sequence[Any]
+    _label_values: List[Any]
+    _label_ids: Optional[Dict[Any, int]]
+    _mmap: Optional[mmap.mmap]
+
+    def __init__(self, tree: SimplePrefixTree) -> None:
+        """Initialize a read-only copy of <tree>.
+        """
+        # Number the trees in preorder.
+        trees = []
+        parents = []
+        stack = [(tree, -1)]
+        while stack:
+            subtree, parent = stack.pop()
+            parents.append(parent)
+            trees.append(subtree)
+            if subtree._subtrees is not None:
+                number = len(trees) - 1
+                for child in reversed(subtree._subtrees):
+                    stack.append((child, number))
+        numbers = {id(subtree): i for i, subtree in enumerate(trees)}
+
+        sizes = [1] * len(trees)
+        for i in range(len(trees) - 1, 0, -1):
+            sizes[parents[i]] += sizes[i]
+        self._end = array('i', [i + sizes[i] for i in range(len(trees))])
+        # The weights are stored as they are, with the scale, since
+        # multiplying them by it could round unequal weights to equal ones.
+        self._weights = array('d', [t.weight for t in trees])
+        self._leaf_counts = array('i', [t._leaf_count for t in trees])
+        self._max_leaf = array('d', [t._max_leaf for t in trees])
+        self._scale = tree._settings.scale
+        self._seqs = array('q', [t._seq for t in trees])
+
+        self._values = []
+        self._value_ids = array('i')
+        self._label_values = []
+        self._label_ids = None
+        self._edge_start = array('i')
+        self._labels = array('i')
+        self._branch_start = array('i')
+        self._branch_keys = array('i')
+        self._branch_trees = array('i')
+        self.weight_type = tree._settings.weight_type
+        self._top_k = tree._settings.top_k
+        self._top_start = array('i')
+        self._top_trees = array('i')
+        for subtree in trees:
+            self._edge_start.append(len(self._labels))
+            self._branch_start.append(len(self._branch_keys))
+            self._top_start.append(len(self._top_trees))
+            if subtree._subtrees is None:
+                self._value_ids.append(len(self._values))
+                self._values.append(subtree._value)
+                continue
+            self._value_ids.append(-1)
+            for element in subtree._edge():
+                self._labels.append(self._label_id(element))
+            branches = []
+            for child in subtree._subtrees:
+                if child._subtrees is not None:
+                    branches.append((self._label_id(child._edge()[0]),
+                                     numbers[id(child)]))
+            branches.sort()
+            for key, number in branches:
+                self._branch_keys.append(key)
+                self._branch_trees.append(number)
+            if subtree._top is not None:
+                for leaf in subtree._top:
+                    self._top_trees.append(numbers[id(leaf)])
+        self._edge_start.append(len(self._labels))
+        self._branch_start.append(len(self._branch_keys))
+        self._top_start.append(len(self._top_trees))
+        self._mmap = None
+
+    def _label_id(self, element: Any) -> int:
+        """Return the id of the prefix element <element>, giving it a new id
+        if it doesn't have one.
+        """
+        label = _index_get(self._label_ids, element)
+        if label is None:
+            label = len(self._label_values)
+            self._label_values.append(element)
+            self._label_ids = _index_set(self._label_ids, element, label)
+        return label
+
+    def __len__(self) -> int:
+        """Return the number of values stored in this FrozenPrefixTree."""
+        return len(self._values)
+
+    def save(self, path: str) -> None:
+        """Write this tree to an index file at <path>, which load can open.
+
+        The file is written under a temporary name and then renamed, so a
+        reader never sees a partly written index.
+        """
+        sections = [array(column.typecode if isinstance(column, array)
+                          else column.format, column)
+                    for column in self._columns()]
+        for objects in [self._values, self._label_values]:
+            offsets, data = _pickle_all(objects)
+            sections.extend([offsets, data])
+
+        table = []
+        offset = (_INDEX_HEADER.size +
+                  _INDEX_SECTION.size * len(sections))
+        for section in sections:
+            offset += -offset % 8
+            table.append(_INDEX_SECTION.pack(section.typecode.encode(),
+                                             offset, len(section)))
+            offset += len(section) * section.itemsize
+        body = bytearray(b''.join(table))
+        for section in sections:
+            body.extend(bytes(-(_INDEX_HEADER.size + len(body)) % 8))
+            body.extend(section.tobytes())
+        header = _INDEX_HEADER.pack(_INDEX_MAGIC, _INDEX_VERSION,
+                                    sys.byteorder[0].encode(),
+                                    self.weight_type[0].encode(), self._top_k,
+                                    len(sections), zlib.crc32(body),
+                                    self._scale)
+
+        temp = path + '.tmp'
+        with open(temp, 'wb') as f:
+            f.write(header)
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, path)
+
+    @classmethod
+    def load(cls, path: str, verify: bool = True) -> FrozenPrefixTree:
+        """Return the tree stored in the index file at <path>.
+
+        The file is memory-mapped rather than read, so this takes time
+        proportional to the number of distinct prefix elements only (plus a
+        pass over the file to compute its checksum if <verify> is True), and
+        processes that load the same file share its pages. Values are only
+        unpickled when autocomplete returns them.
+
+        Raise ValueError if <path> is not an index file this version of the
+        code can read, or if its checksum does not match.
+        """
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(data)
+        if len(data) < _INDEX_HEADER.size:
+            raise ValueError(f'{path} is not a prefix tree index file')
+        magic, version, byteorder, weight_type, top_k, count, checksum, \
+            scale = _INDEX_HEADER.unpack_from(data)
+        if magic != _INDEX_MAGIC:
+            raise ValueError(f'{path} is not a prefix tree index file')
+        elif version != _INDEX_VERSION:
+            raise ValueError(f'{path} has index format version {version}, '
+                             f'but only version {_INDEX_VERSION} is supported')
+        elif byteorder != sys.byteorder[0].encode():
+            raise ValueError(f'{path} was written on a machine with a '
+                             f'different byte order')
+        elif verify and zlib.crc32(view[_INDEX_HEADER.size:]) != checksum:
+            raise ValueError(f'{path} is corrupt (checksum mismatch)')
+
+        sections = []
+        for i in range(count):
+            typecode, offset, length = _INDEX_SECTION.unpack_from(
+                data, _INDEX_HEADER.size + i * _INDEX_SECTION.size)
+            typecode = typecode.decode()
+            size = array(typecode).itemsize
+            sections.append(view[offset:offset + length * size].cast(typecode))
+
+        tree = cls.__new__(cls)
+        (tree._end, tree._weights, tree._leaf_counts, tree._max_leaf,
+         tree._seqs, tree._value_ids, tree._edge_start, tree._labels,
+         tree._branch_start, tree._branch_keys, tree._branch_trees,
+         tree._top_start, tree._top_trees) = sections[:-4]
+        tree.weight_type = 'sum' if weight_type == b's' else 'average'
+        tree._top_k = top_k
+        tree._scale = scale
+        tree._values = _PickledList(sections[-4], sections[-3])
+        labels = _PickledList(sections[-2], sections[-1])
+        tree._label_values = [labels[i] for i in range(len(labels))]
+        tree._label_ids = None
+        for i in range(len(tree._label_values)):
+            tree._label_ids = _index_set(tree._label_ids,
+                                         tree._label_values[i], i)
+        tree._mmap = data
+        return tree
+
+    def thaw(self, tree_class: type = SimplePrefixTree) -> SimplePrefixTree:
+        """Return a new <tree_class> (SimplePrefixTree or CompressedPrefixTree)
+        storing the values of this tree, with the same weights.
+
+        The values are inserted (with from_items) in the order they were
+        first inserted into the tree this one was frozen from, so the new
+        tree breaks ties between equal weights the same way.
+        """
+        thawed = tree_class.from_items(self.weight_type, self._items(),
+                                       self._top_k)
+        # The weights are relative to the same scale as in this tree.
+        thawed._settings.scale = self._scale
+        return thawed
+
+    def _items(self) -> List[Tuple[Any, float, List]]:
+        """Return a (value, weight, prefix) triple for each value of this
+        tree, in the order the values were first inserted into the tree this
+        one was frozen from, with the weights relative to _scale.
+        """
+        labels, edge_start, label_values = \
+            self._labels, self._edge_start, self._label_values
+        items = []
+        # The prefix of the tree being visited, and the end (in preorder) of
+        # each tree on the path to it, with the length of its prefix.
+        path = []
+        ends = []
+        for tree in range(len(self._end)):
+            while ends and tree >= ends[-1][0]:
+                ends.pop()
+            del path[ends[-1][1] if ends else 0:]
+            if self._value_ids[tree] >= 0:
+                items.append((self._seqs[tree],
+                              self._values[self._value_ids[tree]],
+                              self._weights[tree], list(path)))
+            else:
+                path.extend(label_values[labels[i]] for i
+                            in range(edge_start[tree], edge_start[tree + 1]))
+                ends.append((self._end[tree], len(path)))
+        items.sort(key=lambda item: item[0])
+        return [item[1:] for item in items]
+
+    def _columns(self) -> List[Sequence]:
+        """Return the arrays this tree is stored in, in the order they are
+        written to an index file.
+        """
+        return [self._end, self._weights, self._leaf_counts, self._max_leaf,
+                self._seqs, self._value_ids, self._edge_start, self._labels,
+                self._branch_start, self._branch_keys, self._branch_trees,
+                self._top_start, self._top_trees]
+
+    def insert(self, value: Any, weight: float, prefix: List) -> None:
+        """Raise TypeError, since a FrozenPrefixTree is read-only.
+
+        Insert into the tree this one was frozen from, and freeze it again.
+        """
+        raise TypeError(_READ_ONLY)
+
+    def remove(self, prefix: List) -> None:
+        """Raise TypeError, since a FrozenPrefixTree is read-only.
+        """
+        raise TypeError(_READ_ONLY)
+
+    def decay(self, factor: float) -> None:
+        """Raise TypeError, since a FrozenPrefixTree is read-only.
+        """
+        raise TypeError(_READ_ONLY)
+
+    def autocomplete(self, prefix: List,
+                     limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the given prefix.
+
+        The return value is a list of tuples (value, weight), and must be
+        ordered in non-increasing weight. (You can decide how to break ties.)
+
+        If limit is None, return *every* match for the given prefix.
+
+        Precondition: limit is None or limit > 0.
+        """
+        tree = self._locate(prefix)
+        if tree < 0 or self._weights[tree] == 0.0:
+            return []
+        return self._matches(tree, limit)
+
+    def iter_autocomplete(self, prefix: List) -> Iterator[Tuple[Any, float]]:
+        """Yield the matches for the given prefix, as tuples (value, weight),
+        in the order autocomplete(prefix) returns them.
+
+        The matches come from _best_first, so the memory used grows with the
+        part of the tree searched so far rather than with the number of
+        matches.
+        """
+        tree = self._locate(prefix)
+        if tree >= 0 and self._weights[tree] != 0.0:
+            values, value_ids, weights, scale = \
+                self._values, self._value_ids, self._weights, self._scale
+            for i in self._best_first(tree):
+                yield values[value_ids[i]], weights[i] * scale
+
+    def fuzzy_autocomplete(self, prefix: List, distance: int,
+                           limit: Optional[int] = None,
+                           penalty: float = 0.1) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the values whose prefix sequence
+        starts with a sequence at most <distance> edits (insertions,
+        deletions or substitutions of one element) away from <prefix>.
+
+        The distance of a value is the fewest edits turning <prefix> into a
+        prefix of the value's prefix sequence. Matches are ranked by their
+        weight times penalty ** distance, so each edit makes a match count
+        for less; ties are broken as in autocomplete, which this is when
+        <distance> is 0. The return value is a list of tuples
+        (value, weight), in that order (so not always in non-increasing
+        weight).
+
+        If limit is None, return *every* match.
+
+        Precondition: distance >= 0, 0 < penalty <= 1, and limit is None or
+        limit > 0.
+        """
+        return self._results(itertools.islice(
+            self._fuzzy_best_first(prefix, distance, penalty), limit))
+
+    def approximate_autocomplete(self, prefix: List, tolerance: int,
+                                 mismatches: int = 0,
+                                 limit: Optional[int] = None,
+                                 penalty: float = 0.1) \
+            -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the values whose prefix sequence
+        (of numbers) starts with a sequence close to <prefix>: each element
+        is within <tolerance> of the element of <prefix> in the same
+        position, except for at most <mismatches> elements, which can be
+        anything.
+
+        Matches are ranked by their weight times penalty ** (the number of
+        elements more than <tolerance> away), so elements within
+        <tolerance> count as equal; ties are broken as in autocomplete,
+        which this is when <tolerance> and <mismatches> are 0. The return
+        value is a list of tuples (value, weight), in that order.
+
+        If limit is None, return *every* match.
+
+        Precondition: the prefix sequences are sequences of numbers,
+        <tolerance> is a whole number, tolerance >= 0, mismatches >= 0,
+        0 < penalty <= 1, and limit is None or limit > 0.
+        """
+        return self._results(itertools.islice(self._approximate_best_first(
+            prefix, tolerance, mismatches, penalty), limit))
+
+    def autocomplete_many(self, prefixes: List[List],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[Any, float]]]:
+        """Return the list autocomplete(prefix, limit) returns for each
+        prefix in <prefixes>, in order.
+
+        This is SimplePrefixTree.autocomplete_many on the arrays.
+
+        Precondition: limit is None or limit > 0.
+        """
+        return _autocomplete_many(self, prefixes, limit)
+
+    def _walk_start(self) -> Tuple[int, int, int, int]:
+        """Return the walk state for the empty prefix.
+
+        A walk state is as in SimplePrefixTree._walk_start, with trees given
+        by number, and with the edge position <i> (the next label of <tree>
+        is self._labels[i]) before <end>, which is where the labels of the
+        edge of <tree> end in self._labels.
+        """
+        return 0, 0, self._edge_start[0], self._edge_start[1]
+
+    def _walk_step(self, state: Tuple[int, int, int, int], depth: int,
+                   element: Any) -> Optional[Tuple[int, int, int, int]]:
+        """Return the walk state for prefix[:depth + 1], where <state> is the
+        walk state for prefix[:depth] and prefix[depth] is <element>, or None
+        if no value matches prefix[:depth + 1].
+        """
+        matching, tree, i, end = state
+        key = _index_get(self._label_ids, element)
+        if key is None:
+            return None
+        elif i < end:
+            if self._labels[i] != key:
+                return None
+            return matching, tree, i + 1, end
+        lo, hi = self._branch_start[tree], self._branch_start[tree + 1]
+        j = bisect_left(self._branch_keys, key, lo, hi)
+        if j == hi or self._branch_keys[j] != key:
+            return None
+        subtree = self._branch_trees[j]
+        if self._leaf_counts[subtree] != self._leaf_counts[tree]:
+            matching = subtree
+        # The first label of the edge is <key>, so skip it.
+        return (matching, subtree, self._edge_start[subtree] + 1,
+                self._edge_start[subtree + 1])
+
+    def _walk_matches(self, state: Tuple[int, int, int, int],
+                      limit: Optional[int]) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the prefix with walk state
+        <state>, as autocomplete does.
+        """
+        return self._matches(state[0], limit)
+
+    @staticmethod
+    def _walk_version() -> int:
+        """Return the number of times this tree has been changed, which is
+        always 0.
+        """
+        return 0
+
+    def _locate(self, prefix: List) -> int:
+        """Return the number of the highest tree whose values all match
+        <prefix>, or -1 if no value matches <prefix>.
+        """
+        try:
+            keys = [self._label_ids[element] for element in prefix]
+        except (KeyError, TypeError):
+            # Some element is unhashable, or no tree has it in its prefix.
+            keys = [_index_get(self._label_ids, element) for element in prefix]
+            if None in keys:
+                return -1
+
+        labels, edge_start = self._labels, self._edge_start
+        branch_start, branch_keys = self._branch_start, self._branch_keys
+        tree = 0
+        i, end = edge_start[0], edge_start[1]
+        depth = 0
+        while True:
+            while i < end and depth < len(keys):
+                if labels[i] != keys[depth]:
+                    return -1
+                i += 1
+                depth += 1
+            if depth == len(keys):
+                return tree
+            key = keys[depth]
+            lo, hi = branch_start[tree], branch_start[tree + 1]
+            j = bisect_left(branch_keys, key, lo, hi)
+            if j == hi or branch_keys[j] != key:
+                return -1
+            # The first label of the edge is <key>, so skip it.
+            tree = self._branch_trees[j]
+            i, end = edge_start[tree] + 1, edge_start[tree + 1]
+            depth += 1
+
+    def _matches(self, tree: int,
+                 limit: Optional[int]) -> List[Tuple[Any, float]]:
+        """Return up to <limit> (value, weight) tuples for the leaves of
+        tree <tree>, in the order SimplePrefixTree._matches returns them.
+
+        If limit is None, return every leaf.
+        """
+        if limit is not None and limit <= self._top_k:
+            start = self._top_start[tree]
+            end = min(self._top_start[tree + 1], start + limit)
+            leaves = self._top_trees[start:end]
+        elif limit is None or self._leaf_counts[tree] <= limit:
+            value_ids = self._value_ids
+            leaves = [i for i in range(tree, self._end[tree])
+                      if value_ids[i] >= 0]
+            weights, seqs = self._weights, self._seqs
+            leaves.sort(key=lambda i: (-weights[i], seqs[i]))
+        else:
+            leaves = itertools.islice(self._best_first(tree), limit)
+        return self._results(leaves)
+
+    def _results(self, leaves: Iterable[int]) -> List[Tuple[Any, float]]:
+        """Return the (value, weight) tuple of each leaf in <leaves>, in
+        order, with the stored weight times _scale.
+        """
+        values, value_ids, weights, scale = \
+            self._values, self._value_ids, self._weights, self._scale
+        return [(values[value_ids[i]], weights[i] * scale) for i in leaves]
+
+    def _best_first(self, tree: int) -> Iterator[int]:
+        """Yield the numbers of the leaves of tree <tree> in non-increasing
+        order of weight, breaking ties by _seqs.
+
+        This is SimplePrefixTree._best_first on the arrays.
+        """
+        end, max_leaf, seqs = self._end, self._max_leaf, self._seqs
+        value_ids = self._value_ids
+        # No two leaves have the same (-weight, _seq) key, so breaking the
+        # remaining ties by tree number doesn't change the order of leaves.
+        queue = [(-max_leaf[tree], seqs[tree], tree)]
+        while queue:
+            tree = heapq.heappop(queue)[2]
+            if value_ids[tree] >= 0:
+                yield tree
+            else:
+                child = tree + 1
+                while child < end[tree]:
+                    heapq.heappush(queue, (-max_leaf[child], seqs[child],
+                                           child))
+                    child = end[child]
+
+    def _fuzzy_best_first(self, prefix: List, distance: int,
+                          penalty: float) -> Iterator[int]:
+        """Yield the numbers of the leaves at most <distance> edits away from
+        <prefix>, in the order SimplePrefixTree._fuzzy_best_first yields
+        them.
+
+        This is SimplePrefixTree._fuzzy_best_first on the arrays, comparing
+        label ids (an element no tree has in its prefix gets the id None,
+        which matches no label).
+        """
+        keys = [_index_get(self._label_ids, element) for element in prefix]
+        end, weights, max_leaf, seqs = \
+            self._end, self._weights, self._max_leaf, self._seqs
+        value_ids, labels, edge_start = \
+            self._value_ids, self._labels, self._edge_start
+        row, best, bound = _fuzzy_edge(keys, _fuzzy_start(keys), len(keys),
+                                       labels[edge_start[0]:edge_start[1]])
+        if bound > distance:
+            return
+        # Queue entries are (-key, _seqs entry, tree, row, distance, bound,
+        # known), as in SimplePrefixTree._fuzzy_best_first. A tree is queued
+        # again only with a larger key, so the tree numbers break all ties.
+        queue = [(-max_leaf[0] * penalty ** bound, seqs[0], 0, row, best,
+                  bound, True)]
+        while queue:
+            _, _, tree, row, best, bound, known = heapq.heappop(queue)
+            if value_ids[tree] >= 0:
+                yield tree
+                continue
+            if not known:
+                row, best, own = _fuzzy_edge(
+                    keys, row, best,
+                    labels[edge_start[tree]:edge_start[tree + 1]])
+                if own > distance:
+                    continue
+                elif own > bound:
+                    heapq.heappush(queue, (-max_leaf[tree] * penalty ** own,
+                                           seqs[tree], tree, row, best, own,
+                                           True))
+                    continue
+            if best > distance and bound == distance:
+                children = self._fuzzy_branches(keys, row, distance, tree)
+            else:
+                children = []
+                child = tree + 1
+                while child < end[tree]:
+                    children.append(child)
+                    child = end[child]
+            for child in children:
+                if value_ids[child] < 0:
+                    heapq.heappush(queue, (-max_leaf[child] * penalty ** bound,
+                                           seqs[child], child, row, best,
+                                           bound, False))
+                elif best <= distance:
+                    heapq.heappush(queue, (-weights[child] * penalty ** best,
+                                           seqs[child], child, None, best,
+                                           best, True))
+
+    def _fuzzy_branches(self, keys: List[Optional[int]], row: List[int],
+                        distance: int, tree: int) -> List[int]:
+        """Return the numbers of the non-leaf subtrees of tree <tree> that
+        can hold a value at most <distance> edits away from the prefix with
+        label ids <keys>, as SimplePrefixTree._fuzzy_branches does.
+        """
+        lo, hi = self._branch_start[tree], self._branch_start[tree + 1]
+        found = set()
+        children = []
+        for i in range(len(keys)):
+            key = keys[i]
+            if row[i] == distance and key is not None and key not in found:
+                found.add(key)
+                j = bisect_left(self._branch_keys, key, lo, hi)
+                if j < hi and self._branch_keys[j] == key:
+                    children.append(self._branch_trees[j])
+        return children
+
+    def _approximate_best_first(self, prefix: List, tolerance: int,
+                                mismatches: int,
+                                penalty: float) -> Iterator[int]:
+        """Yield the numbers of the leaves that match <prefix> with at most
+        <mismatches> mismatches, in the order
+        SimplePrefixTree._approximate_best_first yields them.
+
+        This is SimplePrefixTree._approximate_best_first on the arrays,
+        comparing the elements with ids in _labels.
+        """
+        end, weights, max_leaf, seqs = \
+            self._end, self._weights, self._max_leaf, self._seqs
+        value_ids, labels, edge_start = \
+            self._value_ids, self._labels, self._edge_start
+        branch_start, branch_keys = self._branch_start, self._branch_keys
+        label_values = self._label_values
+
+        def edge(tree: int) -> Iterator[Any]:
+            """Yield the elements tree <tree> adds to its parent's prefix."""
+            for i in range(edge_start[tree], edge_start[tree + 1]):
+                yield label_values[labels[i]]
+
+        depth, missed = _approximate_edge(prefix, tolerance, 0, 0, edge(0))
+        if missed > mismatches:
+            return
+        # Queue entries are (-key, _seqs entry, tree, depth, missed).
+        queue = [(-max_leaf[0] * penalty ** missed, seqs[0], 0, depth,
+                  missed)]
+        while queue:
+            _, _, tree, depth, missed = heapq.heappop(queue)
+            if value_ids[tree] >= 0:
+                yield tree
+                continue
+            if depth < len(prefix) and missed == mismatches:
+                children = []
+                lo, hi = branch_start[tree], branch_start[tree + 1]
+                for label in range(prefix[depth] - tolerance,
+                                   prefix[depth] + tolerance + 1):
+                    key = _index_get(self._label_ids, label)
+                    j = bisect_left(branch_keys, key, lo, hi) \
+                        if key is not None else hi
+                    if j < hi and branch_keys[j] == key:
+                        children.append(self._branch_trees[j])
+            else:
+                children = []
+                child = tree + 1
+                while child < end[tree]:
+                    children.append(child)
+                    child = end[child]
+            for child in children:
+                if value_ids[child] < 0:
+                    subdepth, submissed = _approximate_edge(
+                        prefix, tolerance, depth, missed, edge(child))
+                    if submissed <= mismatches:
+                        heapq.heappush(queue, (
+                            -max_leaf[child] * penalty ** submissed,
+                            seqs[child], child, subdepth, submissed))
+                elif depth == len(prefix):
+                    heapq.heappush(queue, (-weights[child] * penalty ** missed,
+                                           seqs[child], child, depth, missed))
+
+
+class _PickledList:
+    """A read-only list of objects stored pickled in a buffer, which are
+    unpickled each time they are looked up.
+
+    === Attributes ===
+    _offsets:
+        Object <i> is pickled in _data[_offsets[i]:_offsets[i + 1]].
+    _data:
+        The pickled objects.
+    """
+    _offsets: Sequence[int]
+    _data: Sequence[int]
+
+    def __init__(self, offsets: Sequence[int], data: Sequence[int]) -> None:
+        """Initialize a list of the objects pickled in <data> at <offsets>.
+        """
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self) -> int:
+        """Return the number of objects in this list."""
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> Any:
+        """Return object <i> of this list."""
+        return pickle.loads(self._data[self._offsets[i]:self._offsets[i + 1]])
+
+
+def _pickle_all(objects: Sequence[Any]) -> Tuple[array, array]:
+    """Return the offsets and data of a _PickledList of <objects>."""
+    offsets = array('q', [0])
+    data = bytearray()
+    for i in range(len(objects)):
+        data.extend(pickle.dumps(objects[i], pickle.HIGHEST_PROTOCOL))
+        offsets.append(len(data))
+    return offsets, array('B', data)
+
+
+################################################################################
+# Typing sessions
+################################################################################
+class PrefixSession:
+    """A prefix being typed into a prefix tree one element at a time.
+
+    Each push or pop takes one step down or up the tree from the tree the
+    prefix reached before, instead of walking the whole prefix again from
+    the root. If the prefix tree is changed (by insert or remove), the steps
+    are redone from the root the next time the session is used.
+
+    === Attributes ===
+    prefix:
+        The elements typed so far.
+
+    === Private Attributes ===
+    _tree:
+        The SimplePrefixTree, CompressedPrefixTree or FrozenPrefixTree being
+        searched.
+    _states:
+        _states[d] is the walk state of prefix[:d] in _tree (see
+        SimplePrefixTree._walk_start), or None if no value matches it.
+    _version:
+        The value of _tree._walk_version() when _states was computed.
+
+    === Representation invariants ===
+    - len(_states) == len(prefix) + 1
+    - once an element of _states is None, so are all later ones
+    """
+    prefix: List
+    _tree: Autocompleter
+    _states: List[Any]
+    _version: int
+
+    def __init__(self, tree: Autocompleter, prefix: Optional[List] = None) \
+            -> None:
+        """Initialize a session typing into <tree>, starting from <prefix>
+        (or the empty prefix if it is None).
+
+        Precondition: <tree> is a SimplePrefixTree, CompressedPrefixTree or
+        FrozenPrefixTree.
+        """
+        self._tree = tree
+        self.prefix = []
+        self._states = [tree._walk_start()]
+        self._version = tree._walk_version()
+        for element in prefix or []:
+            self.push(element)
+
+    def push(self, element: Any) -> None:
+        """Add <element> to the end of the prefix."""
+        self._check_version()
+        state = self._states[-1]
+        if state is not None:
+            state = self._tree._walk_step(state, len(self.prefix), element)
+        self.prefix.append(element)
+        self._states.append(state)
+
+    def pop(self) -> Any:
+        """Remove the last element of the prefix, and return it.
+
+        Precondition: the prefix is not empty.
+        """
+        self._states.pop()
+        return self.prefix.pop()
+
+    def autocomplete(self, limit: Optional[int] = None) \
+            -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the prefix, as
+        autocomplete(self.prefix, limit) on the tree does.
+
+        Precondition: limit is None or limit > 0.
+        """
+        self._check_version()
+        if self._states[-1] is None:
+            return []
+        return self._tree._walk_matches(self._states[-1], limit)
+
+    def _check_version(self) -> None:
+        """Walk the prefix again from the root if the tree has been changed
+        since the walk states were computed.
+        """
+        version = self._tree._walk_version()
+        if version == self._version:
+            return
+        self._version = version
+        prefix = self.prefix
+        self.prefix = []
+        self._states = [self._tree._walk_start()]
+        for element in prefix:
+            self.push(element)
+
+
+################################################################################
+# Result caching
+################################################################################
+class CachedAutocompleter(Autocompleter):
+    """An Autocompleter that caches the results of autocomplete calls on
+    another Autocompleter.
+
+    Results are cached by (prefix, limit). Once <size> results are cached,
+    the least recently used one is evicted to make room, and if <ttl> is not
+    None, a result is not used more than <ttl> seconds after it was cached.
+    insert and remove drop exactly the cached results they could change:
+    those for the inserted prefix and its prefixes, and those for the
+    removed prefix, its prefixes, and the prefixes that extend it.
+
+    Prefixes with unhashable elements are never cached.
+
+    === Attributes ===
+    autocompleter:
+        The Autocompleter whose results are cached.
+    size:
+        The maximum number of cached results.
+    ttl:
+        The number of seconds a cached result is used for, or None if cached
+        results do not expire.
+    hits:
+        The number of prefixes whose results came from the cache.
+    misses:
+        The number of prefixes whose results were not cached (or had
+        expired), and so came from <autocompleter>.
+    evictions:
+        The number of cached results evicted to make room for others.
+
+    === Private Attributes ===
+    _results:
+        Maps (tuple(prefix), limit) to the result of autocomplete(prefix,
+        limit) and the time.monotonic() time it was cached, in order from
+        least to most recently used.
+    _limits:
+        Maps each tuple(prefix) with a cached result to the limits it has
+        cached results for.
+
+    === Representation invariants ===
+    - size > 0
+    - len(_results) <= size
+    - (prefix, limit) is in _results if and only if limit is in
+      _limits[prefix]
+    - no set in _limits is empty
+    """
+    autocompleter: Autocompleter
+    size: int
+    ttl: Optional[float]
+    hits: int
+    misses: int
+    evictions: int
+    _results: OrderedDict[Tuple[Tuple, Optional[int]],
+                          Tuple[List[Tuple[Any, float]], float]]
+    _limits: Dict[Tuple, Set[Optional[int]]]
+
+    def __init__(self, autocompleter: Autocompleter, size: int,
+                 ttl: Optional[float] = None) -> None:
+        """Initialize an empty cache of at most <size> results in front of
+        <autocompleter>, with cached results used for at most <ttl> seconds
+        (or until they are evicted, if <ttl> is None).
+
+        Precondition: size > 0
+        """
+        self.autocompleter = autocompleter
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._results = OrderedDict()
+        self._limits = {}
+
+    def __len__(self) -> int:
+        """Return the number of values stored in this Autocompleter."""
+        return len(self.autocompleter)
+
+    def insert(self, value: Any, weight: float, prefix: List) -> None:
+        """Insert the given value into this Autocompleter, as
+        Autocompleter.insert does, and drop the cached results it changes.
+        """
+        self.autocompleter.insert(value, weight, prefix)
+        self._invalidate(prefix, False)
+
+    def remove(self, prefix: List) -> None:
+        """Remove all values that match the given prefix, and drop the cached
+        results this changes.
+        """
+        self.autocompleter.remove(prefix)
+        self._invalidate(prefix, True)
+
+    def decay(self, factor: float) -> None:
+        """Multiply the weight of every value in this Autocompleter by
+        <factor>, and drop every cached result (all of their weights change).
+
+        Precondition: factor > 0
+        """
+        self.autocompleter.decay(factor)
+        self._results.clear()
+        self._limits.clear()
+
+    def autocomplete(self, prefix: List,
+                     limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the given prefix, from the cache
+        if possible.
+
+        The return value is a list of tuples (value, weight), and must be
+        ordered in non-increasing weight. (You can decide how to break ties.)
+
+        If limit is None, return *every* match for the given prefix.
+
+        Precondition: limit is None or limit > 0.
+        """
+        key = (tuple(prefix), limit)
+        result = self._cached(key)
+        if result is None:
+            result = self.autocompleter.autocomplete(prefix, limit)
+            self._store(key, result)
+        return list(result)
+
+    def autocomplete_many(self, prefixes: List[List],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[Any, float]]]:
+        """Return the list autocomplete(prefix, limit) returns for each
+        prefix in <prefixes>, in order.
+
+        The prefixes whose results are not cached are looked up together
+        with autocompleter.autocomplete_many.
+
+        Precondition: limit is None or limit > 0.
+        """
+        results = []
+        missing = []
+        for prefix in prefixes:
+            results.append(self._cached((tuple(prefix), limit)))
+            if results[-1] is None:
+                missing.append(prefix)
+        found = self.autocompleter.autocomplete_many(missing, limit)
+        j = 0
+        for i in range(len(results)):
+            if results[i] is None:
+                results[i] = found[j]
+                self._store((tuple(prefixes[i]), limit), found[j])
+                j += 1
+        return [list(result) for result in results]
+
+    def iter_autocomplete(self, prefix: List) -> Iterator[Tuple[Any, float]]:
+        """Yield the matches for the given prefix, as tuples (value, weight),
+        in the order autocomplete(prefix) returns them.
+
+        These are not cached, since they are produced lazily.
+        """
+        return self.autocompleter.iter_autocomplete(prefix)
+
+    def fuzzy_autocomplete(self, prefix: List, distance: int,
+                           limit: Optional[int] = None,
+                           penalty: float = 0.1) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches within <distance> edits of <prefix>,
+        as Autocompleter.fuzzy_autocomplete does.
+
+        These are not cached.
+        """
+        return self.autocompleter.fuzzy_autocomplete(prefix, distance, limit,
+                                                     penalty)
+
+    def approximate_autocomplete(self, prefix: List, tolerance: int,
+                                 mismatches: int = 0,
+                                 limit: Optional[int] = None,
+                                 penalty: float = 0.1) \
+            -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches close to <prefix>, as
+        Autocompleter.approximate_autocomplete does.
+
+        These are not cached.
+        """
+        return self.autocompleter.approximate_autocomplete(
+            prefix, tolerance, mismatches, limit, penalty)
+
+    def _cached(self, key: Tuple[Tuple, Optional[int]]) \
+            -> Optional[List[Tuple[Any, float]]]:
+        """Return the cached result for <key>, or None if there is none (or
+        it has expired), and count the hit or miss.
+        """
+        try:
+            entry = self._results.get(key)
+        except TypeError:
+            entry = None
+        if entry is not None and (self.ttl is None or
+                                  time.monotonic() - entry[1] < self.ttl):
+            self._results.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        return None
+
+    def _store(self, key: Tuple[Tuple, Optional[int]],
+               result: List[Tuple[Any, float]]) -> None:
+        """Cache <result> under <key>, evicting the least recently used
+        results if there are now more than self.size.
+        """
+        try:
+            self._results[key] = (result, time.monotonic())
+        except TypeError:
+            return
+        self._results.move_to_end(key)
+        self._limits.setdefault(key[0], set()).add(key[1])
+        while len(self._results) > self.size:
+            prefix, limit = self._results.popitem(last=False)[0]
+            self._forget(prefix, limit)
+            self.evictions += 1
+
+    def _forget(self, prefix: Tuple, limit: Optional[int]) -> None:
+        """Remove <limit> from the limits cached for <prefix>."""
+        limits = self._limits[prefix]
+        limits.discard(limit)
+        if not limits:
+            del self._limits[prefix]
+
+    def _invalidate(self, prefix: List, extensions: bool) -> None:
+        """Drop the cached results for <prefix> and its prefixes, and if
+        <extensions> is True, for the prefixes that extend <prefix>.
+        """
+        key = tuple(prefix)
+        stale = []
+        for i in range(len(key) + 1):
+            try:
+                if key[:i] in self._limits:
+                    stale.append(key[:i])
+            except TypeError:
+                # key[:i] has an unhashable element, so neither it nor any
+                # longer prefix of <prefix> can be cached.
+                break
+        if extensions:
+            stale.extend(cached for cached in self._limits
+                         if len(cached) > len(key) and
+                         cached[:len(key)] == key)
+        for cached in stale:
+            for limit in self._limits.pop(cached):
+                del self._results[(cached, limit)]
+
+
+################################################################################
+# Concurrent access
+################################################################################
+class ConcurrentAutocompleter(Autocompleter):
+    """An Autocompleter that can be read from many threads while another
+    thread changes it.
+
+    This keeps two copies of the prefix tree (the "left-right" technique):
+    readers use the active copy, while a writer changes the inactive copy,
+    makes it the active one, waits for the readers still using the old copy
+    to finish, and then makes the same change to it. So readers never see a
+    copy that is being changed, and never wait for a writer; they only
+    update a count of readers, under a lock that is never held for longer
+    than that. Writers take turns.
+
+    === Private Attributes ===
+    _trees:
+        The two copies of the prefix tree.
+    _active:
+        The index in _trees of the copy new readers use.
+    _readers:
+        _readers[i] is the number of readers using _trees[i].
+    _counts:
+        The lock protecting _readers, which writers wait on for the readers
+        of a copy to finish.
+    _writer:
+        The lock held by the writer changing the trees.
+
+    === Representation invariants ===
+    - when no writer holds _writer, the two trees store the same values with
+      the same weights, in the same order
+    - _readers[1 - _active] == 0, except while a writer holding _writer
+      waits for it to become 0
+    """
+    _trees: List[Autocompleter]
+    _active: int
+    _readers: List[int]
+    _counts: threading.Condition
+    _writer: threading.Lock
+
+    def __init__(self, left: Autocompleter, right: Autocompleter) -> None:
+        """Initialize a ConcurrentAutocompleter for the two copies <left> and
+        <right> of a prefix tree.
+
+        Preconditions:
+            <left> and <right> store the same values with the same weights,
+            inserted in the same order (for example, they were built from the
+            same items), so that they give the same autocomplete results.
+            Nothing else uses <left> or <right>.
+        """
+        self._trees = [left, right]
+        self._active = 0
+        self._readers = [0, 0]
+        self._counts = threading.Condition()
+        self._writer = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of values stored in this Autocompleter."""
+        return self._read(len)
+
+    def insert(self, value: Any, weight: float, prefix: List) -> None:
+        """Insert the given value into this Autocompleter, as
+        Autocompleter.insert does.
+
+        Readers see either none or all of this change.
+        """
+        self._write(lambda tree: tree.insert(value, weight, prefix))
+
+    def remove(self, prefix: List) -> None:
+        """Remove all values that match the given prefix.
+
+        Readers see either none or all of this change.
+        """
+        self._write(lambda tree: tree.remove(prefix))
+
+    def decay(self, factor: float) -> None:
+        """Multiply the weight of every value in this Autocompleter by
+        <factor>.
+
+        Readers see either none or all of this change.
+
+        Precondition: factor > 0
+        """
+        self._write(lambda tree: tree.decay(factor))
+
+    def autocomplete(self, prefix: List,
+                     limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the given prefix.
+
+        The return value is a list of tuples (value, weight), and must be
+        ordered in non-increasing weight. (You can decide how to break ties.)
+
+        If limit is None, return *every* match for the given prefix.
+
+        Precondition: limit is None or limit > 0.
+        """
+        return self._read(lambda tree: tree.autocomplete(prefix, limit))
+
+    def autocomplete_many(self, prefixes: List[List],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[Any, float]]]:
+        """Return the list autocomplete(prefix, limit) returns for each
+        prefix in <prefixes>, in order, all from the same version of the tree.
+
+        Precondition: limit is None or limit > 0.
+        """
+        return self._read(lambda tree: tree.autocomplete_many(prefixes, limit))
+
+    def iter_autocomplete(self, prefix: List) -> Iterator[Tuple[Any, float]]:
+        """Yield the matches for the given prefix, as tuples (value, weight),
+        in the order autocomplete(prefix) returns them.
+
+        The generator counts as a reader until it is exhausted or closed, so
+        a writer waits for it; close it as soon as it is no longer needed.
+        """
+        side = self._enter()
+        try:
+            yield from self._trees[side].iter_autocomplete(prefix)
+        finally:
+            self._leave(side)
+
+    def fuzzy_autocomplete(self, prefix: List, distance: int,
+                           limit: Optional[int] = None,
+                           penalty: float = 0.1) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches within <distance> edits of <prefix>,
+        as Autocompleter.fuzzy_autocomplete does.
+        """
+        return self._read(lambda tree: tree.fuzzy_autocomplete(
+            prefix, distance, limit, penalty))
+
+    def approximate_autocomplete(self, prefix: List, tolerance: int,
+                                 mismatches: int = 0,
+                                 limit: Optional[int] = None,
+                                 penalty: float = 0.1) \
+            -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches close to <prefix>, as
+        Autocompleter.approximate_autocomplete does.
+        """
+        return self._read(lambda tree: tree.approximate_autocomplete(
+            prefix, tolerance, mismatches, limit, penalty))
+
+    def freeze(self) -> FrozenPrefixTree:
+        """Return a read-only FrozenPrefixTree with the contents of this
+        Autocompleter.
+        """
+        return self._read(lambda tree: tree.freeze())
+
+    def _read(self, query: Callable[[Autocompleter], Any]) -> Any:
+        """Return query(tree), where tree is the active copy of the prefix
+        tree, which is not changed until <query> returns.
+        """
+        side = self._enter()
+        try:
+            return query(self._trees[side])
+        finally:
+            self._leave(side)
+
+    def _enter(self) -> int:
+        """Register a new reader of the active copy, and return its index in
+        self._trees.
+        """
+        with self._counts:
+            side = self._active
+            self._readers[side] += 1
+        return side
+
+    def _leave(self, side: int) -> None:
+        """Unregister a reader of self._trees[side]."""
+        with self._counts:
+            self._readers[side] -= 1
+            if self._readers[side] == 0:
+                self._counts.notify_all()
+
+    def _write(self, change: Callable[[Autocompleter], None]) -> None:
+        """Call change(tree) on both copies of the prefix tree, one at a
+        time, so that readers only ever use an unchanged or fully changed
+        copy.
+        """
+        with self._writer:
+            inactive = 1 - self._active
+            change(self._trees[inactive])
+            with self._counts:
+                self._active = inactive
+                while self._readers[1 - inactive] > 0:
+                    self._counts.wait()
+            change(self._trees[1 - inactive])
+
+
+################################################################################
+# Write-ahead logging
+################################################################################
+class LoggedAutocompleter(Autocompleter):
+    """An Autocompleter that records every insert, remove and decay in an
+    append-only log, so that they survive a restart (see recover).
+
+    The files are named <path>.<generation>.snapshot and
+    <path>.<generation>.log. The snapshot of a generation is an index file
+    (see FrozenPrefixTree.save) of the tree as it was when the generation
+    started, and its log records the changes made since then. compact starts
+    a new generation, so that the log doesn't grow forever.
+
+    Changes are written to the log in batches, which are flushed to disk
+    (with fsync) once <batch_size> changes are waiting or <sync_interval>
+    seconds have passed since the last flush, whichever comes first (a timer
+    thread flushes them if no further change comes); so a crash loses at
+    most that many changes. A partly written record at the end of a log
+    (from a crash in the middle of a write) is dropped when the log is
+    recovered.
+
+    === Attributes ===
+    autocompleter:
+        The Autocompleter whose changes are logged.
+    path:
+        The path the snapshot and log files are named after.
+    sync_interval:
+        The maximum number of seconds between flushes of the log.
+    batch_size:
+        The maximum number of changes waiting to be flushed.
+
+    === Private Attributes ===
+    _generation:
+        The generation of the log being written.
+    _log:
+        The log being written, open for appending.
+    _pending:
+        The records of the changes not yet written to the log.
+    _synced:
+        The time.monotonic() time of the last flush.
+    _timer:
+        The timer thread that flushes the pending records once
+        <sync_interval> seconds have passed since the last flush, or None if
+        no records are pending.
+    _lock:
+        The lock held while changing the tree or the log.
+
+    === Representation invariants ===
+    - len(_pending) < batch_size
+    """
+    autocompleter: Autocompleter
+    path: str
+    sync_interval: float
+    batch_size: int
+    _generation: int
+    _log: Any
+    _pending: List[bytes]
+    _synced: float
+    _timer: Optional[threading.Timer]
+    _lock: threading.Lock
+
+    def __init__(self, autocompleter: Autocompleter, path: str,
+                 sync_interval: float = 1.0, batch_size: int = 100) -> None:
+        """Initialize a log of the changes to <autocompleter> in the files
+        named after <path>.
+
+        If there are no such files, <autocompleter> is saved as the first
+        snapshot.
+
+        Preconditions:
+            If there are files named after <path>, <autocompleter> stores what
+            they record (for example, it was returned by recover(path)).
+            <autocompleter> can be frozen, and batch_size > 0.
+        """
+        self.autocompleter = autocompleter
+        self.path = path
+        self.sync_interval = sync_interval
+        self.batch_size = batch_size
+        snapshots = _generations(path, '.snapshot')
+        if snapshots:
+            self._generation = max(snapshots + _generations(path, '.log'))
+        else:
+            self._generation = 0
+            autocompleter.freeze().save(_snapshot_path(path, 0))
+        self._log = open(_log_path(path, self._generation), 'ab')
+        self._pending = []
+        self._synced = time.monotonic()
+        self._timer = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def recover(path: str, tree_class: type = SimplePrefixTree) \
+            -> Optional[SimplePrefixTree]:
+        """Return a <tree_class> storing what the files named after <path>
+        record: the latest snapshot, with the changes in the logs of its
+        generation and later ones redone. Return None if there is no
+        snapshot.
+
+        A partly written record at the end of a log is removed from it. As in
+        from_items, the cyclic garbage collector is paused while the tree is
+        rebuilt.
+        """
+        snapshots = _generations(path, '.snapshot')
+        if not snapshots:
+            return None
+        tree = FrozenPrefixTree.load(
+            _snapshot_path(path, snapshots[-1])).thaw(tree_class)
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for generation in _generations(path, '.log'):
+                if generation >= snapshots[-1]:
+                    _replay(_log_path(path, generation), tree)
+        finally:
+            if enabled:
+                gc.enable()
+        return tree
+
+    def __len__(self) -> int:
+        """Return the number of values stored in this Autocompleter."""
+        return len(self.autocompleter)
+
+    def insert(self, value: Any, weight: float, prefix: List) -> None:
+        """Insert the given value into this Autocompleter, as
+        Autocompleter.insert does, and log the insertion.
+        """
+        with self._lock:
+            self.autocompleter.insert(value, weight, prefix)
+            self._append(('insert', value, weight, prefix))
+
+    def remove(self, prefix: List) -> None:
+        """Remove all values that match the given prefix, and log the
+        removal.
+        """
+        with self._lock:
+            self.autocompleter.remove(prefix)
+            self._append(('remove', prefix))
+
+    def decay(self, factor: float) -> None:
+        """Multiply the weight of every value in this Autocompleter by
+        <factor>, and log the decay.
+
+        Precondition: factor > 0
+        """
+        with self._lock:
+            self.autocompleter.decay(factor)
+            self._append(('decay', factor))
+
+    def autocomplete(self, prefix: List,
+                     limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the given prefix.
+
+        The return value is a list of tuples (value, weight), and must be
+        ordered in non-increasing weight. (You can decide how to break ties.)
+
+        If limit is None, return *every* match for the given prefix.
+
+        Precondition: limit is None or limit > 0.
+        """
+        return self.autocompleter.autocomplete(prefix, limit)
+
+    def autocomplete_many(self, prefixes: List[List],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[Any, float]]]:
+        """Return the list autocomplete(prefix, limit) returns for each
+        prefix in <prefixes>, in order.
+
+        Precondition: limit is None or limit > 0.
+        """
+        return self.autocompleter.autocomplete_many(prefixes, limit)
+
+    def iter_autocomplete(self, prefix: List) -> Iterator[Tuple[Any, float]]:
+        """Yield the matches for the given prefix, as tuples (value, weight),
+        in the order autocomplete(prefix) returns them.
+        """
+        return self.autocompleter.iter_autocomplete(prefix)
+
+    def fuzzy_autocomplete(self, prefix: List, distance: int,
+                           limit: Optional[int] = None,
+                           penalty: float = 0.1) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches within <distance> edits of <prefix>,
+        as Autocompleter.fuzzy_autocomplete does.
+        """
+        return self.autocompleter.fuzzy_autocomplete(prefix, distance, limit,
+                                                     penalty)
+
+    def approximate_autocomplete(self, prefix: List, tolerance: int,
+                                 mismatches: int = 0,
+                                 limit: Optional[int] = None,
+                                 penalty: float = 0.1) \
+            -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches close to <prefix>, as
+        Autocompleter.approximate_autocomplete does.
+        """
+        return self.autocompleter.approximate_autocomplete(
+            prefix, tolerance, mismatches, limit, penalty)
+
+    def freeze(self) -> FrozenPrefixTree:
+        """Return a read-only FrozenPrefixTree with the contents of this
+        Autocompleter.
+        """
+        with self._lock:
+            return self.autocompleter.freeze()
+
+    def flush(self) -> None:
+        """Write the changes not yet in the log to it, and wait until they
+        are on disk.
+        """
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        """Flush and close the log. This Autocompleter must not be changed
+        afterwards.
+        """
+        with self._lock:
+            self._flush()
+            self._log.close()
+
+    def compact(self) -> None:
+        """Fold the log into a new snapshot, and delete the older snapshots
+        and logs.
+
+        A new generation starts at once, so changes made while the snapshot
+        is written go to the new log. Only freezing a copy of the tree for
+        the snapshot holds up changes, and reads are not held up at all,
+        since freezing only reads the tree.
+        """
+        with self._lock:
+            self._flush()
+            self._log.close()
+            self._generation += 1
+            generation = self._generation
+            self._log = open(_log_path(self.path, generation), 'ab')
+            frozen = self.autocompleter.freeze()
+        frozen.save(_snapshot_path(self.path, generation))
+        # The new snapshot replaces everything from older generations.
+        for suffix, name in [('.snapshot', _snapshot_path),
+                             ('.log', _log_path)]:
+            for old in _generations(self.path, suffix):
+                if old < generation:
+                    os.remove(name(self.path, old))
+
+    def _append(self, change: Tuple) -> None:
+        """Add a record of <change> to the log, flushing the log if the
+        batch is full or it is time to sync.
+        """
+        data = pickle.dumps(change, pickle.HIGHEST_PROTOCOL)
+        self._pending.append(_LOG_RECORD.pack(len(data), zlib.crc32(data)) +
+                             data)
+        waited = time.monotonic() - self._synced
+        if len(self._pending) >= self.batch_size or \
+                waited >= self.sync_interval:
+            self._flush()
+        elif self._timer is None:
+            # Without further changes, nothing else would flush these.
+            self._timer = threading.Timer(self.sync_interval - waited,
+                                          self._timed_flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _timed_flush(self) -> None:
+        """Flush the pending records, when run by self._timer."""
+        with self._lock:
+            # A flush since the timer went off has already cancelled it.
+            if self._timer is threading.current_thread():
+                self._flush()
+
+    def _flush(self) -> None:
+        """Write the pending records to the log and sync it to disk."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._pending:
+            self._log.write(b''.join(self._pending))
+            self._pending = []
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._synced = time.monotonic()
+
+
+def _snapshot_path(path: str, generation: int) -> str:
+    """Return the path of the snapshot of <generation> for <path>."""
+    return f'{path}.{generation}.snapshot'
+
+
+def _log_path(path: str, generation: int) -> str:
+    """Return the path of the log of <generation> for <path>."""
+    return f'{path}.{generation}.log'
+
+
+def _generations(path: str, suffix: str) -> List[int]:
+    """Return the generations with a file named <path>.<generation><suffix>,
+    in increasing order.
+    """
+    directory, name = os.path.split(path)
+    generations = []
+    for file in os.listdir(directory or '.'):
+        if file.startswith(name + '.') and file.endswith(suffix):
+            generation = file[len(name) + 1:len(file) - len(suffix)]
+            if generation.isdigit():
+                generations.append(int(generation))
+    return sorted(generations)
+
+
+def _replay(log: str, tree: Autocompleter) -> None:
+    """Redo the changes recorded in the log file <log> on <tree>, and cut
+    off a partly written record at the end of the log.
+    """
+    with open(log, 'r+b') as f:
+        data = f.read()
+        position = 0
+        while position + _LOG_RECORD.size <= len(data):
+            length, checksum = _LOG_RECORD.unpack_from(data, position)
+            start = position + _LOG_RECORD.size
+            record = data[start:start + length]
+            if len(record) < length or zlib.crc32(record) != checksum:
+                break
+            change = pickle.loads(record)
+            if change[0] == 'insert':
+                tree.insert(change[1], change[2], change[3])
+            elif change[0] == 'decay':
+                tree.decay(change[1])
+            else:
+                tree.remove(change[1])
+            position = start + length
+        if position < len(data):
+            f.truncate(position)
+
+
+################################################################################
+# Infix matching
+################################################################################
+class InfixIndex(Autocompleter):
+    """An Autocompleter that can also match a prefix starting at any element
+    of a value's prefix sequence, not just the first (see
+    infix_autocomplete).
+
+    Besides <autocompleter>, which holds every value under its prefix
+    sequence, a secondary prefix tree holds each value under every proper
+    suffix of its prefix sequence (all but the first element, all but the
+    first two, and so on). The secondary tree's leaves store the same value
+    objects as <autocompleter>, so no value is copied, only the tree objects
+    leading to it; still, for sentences the secondary tree takes about 2 to
+    2.5 times the memory of <autocompleter>. Each suffix is followed by a
+    _Terminator of the value as a last element, so that one value can be
+    removed from under a suffix (see remove) without touching the others.
+
+    The secondary tree stores the same weights as <autocompleter>, with the
+    same scale (see SimplePrefixTree.decay), and equal weights are ordered
+    by when the values were first inserted into <autocompleter>, as
+    autocomplete orders them.
+
+    Every other query goes to <autocompleter> unchanged.
+
+    === Attributes ===
+    autocompleter:
+        The Autocompleter holding every value under its prefix sequence.
+    split:
+        The function returning the prefix sequence of a value, such as
+        str.split for sentences.
+    suffixes:
+        The secondary prefix tree, holding each value <value> with prefix
+        sequence <prefix> under prefix[i:] + [_Terminator(value)] for
+        0 < i < len(prefix), with the same weight as in <autocompleter>.
+
+    === Private Attributes ===
+    _order:
+        An index (see _index_get) from each value to its rank: values first
+        inserted earlier have smaller ranks.
+    _inserted:
+        The number of ranks given out so far.
+
+    === Representation invariants ===
+    - Each value in <autocompleter> has split(value) as its prefix sequence.
+    - Every value in <autocompleter> has a rank in _order, and no other
+      value does.
+    """
+    autocompleter: Autocompleter
+    split: Callable[[Any], List]
+    suffixes: SimplePrefixTree
+    _order: Optional[Dict[Any, int]]
+    _inserted: int
+
+    def __init__(self, autocompleter: Autocompleter,
+                 split: Callable[[Any], List],
+                 tree_class: type = CompressedPrefixTree) -> None:
+        """Initialize an index of the values in <autocompleter>, whose
+        prefix sequences are given by <split>, with a secondary tree of class
+        <tree_class> (SimplePrefixTree or CompressedPrefixTree).
+
+        The secondary tree is built from a frozen copy of <autocompleter>
+        (with from_items, in the order the values were first inserted), so it
+        never needs to be saved.
+
+        Precondition: <autocompleter> is a FrozenPrefixTree or has a freeze
+        method, and all its changes are made through this InfixIndex.
+        """
+        self.autocompleter = autocompleter
+        self.split = split
+        if isinstance(autocompleter, FrozenPrefixTree):
+            frozen = autocompleter
+        else:
+            frozen = autocompleter.freeze()
+        self._order = None
+        self._inserted = 0
+        items = []
+        for value, weight, prefix in frozen._items():
+            self._rank(value)
+            end = _Terminator(value)
+            for i in range(1, len(prefix)):
+                items.append((value, weight, prefix[i:] + [end]))
+        self.suffixes = tree_class.from_items('sum', items)
+        self.suffixes._settings.scale = frozen._scale
+
+    def __len__(self) -> int:
+        """Return the number of values stored in this Autocompleter."""
+        return len(self.autocompleter)
+
+    def insert(self, value: Any, weight: float, prefix: List) -> None:
+        """Insert the given value into this Autocompleter, as
+        Autocompleter.insert does, under <prefix> and each of its suffixes.
+
+        Precondition: prefix == split(value)
+        """
+        self.autocompleter.insert(value, weight, prefix)
+        self._rank(value)
+        end = _Terminator(value)
+        for i in range(1, len(prefix)):
+            self.suffixes.insert(value, weight, prefix[i:] + [end])
+
+    def remove(self, prefix: List) -> None:
+        """Remove all values that match the given prefix, from under their
+        prefix sequences and their suffixes.
+        """
+        removed = [value for value, _
+                   in self.autocompleter.iter_autocomplete(prefix)]
+        self.autocompleter.remove(prefix)
+        for value in removed:
+            self._order = _index_pop(self._order, value)
+            sequence = self.split(value)
+            end = _Terminator(value)
+            for i in range(1, len(sequence)):
+                self.suffixes.remove(sequence[i:] + [end])
+
+    def decay(self, factor: float) -> None:
+        """Multiply the weight of every value in this Autocompleter by
+        <factor>.
+
+        Precondition: factor > 0
+        """
+        self.autocompleter.decay(factor)
+        self.suffixes.decay(factor)
+
+    def autocomplete(self, prefix: List,
+                     limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the given prefix.
+
+        The return value is a list of tuples (value, weight), and must be
+        ordered in non-increasing weight. (You can decide how to break ties.)
+
+        If limit is None, return *every* match for the given prefix.
+
+        Precondition: limit is None or limit > 0.
+        """
+        return self.autocompleter.autocomplete(prefix, limit)
+
+    def autocomplete_many(self, prefixes: List[List],
+                          limit: Optional[int] = None) \
+            -> List[List[Tuple[Any, float]]]:
+        """Return the list autocomplete(prefix, limit) returns for each
+        prefix in <prefixes>, in order.
+
+        Precondition: limit is None or limit > 0.
+        """
+        return self.autocompleter.autocomplete_many(prefixes, limit)
+
+    def iter_autocomplete(self, prefix: List) -> Iterator[Tuple[Any, float]]:
+        """Yield the matches for the given prefix, as tuples (value, weight),
+        in the order autocomplete(prefix) returns them.
+        """
+        return self.autocompleter.iter_autocomplete(prefix)
+
+    def fuzzy_autocomplete(self, prefix: List, distance: int,
+                           limit: Optional[int] = None,
+                           penalty: float = 0.1) -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches within <distance> edits of <prefix>,
+        as Autocompleter.fuzzy_autocomplete does.
+        """
+        return self.autocompleter.fuzzy_autocomplete(prefix, distance, limit,
+                                                     penalty)
+
+    def approximate_autocomplete(self, prefix: List, tolerance: int,
+                                 mismatches: int = 0,
+                                 limit: Optional[int] = None,
+                                 penalty: float = 0.1) \
+            -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches close to <prefix>, as
+        Autocompleter.approximate_autocomplete does.
+        """
+        return self.autocompleter.approximate_autocomplete(
+            prefix, tolerance, mismatches, limit, penalty)
+
+    def infix_autocomplete(self, prefix: List,
+                           limit: Optional[int] = None) \
+            -> List[Tuple[Any, float]]:
+        """Return up to <limit> matches for the values whose prefix sequence
+        contains <prefix> starting at any of its elements (so
+        infix_autocomplete(['to', 'cook']) matches 'how to cook rice').
+
+        The return value is a list of tuples (value, weight), ordered in
+        non-increasing weight, with each value at most once.
+
+        The matches of <autocompleter> and of the secondary tree are each
+        found best first (see iter_autocomplete) and merged, breaking ties
+        by rank, so only about <limit> matches are looked at, plus the
+        repeats of a value whose sequence contains <prefix> more than once.
+
+        If limit is None, return *every* match for the given prefix.
+
+        Precondition: limit is None or limit > 0.
+        """
+        if not prefix:
+            return self.autocompleter.autocomplete(prefix, limit)
+        whole = self.autocompleter.iter_autocomplete(prefix)
+        inner = self.suffixes.iter_autocomplete(prefix)
+        order = self._order
+        results = []
+        seen = None
+        try:
+            for value, weight in heapq.merge(
+                    whole, inner, key=lambda match: (
+                        -match[1], _index_get(order, match[0]))):
+                if _index_get(seen, value) is None:
+                    seen = _index_set(seen, value, True)
+                    results.append((value, weight))
+                    if len(results) == limit:
+                        break
+        finally:
+            whole.close()
+            inner.close()
+        return results
+
+    def _rank(self, value: Any) -> None:
+        """Give <value> the next rank, if it doesn't have one."""
+        if _index_get(self._order, value) is None:
+            self._order = _index_set(self._order, value, self._inserted)
+            self._inserted += 1
+
+
+class _Terminator:
+    """The last element of a suffix in the secondary tree of an InfixIndex,
+    standing for <value>.
+
+    Terminators are equal when their values are, and are never equal to
+    anything else, so unlike the value itself, a terminator cannot be
+    mistaken for an element of a prefix sequence.
+
+    === Attributes ===
+    value:
+        The value whose suffixes this terminates.
+    """
+    __slots__ = ('value',)
+    value: Any
+
+    def __init__(self, value: Any) -> None:
+        """Initialize a terminator standing for <value>."""
+        self.value = value
+
+    def __eq__(self, other: Any) -> bool:
+        """Return whether <other> is a terminator of an equal value."""
+        return isinstance(other, _Terminator) and self.value == other.value
+
+    def __hash__(self) -> int:
+        """Return the hash of the value, raising TypeError if it has none.
+        """
+        return hash(self.value)
 
 
 if __name__ == '__main__':
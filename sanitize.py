@@ -1,10 +1,79 @@
-def sanitize(string):
-    new_string = ""
-    for char in string:
-        if char.isalnum() or char == " ":
-            new_string += char
+"""CSC148 Assignment 2: Text sanitization
+
+=== Module Description ===
+This file contains the text sanitization shared by the text-based
+autocomplete engines: a sanitized string keeps only the alphanumeric and
+space characters of the original, in lowercase (see the section on
+"Text sanitization" on the assignment handout).
+
+Lines that contain only ASCII characters (almost all of them in practice)
+are sanitized with a single str.translate call instead of one character at a
+time, and whether a line has an alphanumeric character is read off the
+sanitized line instead of being checked in a separate pass.
+"""
+from __future__ import annotations
+import string as _string
+from typing import List, Optional
+
+# Deletes every ASCII character that is not alphanumeric or a space, and
+# lowercases the rest.
+_ASCII_TABLE = str.maketrans(_string.ascii_uppercase, _string.ascii_lowercase,
+                             ''.join(chr(i) for i in range(128)
+                                     if not chr(i).isalnum() and chr(i) != ' '))
+
+# Like _ASCII_TABLE, but keeps newlines so that sanitized lines can be split.
+_ASCII_LINES_TABLE = str.maketrans(_string.ascii_uppercase,
+                                   _string.ascii_lowercase,
+                                   ''.join(chr(i) for i in range(128)
+                                           if not chr(i).isalnum() and
+                                           chr(i) not in ' \n'))
+
+
+def sanitize(string: str) -> str:
+    """Return a sanitized version of the string.
+    """
+    if string.isascii():
+        return string.translate(_ASCII_TABLE)
+    return ''.join([char for char in string
+                    if char.isalnum() or char == ' ']).lower()
+
+
+def sanitize_checked(string: str) -> Optional[str]:
+    """Return a sanitized version of the string, or None if the string does
+    not contain at least one alphanumeric character.
+
+    Note that a string of spaces has no alphanumeric characters even though
+    its sanitized version is not empty.
+    """
+    sanitized = sanitize(string)
+    # Only spaces and (lowercased) alphanumeric characters are left.
+    if sanitized.strip(' ') == '':
+        return None
+    return sanitized
+
+
+def sanitize_lines(lines: List[str]) -> List[str]:
+    """Return the sanitized versions of the lines in <lines> that contain at
+    least one alphanumeric character, in order.
+
+    This is the same as calling sanitize_checked on each line and dropping
+    the Nones, but an ASCII-only batch is sanitized with one str.translate
+    call.
+
+    Precondition: no line contains a newline, except as its last character
+    (as when the lines are read from a text file).
+    """
+    text = '\n'.join(lines)
+    if text.isascii():
+        return [line for line in text.translate(_ASCII_LINES_TABLE).split('\n')
+                if line.strip(' ') != '']
+    sanitized = []
+    for line in lines:
+        checked = sanitize_checked(line)
+        if checked is not None:
+            sanitized.append(checked)
+    return sanitized
 
-    return new_string.lower().strip('\n')
 
 if __name__ == "__main__":
     print(sanitize("!%^^!#&#!^#&!^#&!#ur mom haha\n&$*# 7"))
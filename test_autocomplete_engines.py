@@ -0,0 +1,122 @@
+"""CSC148 Assignment 2: Tests for the autocomplete engines
+
+=== Module Description ===
+This file contains pytest tests for autocomplete_engines.py. Each test writes
+a small input file of its own to a temporary directory, so none of the files
+in data/ are needed.
+"""
+from __future__ import annotations
+import random
+from typing import Any, Dict, List
+
+import pytest
+
+from autocomplete_engines import LetterAutocompleteEngine, \
+    SentenceAutocompleteEngine
+
+
+def write_letters(tmp_path, seed: int, count: int = 300) -> str:
+    """Write <count> random lines, with repeats and non-ASCII characters,
+    to a text file in <tmp_path>, and return its path.
+    """
+    rng = random.Random(seed)
+    words = ['the', 'The', 'then', 'them', 'hobbit', 'höbbit', 'ring',
+             'Ring!', 'rings', '42', '...']
+    file = tmp_path / 'letters.txt'
+    with open(file, 'w', encoding='utf-8') as f:
+        for _ in range(count):
+            f.write(' '.join(rng.choice(words)
+                             for _ in range(rng.randint(1, 3))) + '\n')
+    return str(file)
+
+
+def write_sentences(tmp_path, seed: int, count: int = 300) -> str:
+    """Write <count> random CSV lines of sentences and weights to a file in
+    <tmp_path>, and return its path.
+    """
+    rng = random.Random(seed)
+    words = ['how', 'to', 'cook', 'rice', 'tie', 'a', 'Tie', '!!']
+    file = tmp_path / 'sentences.csv'
+    with open(file, 'w', encoding='utf-8') as f:
+        for _ in range(count):
+            sentence = ' '.join(rng.choice(words)
+                                for _ in range(rng.randint(1, 4)))
+            f.write(f'{sentence},{rng.randint(1, 9)}\n')
+    return str(file)
+
+
+def results(engine: Any, prefixes: List[str]) -> List[List]:
+    """Return the matches of <engine> for each of <prefixes>, with and
+    without a limit.
+    """
+    return [engine.autocomplete(prefix, limit) for prefix in prefixes
+            for limit in [None, 1, 3]]
+
+
+LETTER_PREFIXES = ['', 't', 'th', 'the', 'r', 'h', 'x', '4']
+SENTENCE_PREFIXES = ['', 'how', 'how to', 'tie', 'a tie', 'rice', 'x']
+
+
+################################################################################
+# Index files
+################################################################################
+@pytest.mark.parametrize('kind', ['simple', 'compressed'])
+def test_index(tmp_path, kind: str) -> None:
+    """Test that an engine with an index returns what one without returns,
+    both when it builds the index and when it opens it.
+    """
+    config = {'file': write_letters(tmp_path, 11), 'autocompleter': kind,
+              'weight_type': 'sum', 'top_k': 2}
+    expected = results(LetterAutocompleteEngine(config), LETTER_PREFIXES)
+    config['index'] = str(tmp_path / 'letters.idx')
+    assert results(LetterAutocompleteEngine(config),
+                   LETTER_PREFIXES) == expected
+    # Opening the index does not read the input file.
+    with open(config['file'], 'w') as f:
+        f.write('nothing\n')
+    assert results(LetterAutocompleteEngine(config),
+                   LETTER_PREFIXES) == expected
+
+
+def test_index_errors(tmp_path) -> None:
+    """Test that an index built with another weight type, or one that is
+    corrupt, is rejected.
+    """
+    config = {'file': write_sentences(tmp_path, 110),
+              'autocompleter': 'compressed', 'weight_type': 'sum',
+              'index': str(tmp_path / 'sentences.idx')}
+    SentenceAutocompleteEngine(config)
+    with pytest.raises(ValueError):
+        SentenceAutocompleteEngine(dict(config, weight_type='average'))
+    with open(config['index'], 'r+b') as f:
+        f.seek(-1, 2)
+        last = f.read(1)
+        f.seek(-1, 2)
+        f.write(bytes([last[0] ^ 1]))
+    with pytest.raises(ValueError):
+        SentenceAutocompleteEngine(config)
+    with open(config['index'], 'wb') as f:
+        f.write(b'not an index')
+    with pytest.raises(ValueError):
+        SentenceAutocompleteEngine(config)
+
+
+################################################################################
+# Parallel parsing
+################################################################################
+@pytest.mark.parametrize('workers', [2, 3])
+def test_workers(tmp_path, workers: int) -> None:
+    """Test that parsing the input file in worker processes gives the same
+    results, ties included, as parsing it serially.
+    """
+    configs: List[Dict[str, Any]] = [
+        {'file': write_letters(tmp_path, 14), 'autocompleter': 'simple',
+         'weight_type': 'sum'},
+        {'file': write_sentences(tmp_path, 140), 'autocompleter': 'compressed',
+         'weight_type': 'average'}]
+    for config, engine_class, prefixes in [
+            (configs[0], LetterAutocompleteEngine, LETTER_PREFIXES),
+            (configs[1], SentenceAutocompleteEngine, SENTENCE_PREFIXES)]:
+        expected = results(engine_class(config), prefixes)
+        parallel = engine_class(dict(config, workers=workers))
+        assert results(parallel, prefixes) == expected
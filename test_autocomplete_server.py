@@ -0,0 +1,104 @@
+"""CSC148 Assignment 2: Tests for the autocomplete server
+
+=== Module Description ===
+This file contains pytest tests for autocomplete_server.py. Each test starts
+a server on a free local port, for a sentence engine built from a small CSV
+file of its own, and talks to it over the line protocol.
+"""
+from __future__ import annotations
+import asyncio
+import json
+from typing import Any, List, Optional, Tuple
+
+from autocomplete_engines import SentenceAutocompleteEngine
+from autocomplete_server import AutocompleteServer
+from prefix_tree import SimplePrefixTree
+
+
+class FailingEngine:
+    """An engine whose autocomplete raises an error no request check could
+    catch, like an engine failing on a malformed prefix.
+
+    === Attributes ===
+    autocompleter:
+        An empty prefix tree, which is never used.
+    """
+    autocompleter: SimplePrefixTree
+
+    def __init__(self) -> None:
+        """Initialize a FailingEngine."""
+        self.autocompleter = SimplePrefixTree('sum')
+
+    def autocomplete(self, prefix: Any,
+                     limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Raise IndexError."""
+        raise IndexError('no such interval')
+
+
+def exchange(engine: Any, requests: List[Any],
+             max_pending: int = 64) -> List[Any]:
+    """Return the responses of a server for <engine> to <requests>, sent
+    on one connection without waiting for the responses.
+    """
+    async def run() -> List[Any]:
+        server = AutocompleteServer(engine, max_pending=max_pending)
+        listener = await server.serve(port=0)
+        port = listener.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('localhost', port)
+        for request in requests:
+            writer.write(json.dumps(request).encode() + b'\n')
+        writer.write_eof()
+        responses = []
+        for _ in requests:
+            line = await asyncio.wait_for(reader.readline(), 5)
+            responses.append(json.loads(line))
+        writer.close()
+        listener.close()
+        await listener.wait_closed()
+        server.close()
+        return responses
+    return asyncio.run(run())
+
+
+def sentence_engine(tmp_path) -> SentenceAutocompleteEngine:
+    """Return a sentence engine for a small CSV file in <tmp_path>."""
+    file = tmp_path / 'searches.csv'
+    file.write_text('how to cook rice,5\nhow to tie a tie,3\n'
+                    'hello world,4\n')
+    return SentenceAutocompleteEngine({'file': str(file),
+                                       'autocompleter': 'simple',
+                                       'weight_type': 'sum'})
+
+
+def test_results(tmp_path) -> None:
+    """Test that queries are answered in order, with and without a limit."""
+    responses = exchange(sentence_engine(tmp_path),
+                         [{'prefix': 'how', 'limit': 1},
+                          {'prefix': ''},
+                          {'prefix': 'hello there', 'limit': 3}])
+    assert responses == [{'results': [['how to cook rice', 5.0]]},
+                         {'results': [['how to cook rice', 5.0],
+                                      ['hello world', 4.0],
+                                      ['how to tie a tie', 3.0]]},
+                         {'results': []}]
+
+
+def test_bad_limits(tmp_path) -> None:
+    """Test that limits other than positive integers or null are rejected,
+    including true.
+    """
+    responses = exchange(sentence_engine(tmp_path),
+                         [{'prefix': 'how', 'limit': limit}
+                          for limit in [True, False, 0, -1, 1.5, '2']])
+    assert all(list(response) == ['error'] for response in responses)
+
+
+def test_engine_errors() -> None:
+    """Test that any error raised by the engine becomes an error response,
+    and that the connection keeps being answered after more than
+    max_pending of them.
+    """
+    responses = exchange(FailingEngine(), [{'prefix': [1, 2], 'limit': 5}] * 10
+                         + [{'prefix': [1], 'limit': None}] * 10,
+                         max_pending=4)
+    assert responses == [{'error': 'IndexError: no such interval'}] * 20
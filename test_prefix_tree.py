@@ -0,0 +1,938 @@
+"""CSC148 Assignment 2: Tests for the Autocompleter classes
+
+=== Module Description ===
+This file contains pytest tests for prefix_tree.py. The results of the trees
+are compared with those of a brute-force Oracle, which keeps every value in a
+dictionary and sorts the matches by (-weight, insertion order), the order the
+trees break ties in. The tests use small random data sets of their own, so
+they need none of the files in data/.
+"""
+from __future__ import annotations
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+
+from prefix_tree import SimplePrefixTree, CompressedPrefixTree, \
+    FrozenPrefixTree, PrefixSession, CachedAutocompleter, \
+    ConcurrentAutocompleter, LoggedAutocompleter, InfixIndex
+
+
+################################################################################
+# Brute-force oracle
+################################################################################
+class Oracle:
+    """A brute-force model of an Autocompleter.
+
+    === Attributes ===
+    values:
+        Maps each value to its [weight, prefix, insertion number].
+
+    === Private Attributes ===
+    _count:
+        The number of values inserted so far, including removed ones.
+    """
+    values: Dict[Any, List]
+    _count: int
+
+    def __init__(self) -> None:
+        """Initialize an empty Oracle."""
+        self.values = {}
+        self._count = 0
+
+    def insert(self, value: Any, weight: float, prefix: List) -> None:
+        """Insert <value> as Autocompleter.insert does."""
+        if value in self.values:
+            self.values[value][0] += weight
+        else:
+            self.values[value] = [weight, prefix, self._count]
+            self._count += 1
+
+    def remove(self, prefix: List) -> None:
+        """Remove the values matching <prefix>."""
+        for value in self.matching(prefix):
+            del self.values[value]
+
+    def decay(self, factor: float) -> None:
+        """Multiply every weight by <factor>."""
+        for entry in self.values.values():
+            entry[0] *= factor
+
+    def matching(self, prefix: List) -> List[Any]:
+        """Return the values matching <prefix>, best first."""
+        matches = [value for value, (_, sequence, _) in self.values.items()
+                   if sequence[:len(prefix)] == prefix]
+        return sorted(matches, key=lambda value: (-self.values[value][0],
+                                                  self.values[value][2]))
+
+    def autocomplete(self, prefix: List,
+                     limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return what Autocompleter.autocomplete should."""
+        matches = [(value, self.values[value][0])
+                   for value in self.matching(prefix)]
+        return matches if limit is None else matches[:limit]
+
+
+def random_changes(rng: random.Random, steps: int,
+                   alphabet: str = 'abc') -> List[Tuple]:
+    """Return <steps> random changes, as tuples ('insert', value, weight,
+    prefix) or ('remove', prefix), with values that are always inserted
+    under the same prefix.
+    """
+    changes = []
+    for _ in range(steps):
+        if rng.random() < 0.1:
+            changes.append(('remove', [rng.choice(alphabet)
+                                       for _ in range(rng.randint(0, 2))]))
+        else:
+            prefix = [rng.choice(alphabet) for _ in range(rng.randint(0, 4))]
+            value = ''.join(prefix) + str(rng.randint(0, 1))
+            changes.append(('insert', value, rng.choice([1, 2, 3]), prefix))
+    return changes
+
+
+def apply(change: Tuple, *autocompleters: Any) -> None:
+    """Make <change>, from random_changes, to each of <autocompleters>."""
+    for autocompleter in autocompleters:
+        if change[0] == 'insert':
+            autocompleter.insert(change[1], change[2], change[3])
+        else:
+            autocompleter.remove(change[1])
+
+
+def all_prefixes(alphabet: str = 'abc', length: int = 2) -> List[List]:
+    """Return every prefix of up to <length> elements of <alphabet>."""
+    prefixes = [[]]
+    for size in range(length):
+        prefixes += [prefix + [element] for prefix in prefixes
+                     if len(prefix) == size for element in alphabet]
+    return prefixes
+
+
+# Every kind of mutable tree: (tree class, weight type, top_k).
+KINDS = [(tree_class, weight_type, top_k)
+         for tree_class in [SimplePrefixTree, CompressedPrefixTree]
+         for weight_type in ['sum', 'average']
+         for top_k in [0, 3]]
+
+
+def assert_same(tree: Any, other: Any) -> None:
+    """Assert that <tree> and <other> return the same matches for every
+    short prefix, with and without limits.
+    """
+    for prefix in all_prefixes():
+        for limit in [None, 1, 2, 5]:
+            assert tree.autocomplete(prefix, limit) == \
+                other.autocomplete(prefix, limit)
+        assert list(tree.iter_autocomplete(prefix)) == \
+            list(other.iter_autocomplete(prefix))
+
+
+def check_aggregates(tree: SimplePrefixTree) -> None:
+    """Check the weights, leaf counts and subtree order of every non-leaf
+    tree in <tree> against its leaves.
+    """
+    stack = [tree]
+    while stack:
+        subtree = stack.pop()
+        if subtree.is_leaf() or subtree.is_empty():
+            continue
+        weights = [child.weight for child in subtree.subtrees]
+        assert weights == sorted(weights, reverse=True)
+        leaves = []
+        leaf_stack = [subtree]
+        while leaf_stack:
+            node = leaf_stack.pop()
+            if node.is_leaf():
+                leaves.append(node.weight)
+            else:
+                leaf_stack.extend(node.subtrees)
+        total = sum(leaves)
+        expected = total if tree.weight_type == 'sum' else total / len(leaves)
+        assert subtree.weight == pytest.approx(expected)
+        stack.extend(subtree.subtrees)
+
+
+################################################################################
+# Inserting and looking up
+################################################################################
+@pytest.mark.parametrize('tree_class', [SimplePrefixTree,
+                                        CompressedPrefixTree])
+def test_unhashable(tree_class: type) -> None:
+    """Test that values and prefix elements that cannot be hashed are found
+    and merged like hashable ones, next to equal-looking hashable ones.
+    """
+    tree = tree_class('sum')
+    tree.insert(['x'], 1, [[1], 'a'])
+    tree.insert('y', 2, [[1], 'b'])
+    tree.insert(['x'], 2, [[1], 'a'])
+    tree.insert('one', 1, [1])
+    assert len(tree) == 3
+    assert tree.autocomplete([[1]]) == [(['x'], 3), ('y', 2)]
+    assert tree.autocomplete([[1], 'a']) == [(['x'], 3)]
+    assert tree.autocomplete([1]) == [('one', 1)]
+    assert tree.autocomplete([[2]]) == []
+    tree.remove([[1], 'b'])
+    assert tree.autocomplete([]) == [(['x'], 3), ('one', 1)]
+
+
+@pytest.mark.parametrize('tree_class, weight_type, top_k', KINDS)
+def test_weight_order(tree_class: type, weight_type: str,
+                      top_k: int) -> None:
+    """Test that inserting values that are already in the tree again moves
+    them to where the oracle orders them, ties included.
+    """
+    rng = random.Random(2)
+    tree = tree_class(weight_type, top_k)
+    oracle = Oracle()
+    values = [(f'v{i}', [rng.choice('abcd'), rng.choice('ab')])
+              for i in range(40)]
+    for _ in range(300):
+        value, prefix = rng.choice(values)
+        apply(('insert', value, rng.choice([1, 2]), prefix), tree, oracle)
+        assert tree.autocomplete([]) == oracle.autocomplete([])
+    for prefix in all_prefixes('abcd'):
+        assert tree.autocomplete(prefix) == oracle.autocomplete(prefix)
+    check_aggregates(tree)
+
+
+@pytest.mark.parametrize('tree_class, weight_type, top_k', KINDS)
+def test_limits(tree_class: type, weight_type: str, top_k: int) -> None:
+    """Test that autocomplete with a limit returns the first matches of
+    autocomplete without one, for every limit.
+    """
+    tree = tree_class(weight_type, top_k)
+    oracle = Oracle()
+    # With average weights, 'b' outweighs the tree of the 'a' values, but
+    # the best match is one of those.
+    for value, weight in [('a0', 10), ('a1', 1), ('a2', 1), ('a3', 1)]:
+        apply(('insert', value, weight, ['a', value[1]]), tree, oracle)
+    apply(('insert', 'b', 4, ['b']), tree, oracle)
+    assert tree.autocomplete([], 1) == [('a0', 10)]
+    for change in random_changes(random.Random(3), 100):
+        apply(change, tree, oracle)
+    for prefix in all_prefixes():
+        matches = tree.autocomplete(prefix)
+        assert matches == oracle.autocomplete(prefix)
+        for limit in range(1, len(matches) + 2):
+            assert tree.autocomplete(prefix, limit) == matches[:limit]
+
+
+def check_top(tree: SimplePrefixTree, oracle: Oracle) -> None:
+    """Check the top-k cache of every non-leaf tree in <tree> against the
+    best matches of its prefix in <oracle>.
+    """
+    stack = [tree]
+    while stack:
+        subtree = stack.pop()
+        if subtree.is_leaf() or subtree.is_empty():
+            continue
+        top = [(leaf.value, leaf.weight) for leaf in subtree._top]
+        assert top == oracle.autocomplete(subtree.value,
+                                          tree._settings.top_k)
+        stack.extend(subtree.subtrees)
+
+
+@pytest.mark.parametrize('tree_class', [SimplePrefixTree,
+                                        CompressedPrefixTree])
+@pytest.mark.parametrize('weight_type', ['sum', 'average'])
+def test_top_k(tree_class: type, weight_type: str) -> None:
+    """Test that the top-k cache of every tree holds the best matches of its
+    prefix after each of a series of random inserts and removes.
+    """
+    rng = random.Random(4)
+    tree = tree_class(weight_type, 3)
+    oracle = Oracle()
+    for change in random_changes(rng, 200):
+        apply(change, tree, oracle)
+        check_top(tree, oracle)
+
+
+def test_compressed_shape() -> None:
+    """Test that a CompressedPrefixTree has no tree with a single non-leaf
+    subtree, even after removes.
+    """
+    rng = random.Random(5)
+    tree = CompressedPrefixTree('sum')
+    for change in random_changes(rng, 300):
+        apply(change, tree)
+        stack = [tree]
+        while stack:
+            subtree = stack.pop()
+            if subtree.is_leaf():
+                continue
+            children = subtree.subtrees
+            assert not (len(children) == 1 and not children[0].is_leaf())
+            stack.extend(children)
+
+
+################################################################################
+# Inserting and removing
+################################################################################
+@pytest.mark.parametrize('tree_class, weight_type, top_k', KINDS)
+def test_insert_remove(tree_class: type, weight_type: str,
+                       top_k: int) -> None:
+    """Test autocomplete, with and without limits, and len against the
+    oracle after each of a series of random inserts and removes.
+    """
+    rng = random.Random(6)
+    tree = tree_class(weight_type, top_k)
+    oracle = Oracle()
+    for change in random_changes(rng, 300):
+        apply(change, tree, oracle)
+        assert len(tree) == len(oracle.values)
+        for prefix in all_prefixes():
+            for limit in [None, 1, 2, 3, 4, 10]:
+                assert tree.autocomplete(prefix, limit) == \
+                    oracle.autocomplete(prefix, limit)
+    check_aggregates(tree)
+
+
+@pytest.mark.parametrize('tree_class', [SimplePrefixTree,
+                                        CompressedPrefixTree])
+def test_remove_everything(tree_class: type) -> None:
+    """Test that removing the empty prefix empties the tree, which can then
+    be used again.
+    """
+    tree = tree_class('average')
+    tree.insert('ab', 2, ['a', 'b'])
+    tree.insert('ac', 1, ['a', 'c'])
+    tree.remove([])
+    assert tree.is_empty() and len(tree) == 0 and tree.autocomplete([]) == []
+    tree.insert('b', 3, ['b'])
+    assert tree.autocomplete(['b']) == [('b', 3)]
+
+
+@pytest.mark.parametrize('tree_class', [SimplePrefixTree,
+                                        CompressedPrefixTree])
+def test_len(tree_class: type) -> None:
+    """Test that the len of the tree and of each of its subtrees is the
+    number of leaves below it, across inserts of new and existing values,
+    removes and decays.
+    """
+    rng = random.Random(7)
+    tree = tree_class('average')
+    for step, change in enumerate(random_changes(rng, 200)):
+        apply(change, tree)
+        if step % 50 == 0:
+            tree.decay(0.5)
+        stack = [tree]
+        while stack:
+            subtree = stack.pop()
+            leaves = 0
+            leaf_stack = [subtree]
+            while leaf_stack:
+                node = leaf_stack.pop()
+                leaves += node.is_leaf()
+                leaf_stack.extend(node.subtrees)
+            assert len(subtree) == leaves
+            stack.extend(subtree.subtrees)
+
+
+################################################################################
+# Deep trees and tree objects
+################################################################################
+@pytest.mark.parametrize('tree_class', [SimplePrefixTree,
+                                        CompressedPrefixTree])
+def test_deep_prefix(tree_class: type) -> None:
+    """Test that a tree with a prefix several times longer than the recursion
+    limit can be looked up, measured, printed, frozen, bulk built and
+    removed from.
+
+    Values branch off the long prefix at each of its first limit + 1
+    elements, so that a CompressedPrefixTree is deeper than the recursion
+    limit too.
+    """
+    limit = sys.getrecursionlimit()
+    long = ['x'] * (3 * limit)
+    items = [('long', 2, long)] + [(i, 1, long[:i] + ['#'])
+                                   for i in range(limit + 1)]
+    tree = tree_class('sum')
+    for value, weight, prefix in items:
+        tree.insert(value, weight, prefix)
+    expected = [('long', 2)] + [(i, 1) for i in range(limit + 1)]
+    assert len(tree) == limit + 2
+    assert tree.autocomplete([]) == expected
+    assert tree.autocomplete([], 3) == expected[:3]
+    assert tree.autocomplete(long[:limit]) == [('long', 2), (limit, 1)]
+    assert tree.autocomplete(long + ['x']) == []
+    assert str(tree).count('\n') > 3 * limit
+    frozen = tree.freeze()
+    assert frozen.autocomplete([]) == expected
+    assert frozen.autocomplete(long[:limit], 1) == [('long', 2)]
+    assert tree_class.from_items('sum', items).autocomplete([]) == expected
+    tree.remove(long[:limit // 2])
+    assert len(tree) == limit // 2
+    assert tree.autocomplete([]) == expected[1:limit // 2 + 1]
+
+
+@pytest.mark.parametrize('tree_class, prefixes', [
+    (SimplePrefixTree, [[], ['a'], ['a', 'b'], ['a', 'b', 'c'],
+                        ['a', 'b', 'd'], ['e']]),
+    (CompressedPrefixTree, [[], ['a', 'b'], ['a', 'b', 'c'],
+                            ['a', 'b', 'd'], ['e']])])
+def test_tree_objects(tree_class: type, prefixes: List[List]) -> None:
+    """Test that no tree object has a __dict__, and that the value of each
+    non-leaf tree is its whole prefix.
+    """
+    tree = tree_class('sum')
+    tree.insert('abc', 1, ['a', 'b', 'c'])
+    tree.insert('abd', 1, ['a', 'b', 'd'])
+    tree.insert('e', 1, ['e'])
+    found = []
+    stack = [tree]
+    while stack:
+        subtree = stack.pop()
+        assert not hasattr(subtree, '__dict__')
+        if not subtree.is_leaf():
+            found.append(subtree.value)
+            stack.extend(subtree.subtrees)
+    assert sorted(found) == prefixes
+
+
+################################################################################
+# Bulk building
+################################################################################
+@pytest.mark.parametrize('tree_class, weight_type, top_k', KINDS)
+def test_from_items(tree_class: type, weight_type: str, top_k: int) -> None:
+    """Test that from_items builds the tree inserting the items one by one
+    does, including how it breaks ties after further changes.
+    """
+    rng = random.Random(13)
+    items = [change[1:] for change in random_changes(rng, 200)
+             if change[0] == 'insert']
+    built = tree_class.from_items(weight_type, items, top_k)
+    inserted = tree_class(weight_type, top_k)
+    for value, weight, prefix in items:
+        inserted.insert(value, weight, prefix)
+    assert len(built) == len(inserted)
+    assert_same(built, inserted)
+    for change in random_changes(rng, 50):
+        apply(change, built, inserted)
+    assert_same(built, inserted)
+    check_aggregates(built)
+
+
+################################################################################
+# Freezing
+################################################################################
+@pytest.mark.parametrize('tree_class, weight_type, top_k', KINDS)
+def test_freeze_round_trip(tmp_path, tree_class: type, weight_type: str,
+                           top_k: int) -> None:
+    """Test that freezing, saving and loading, and thawing a tree keep its
+    matches in the same order.
+    """
+    rng = random.Random(10)
+    tree = tree_class(weight_type, top_k)
+    for change in random_changes(rng, 150):
+        apply(change, tree)
+    tree.decay(0.75)
+    frozen = tree.freeze()
+    assert len(frozen) == len(tree)
+    assert_same(frozen, tree)
+    frozen.save(str(tmp_path / 'tree.idx'))
+    loaded = FrozenPrefixTree.load(str(tmp_path / 'tree.idx'))
+    assert_same(loaded, tree)
+    thawed = loaded.thaw(tree_class)
+    assert_same(thawed, tree)
+    # The thawed tree breaks ties like the original after further changes.
+    for change in random_changes(rng, 50):
+        apply(change, tree, thawed)
+    assert_same(thawed, tree)
+
+
+def test_freeze_after_inexact_decay() -> None:
+    """Test that a tree decayed by a factor that rounds its weights is
+    frozen with its matches in the same order.
+    """
+    rng = random.Random(9)
+    tree = SimplePrefixTree('sum')
+    for i in range(300):
+        prefix = [rng.choice('abc') for _ in range(rng.randint(0, 3))]
+        tree.insert(i, 1 + rng.randint(0, 3) * 2.0 ** -52, prefix)
+    for _ in range(5):
+        tree.decay(0.9)
+        assert_same(tree.freeze(), tree)
+
+
+def test_freeze_read_only() -> None:
+    """Test that a frozen tree cannot be changed."""
+    tree = SimplePrefixTree('sum')
+    tree.insert('a', 1, ['a'])
+    frozen = tree.freeze()
+    with pytest.raises(TypeError):
+        frozen.insert('b', 1, ['b'])
+    with pytest.raises(TypeError):
+        frozen.remove([])
+    with pytest.raises(TypeError):
+        frozen.decay(0.5)
+    assert frozen.autocomplete([]) == [('a', 1)]
+
+
+################################################################################
+# Lazy, batched and incremental lookups
+################################################################################
+def random_tree(tree_class: type, weight_type: str, top_k: int,
+                seed: int) -> SimplePrefixTree:
+    """Return a <tree_class> after random changes made with seed <seed>."""
+    rng = random.Random(seed)
+    tree = tree_class(weight_type, top_k)
+    for change in random_changes(rng, 150):
+        apply(change, tree)
+    return tree
+
+
+@pytest.mark.parametrize('tree_class, weight_type, top_k', KINDS)
+def test_iter_autocomplete(tree_class: type, weight_type: str,
+                           top_k: int) -> None:
+    """Test that iter_autocomplete yields the matches autocomplete returns,
+    in the same order, on the tree and its frozen copy.
+    """
+    tree = random_tree(tree_class, weight_type, top_k, 15)
+    frozen = tree.freeze()
+    for prefix in all_prefixes(length=3) + [['d'], ['a', 'd']]:
+        expected = tree.autocomplete(prefix)
+        assert list(tree.iter_autocomplete(prefix)) == expected
+        assert list(frozen.iter_autocomplete(prefix)) == expected
+        first = itertools.islice(tree.iter_autocomplete(prefix), 3)
+        assert list(first) == expected[:3]
+
+
+@pytest.mark.parametrize('tree_class, weight_type, top_k', KINDS)
+def test_autocomplete_many(tree_class: type, weight_type: str,
+                           top_k: int) -> None:
+    """Test that autocomplete_many returns autocomplete's list for each
+    prefix, with repeated prefixes, prefixes that match nothing, and
+    prefixes that cannot be sorted together.
+    """
+    tree = random_tree(tree_class, weight_type, top_k, 16)
+    tree.insert('one', 1, [1])
+    frozen = tree.freeze()
+    rng = random.Random(16)
+    prefixes = [rng.choice(all_prefixes('abcd', 3)) for _ in range(40)]
+    for batch in [prefixes, prefixes + [[1], [[]]], []]:
+        for limit in [None, 1, 3]:
+            expected = [tree.autocomplete(prefix, limit) for prefix in batch]
+            assert tree.autocomplete_many(batch, limit) == expected
+            assert frozen.autocomplete_many(batch, limit) == expected
+
+
+@pytest.mark.parametrize('tree_class, weight_type, top_k', KINDS)
+def test_session(tree_class: type, weight_type: str, top_k: int) -> None:
+    """Test that a PrefixSession returns what autocomplete does for the
+    prefix typed so far, while elements are typed and deleted and the tree
+    is changed.
+    """
+    rng = random.Random(17)
+    tree = random_tree(tree_class, weight_type, top_k, 17)
+    session = PrefixSession(tree)
+    frozen_session = PrefixSession(tree.freeze())
+    frozen = tree.freeze()
+    for step in range(300):
+        if session.prefix and rng.random() < 0.4:
+            assert session.pop() == frozen_session.pop()
+        elif len(session.prefix) < 4:
+            element = rng.choice('abcd')
+            session.push(element)
+            frozen_session.push(element)
+        if step % 10 == 0:
+            apply(random_changes(rng, 1)[0], tree)
+        assert session.prefix == frozen_session.prefix
+        for limit in [None, 2]:
+            assert session.autocomplete(limit) == \
+                tree.autocomplete(session.prefix, limit)
+            assert frozen_session.autocomplete(limit) == \
+                frozen.autocomplete(session.prefix, limit)
+
+
+################################################################################
+# Caching
+################################################################################
+def test_cache() -> None:
+    """Test that a CachedAutocompleter returns what the oracle does while
+    the tree is changed, so no stale result is used.
+    """
+    rng = random.Random(18)
+    cached = CachedAutocompleter(SimplePrefixTree('sum', 2), 8)
+    oracle = Oracle()
+    prefixes = all_prefixes(length=3)
+    for step in range(1000):
+        if step % 10 == 0:
+            apply(random_changes(rng, 1)[0], cached, oracle)
+        elif step % 97 == 0:
+            cached.decay(0.5)
+            oracle.decay(0.5)
+        prefix = rng.choice(prefixes[:8])
+        limit = rng.choice([None, 2, 5])
+        assert cached.autocomplete(prefix, limit) == \
+            oracle.autocomplete(prefix, limit)
+    assert cached.hits > 0 and cached.evictions > 0
+    assert len(cached._results) <= 8
+
+
+def test_cache_ttl() -> None:
+    """Test that a cached result is not used once it has expired."""
+    cached = CachedAutocompleter(SimplePrefixTree('sum'), 8, ttl=0.05)
+    cached.insert('a', 1, ['a'])
+    assert cached.autocomplete(['a']) == [('a', 1)]
+    assert cached.autocomplete(['a']) == [('a', 1)]
+    assert cached.hits == 1
+    time.sleep(0.1)
+    assert cached.autocomplete(['a']) == [('a', 1)]
+    assert cached.hits == 1 and cached.misses == 2
+
+
+################################################################################
+# Concurrent reads
+################################################################################
+def test_concurrent_oracle() -> None:
+    """Test that a ConcurrentAutocompleter returns what the oracle does
+    after random changes.
+    """
+    rng = random.Random(19)
+    concurrent = ConcurrentAutocompleter(CompressedPrefixTree('average', 2),
+                                         CompressedPrefixTree('average', 2))
+    oracle = Oracle()
+    for change in random_changes(rng, 200):
+        apply(change, concurrent, oracle)
+    assert len(concurrent) == len(oracle.values)
+    for prefix in all_prefixes():
+        for limit in [None, 1, 3]:
+            assert concurrent.autocomplete(prefix, limit) == \
+                oracle.autocomplete(prefix, limit)
+
+
+def test_concurrent_reads() -> None:
+    """Test that readers in other threads see each insert either entirely
+    or not at all, and never see inserts disappear.
+    """
+    concurrent = ConcurrentAutocompleter(SimplePrefixTree('sum'),
+                                         SimplePrefixTree('sum'))
+    expected = [(f'z{i}', 1.0) for i in range(200)]
+    errors = []
+    done = threading.Event()
+
+    def read() -> None:
+        """Check the matches of ['z'] until the writer is done."""
+        seen = 0
+        while not done.is_set():
+            matches = concurrent.autocomplete(['z'])
+            if matches != expected[:len(matches)] or len(matches) < seen:
+                errors.append(matches)
+                return
+            seen = len(matches)
+
+    readers = [threading.Thread(target=read) for _ in range(3)]
+    for reader in readers:
+        reader.start()
+    for value, weight in expected:
+        concurrent.insert(value, weight, ['z', value])
+    done.set()
+    for reader in readers:
+        reader.join()
+    assert errors == []
+    assert concurrent.autocomplete(['z']) == expected
+
+
+################################################################################
+# Decay
+################################################################################
+@pytest.mark.parametrize('tree_class, weight_type, top_k', KINDS)
+def test_decay(tree_class: type, weight_type: str, top_k: int) -> None:
+    """Test that decay multiplies every weight, with inserts and removes in
+    between, including when the scale is folded into the stored weights.
+
+    The factors are powers of two, so the oracle's weights are exact.
+    """
+    rng = random.Random(22)
+    tree = tree_class(weight_type, top_k)
+    oracle = Oracle()
+    for step, change in enumerate(random_changes(rng, 200)):
+        apply(change, tree, oracle)
+        if step % 20 == 0:
+            factor = rng.choice([0.5, 2.0, 2.0 ** -40, 2.0 ** 40])
+            tree.decay(factor)
+            oracle.decay(factor)
+        for prefix in all_prefixes():
+            for limit in [None, 1, 3]:
+                assert tree.autocomplete(prefix, limit) == \
+                    oracle.autocomplete(prefix, limit)
+    check_aggregates(tree)
+
+
+def test_decay_rescale() -> None:
+    """Test that folding the scale into the stored weights keeps the
+    matches and their order.
+    """
+    tree = SimplePrefixTree('sum', 2)
+    tree.insert('a', 1, ['a'])
+    tree.insert('b', 3, ['b'])
+    tree.insert('c', 1, ['c'])
+    for _ in range(3):
+        tree.decay(2.0 ** -30)
+    assert tree._settings.scale == 1.0
+    unit = 2.0 ** -90
+    assert tree.autocomplete([]) == [('b', 3 * unit), ('a', unit),
+                                     ('c', unit)]
+    # 'a' now ties with 'b', and was inserted first.
+    tree.insert('a', 2 * unit, ['a'])
+    assert tree.autocomplete([], 1) == [('a', 3 * unit)]
+    assert tree.autocomplete([]) == [('a', 3 * unit), ('b', 3 * unit),
+                                     ('c', unit)]
+
+
+################################################################################
+# Fuzzy and approximate matching
+################################################################################
+def edit_distance(prefix: List, sequence: List) -> int:
+    """Return the fewest edits turning <prefix> into a prefix of
+    <sequence>.
+    """
+    row = list(range(len(sequence) + 1))
+    for i in range(len(prefix)):
+        new = [i + 1]
+        for j in range(len(sequence)):
+            new.append(min(row[j] + (prefix[i] != sequence[j]),
+                           row[j + 1] + 1, new[j] + 1))
+        row = new
+    return min(row)
+
+
+def scan(oracle: Oracle, distances: Dict[Any, float], within: int,
+         penalty: float) -> List[Tuple[Any, float]]:
+    """Return the values of <oracle> with a distance of at most <within> in
+    <distances>, ranked by weight times penalty ** distance, ties broken by
+    insertion order.
+    """
+    matches = [value for value in oracle.values if distances[value] <= within]
+    matches.sort(key=lambda value: (
+        -oracle.values[value][0] * penalty ** distances[value],
+        oracle.values[value][2]))
+    return [(value, oracle.values[value][0]) for value in matches]
+
+
+@pytest.mark.parametrize('tree_class, weight_type, top_k', KINDS)
+def test_fuzzy(tree_class: type, weight_type: str, top_k: int) -> None:
+    """Test fuzzy_autocomplete on the tree and its frozen copy against a scan
+    computing the edit distance of every value.
+    """
+    rng = random.Random(23)
+    tree = tree_class(weight_type, top_k)
+    oracle = Oracle()
+    for change in random_changes(rng, 150, 'abcd'):
+        apply(change, tree, oracle)
+    frozen = tree.freeze()
+    for _ in range(60):
+        prefix = [rng.choice('abcde') for _ in range(rng.randint(0, 4))]
+        distances = {value: edit_distance(prefix, sequence)
+                     for value, (_, sequence, _) in oracle.values.items()}
+        for distance in [0, 1, 2]:
+            expected = scan(oracle, distances, distance, 0.5)
+            for limit in [None, 1, 5]:
+                wanted = expected if limit is None else expected[:limit]
+                assert tree.fuzzy_autocomplete(prefix, distance, limit,
+                                               0.5) == wanted
+                assert frozen.fuzzy_autocomplete(prefix, distance, limit,
+                                                 0.5) == wanted
+        assert tree.fuzzy_autocomplete(prefix, 0) == tree.autocomplete(prefix)
+
+
+@pytest.mark.parametrize('tree_class, weight_type, top_k', KINDS)
+def test_approximate(tree_class: type, weight_type: str, top_k: int) -> None:
+    """Test approximate_autocomplete on the tree and its frozen copy against
+    a scan counting the mismatched elements of every value.
+    """
+    rng = random.Random(25)
+    tree = tree_class(weight_type, top_k)
+    oracle = Oracle()
+    for _ in range(150):
+        prefix = [rng.randint(-3, 3) for _ in range(rng.randint(0, 5))]
+        change = ('insert', tuple(prefix), rng.choice([1, 2, 3]), prefix)
+        apply(change, tree, oracle)
+    frozen = tree.freeze()
+    for _ in range(60):
+        prefix = [rng.randint(-4, 4) for _ in range(rng.randint(0, 4))]
+        for tolerance in [0, 1, 2]:
+            missed = {}
+            for value, (_, sequence, _) in oracle.values.items():
+                if len(sequence) < len(prefix):
+                    # Too short to match with any number of mismatches.
+                    missed[value] = float('inf')
+                else:
+                    missed[value] = sum(abs(a - b) > tolerance
+                                        for a, b in zip(prefix, sequence))
+            for mismatches in [0, 1, 2]:
+                expected = scan(oracle, missed, mismatches, 0.5)
+                for limit in [None, 1, 5]:
+                    wanted = expected if limit is None else expected[:limit]
+                    assert tree.approximate_autocomplete(
+                        prefix, tolerance, mismatches, limit, 0.5) == wanted
+                    assert frozen.approximate_autocomplete(
+                        prefix, tolerance, mismatches, limit, 0.5) == wanted
+        assert tree.approximate_autocomplete(prefix, 0) == \
+            tree.autocomplete(prefix)
+
+
+################################################################################
+# Infix matching
+################################################################################
+def contains(sequence: List, part: List) -> bool:
+    """Return whether <part> appears in <sequence> starting at some
+    element.
+    """
+    return any(sequence[i:i + len(part)] == part
+               for i in range(len(sequence)))
+
+
+@pytest.mark.parametrize('tree_class', [SimplePrefixTree,
+                                        CompressedPrefixTree])
+def test_infix_order(tree_class: type) -> None:
+    """Test that infix_autocomplete returns the values containing a prefix
+    in the order autocomplete returns them, ties included, across inserts,
+    removes and an inexact decay.
+    """
+    rng = random.Random(24)
+    tree = tree_class('sum')
+    for _ in range(30):
+        words = [rng.choice('abcd') for _ in range(rng.randint(1, 4))]
+        tree.insert(' '.join(words), rng.choice([1, 2]), words)
+    index = InfixIndex(tree, str.split, tree_class)
+    for step in range(60):
+        if step % 20 == 19:
+            index.decay(0.9)
+        elif rng.random() < 0.1:
+            index.remove([rng.choice('abcd')])
+        else:
+            words = [rng.choice('abcd') for _ in range(rng.randint(1, 4))]
+            index.insert(' '.join(words), rng.choice([1, 2]), words)
+        everything = index.autocomplete([])
+        for part in all_prefixes('abcd'):
+            expected = [(value, weight) for value, weight in everything
+                        if contains(value.split(), part)]
+            assert index.infix_autocomplete(part) == expected
+            assert index.infix_autocomplete(part, 2) == expected[:2]
+
+
+def test_infix_value_as_element() -> None:
+    """Test that a value equal to an element of another value's prefix
+    sequence is kept apart from it.
+    """
+    index = InfixIndex(SimplePrefixTree('sum'), list)
+    index.insert((1, 2), 2, [1, 2])
+    index.insert((0, 2, (1, 2), 3), 1, [0, 2, (1, 2), 3])
+    assert index.infix_autocomplete([2]) == [((1, 2), 2),
+                                             ((0, 2, (1, 2), 3), 1)]
+    index.remove([1])
+    assert index.infix_autocomplete([2]) == [((0, 2, (1, 2), 3), 1)]
+    assert index.infix_autocomplete([(1, 2), 3]) == [((0, 2, (1, 2), 3), 1)]
+
+
+def test_infix_frozen() -> None:
+    """Test that an InfixIndex over a frozen tree orders ties as the frozen
+    tree does.
+    """
+    rng = random.Random(240)
+    tree = CompressedPrefixTree('average')
+    for _ in range(100):
+        words = [rng.choice('abc') for _ in range(rng.randint(1, 4))]
+        tree.insert(' '.join(words), rng.choice([1, 2]), words)
+    tree.decay(0.9)
+    index = InfixIndex(tree.freeze(), str.split)
+    everything = tree.autocomplete([])
+    for part in all_prefixes():
+        assert index.infix_autocomplete(part) == \
+            [(value, weight) for value, weight in everything
+             if contains(value.split(), part)]
+
+
+################################################################################
+# Write-ahead logging
+################################################################################
+def test_log_recover(tmp_path) -> None:
+    """Test that recover redoes every logged change, in order."""
+    path = str(tmp_path / 'tree')
+    rng = random.Random(21)
+    oracle = Oracle()
+    logged = LoggedAutocompleter(SimplePrefixTree('sum'), path,
+                                 batch_size=7)
+    for change in random_changes(rng, 200):
+        apply(change, logged, oracle)
+    logged.decay(0.5)
+    oracle.decay(0.5)
+    logged.close()
+    recovered = LoggedAutocompleter.recover(path, CompressedPrefixTree)
+    for prefix in all_prefixes():
+        assert recovered.autocomplete(prefix) == oracle.autocomplete(prefix)
+
+
+def test_log_torn_record(tmp_path) -> None:
+    """Test that a partly written record at the end of a log is cut off, and
+    the records before it are redone.
+    """
+    path = str(tmp_path / 'tree')
+    logged = LoggedAutocompleter(SimplePrefixTree('sum'), path,
+                                 batch_size=1)
+    logged.insert('ab', 1, ['a', 'b'])
+    logged.insert('ac', 2, ['a', 'c'])
+    logged.close()
+    log = path + '.0.log'
+    size = os.path.getsize(log)
+    with open(log, 'r+b') as f:
+        f.truncate(size - 3)
+    recovered = LoggedAutocompleter.recover(path)
+    assert recovered.autocomplete([]) == [('ab', 1)]
+    assert os.path.getsize(log) < size - 3
+    # The log can be appended to again after the torn record.
+    logged = LoggedAutocompleter(recovered, path, batch_size=1)
+    logged.insert('b', 4, ['b'])
+    logged.close()
+    assert LoggedAutocompleter.recover(path).autocomplete([]) == \
+        [('b', 4), ('ab', 1)]
+
+
+def test_log_compact(tmp_path) -> None:
+    """Test that compact folds the log into a new snapshot, deletes the
+    older files, and keeps logging the changes made afterwards.
+    """
+    path = str(tmp_path / 'tree')
+    rng = random.Random(148)
+    oracle = Oracle()
+    logged = LoggedAutocompleter(CompressedPrefixTree('average'), path)
+    changes = random_changes(rng, 100)
+    for change in changes[:50]:
+        apply(change, logged, oracle)
+    logged.compact()
+    assert sorted(os.listdir(tmp_path)) == ['tree.1.log', 'tree.1.snapshot']
+    for change in changes[50:]:
+        apply(change, logged, oracle)
+    logged.close()
+    recovered = LoggedAutocompleter.recover(path, CompressedPrefixTree)
+    for prefix in all_prefixes():
+        assert recovered.autocomplete(prefix) == oracle.autocomplete(prefix)
+
+
+def test_log_idle_flush(tmp_path) -> None:
+    """Test that the changes of an idle logger reach the disk about
+    sync_interval seconds after the last flush, with no further change.
+    """
+    path = str(tmp_path / 'tree')
+    logged = LoggedAutocompleter(SimplePrefixTree('sum'), path,
+                                 sync_interval=0.05)
+    logged.insert('ab', 1, ['a', 'b'])
+    assert os.path.getsize(path + '.0.log') == 0
+    deadline = time.monotonic() + 2
+    while os.path.getsize(path + '.0.log') == 0 and \
+            time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert os.path.getsize(path + '.0.log') > 0
+    assert LoggedAutocompleter.recover(path).autocomplete([]) == [('ab', 1)]
+    logged.close()
+
+
+if __name__ == '__main__':
+    pytest.main(['test_prefix_tree.py'])
@@ -0,0 +1,64 @@
+"""CSC148 Assignment 2: Tests for text sanitization
+
+=== Module Description ===
+This file contains pytest tests for sanitize.py, comparing its functions
+with the original one-character-at-a-time sanitizer.
+"""
+from __future__ import annotations
+import random
+from typing import List, Optional
+
+from sanitize import sanitize, sanitize_checked, sanitize_lines
+
+# Strings mixing ASCII punctuation, spaces, digits, letters of both cases and
+# non-ASCII characters.
+SAMPLES = ['', ' ', '   ', '@@@@', '!%^^!#&#!^#&ur mom haha&$*# 7',
+           'WHerE Are U AT@#$*??', 'tab\there', 'Ünïcödé Straße 42',
+           'ǅemal İstanbul', '日本語 テキスト', '  ½ ² ⅷ  ', 'ok\n']
+
+
+def original_sanitize(string: str) -> str:
+    """Return <string> sanitized as the original sanitizer did."""
+    new_string = ''
+    for char in string:
+        if char.isalnum() or char == ' ':
+            new_string += char
+    return new_string.lower()
+
+
+def original_checked(string: str) -> Optional[str]:
+    """Return what sanitize_checked should for <string>."""
+    if any(char.isalnum() for char in string):
+        return original_sanitize(string)
+    return None
+
+
+def random_strings(rng: random.Random, count: int) -> List[str]:
+    """Return <count> random strings of characters from SAMPLES."""
+    characters = ''.join(SAMPLES)
+    return [''.join(rng.choice(characters)
+                    for _ in range(rng.randint(0, 12)))
+            for _ in range(count)]
+
+
+def test_sanitize() -> None:
+    """Test sanitize and sanitize_checked against the original sanitizer.
+    """
+    for string in SAMPLES + random_strings(random.Random(12), 500):
+        assert sanitize(string) == original_sanitize(string)
+        assert sanitize_checked(string) == original_checked(string)
+
+
+def test_sanitize_lines() -> None:
+    """Test that sanitize_lines keeps the sanitized lines that have an
+    alphanumeric character, for ASCII-only and mixed batches.
+    """
+    rng = random.Random(120)
+    ascii_lines = [line + '\n' for line in random_strings(rng, 200)
+                   if line.isascii() and '\n' not in line]
+    mixed_lines = [line + '\n' for line in random_strings(rng, 200)
+                   if '\n' not in line]
+    for lines in [ascii_lines, mixed_lines, []]:
+        expected = [original_checked(line.rstrip('\n')) for line in lines]
+        assert sanitize_lines(lines) == [line for line in expected
+                                         if line is not None]